@@ -0,0 +1,90 @@
+"""
+Servidor Ollama falso para benchmarks (POST /api/generate)
+
+Responde com as respostas simuladas de `mock_response.get_mock_response`,
+emitindo um "token" (palavra) a cada --token-ms depois de um prefill de
+--prefill-ms-por-token por token do prompt, em streaming ou não. Quando a
+requisição pede saída estruturada (campo "format"), devolve o mesmo conteúdo
+em JSON. Informa prompt_eval_count/eval_count como o Ollama real.
+
+Uso (a partir do diretório backend):
+    python benchmarks/fake_ollama.py --porta 11435 --token-ms 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_parser import process_llm_response
+from mock_response import get_mock_response
+
+app = FastAPI(title="Ollama falso")
+config = {"token_ms": 20.0, "prefill_ms_por_token": 0.2}
+_TOKEN = re.compile(r"\S+\s*|\s+")
+
+
+def _resposta(corpo: dict) -> str:
+    prompt = corpo.get("prompt", "")
+    sintomas = prompt.split("Sintomas do novo caso:")[-1].split("\n")[0]
+    texto = get_mock_response(sintomas)
+    if corpo.get("format"):
+        classificacao, justificativa, condutas = process_llm_response(texto)
+        texto = json.dumps({
+            "classificacao": classificacao.lower(),
+            "justificativa": justificativa,
+            "condutas": [linha.lstrip("- ").strip() for linha in condutas.splitlines() if linha.strip()],
+        }, ensure_ascii=False)
+    return texto
+
+
+def _contar_tokens_prompt(corpo: dict) -> int:
+    return len((corpo.get("system", "") + " " + corpo.get("prompt", "")).split())
+
+
+@app.post("/api/generate")
+async def generate(request: Request):
+    corpo = await request.json()
+    texto = _resposta(corpo)
+    tokens = _TOKEN.findall(texto)
+    prompt_tokens = _contar_tokens_prompt(corpo)
+    opcoes = corpo.get("options") or {}
+    if "num_predict" in opcoes:
+        tokens = tokens[:opcoes["num_predict"]]
+    final = {"done": True, "prompt_eval_count": prompt_tokens, "eval_count": len(tokens)}
+
+    await asyncio.sleep(prompt_tokens * config["prefill_ms_por_token"] / 1000)
+
+    if not corpo.get("stream", True):
+        await asyncio.sleep(len(tokens) * config["token_ms"] / 1000)
+        return JSONResponse({"model": corpo.get("model"), "response": "".join(tokens), **final})
+
+    async def fragmentos():
+        for token in tokens:
+            await asyncio.sleep(config["token_ms"] / 1000)
+            yield json.dumps({"model": corpo.get("model"), "response": token, "done": False}, ensure_ascii=False) + "\n"
+        yield json.dumps({"model": corpo.get("model"), "response": "", **final}) + "\n"
+
+    return StreamingResponse(fragmentos(), media_type="application/x-ndjson")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor Ollama falso para benchmarks")
+    parser.add_argument("--porta", type=int, default=11435)
+    parser.add_argument("--token-ms", type=float, default=20.0, help="Tempo por token gerado (ms)")
+    parser.add_argument("--prefill-ms-por-token", type=float, default=0.2, help="Tempo de prefill por token do prompt (ms)")
+    args = parser.parse_args()
+    config["token_ms"] = args.token_ms
+    config["prefill_ms_por_token"] = args.prefill_ms_por_token
+    uvicorn.run(app, host="127.0.0.1", port=args.porta, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
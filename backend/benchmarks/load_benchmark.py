@@ -0,0 +1,320 @@
+"""
+Benchmark de carga da API de triagem
+
+Sobe um Ollama falso (`fake_ollama.py`, com latência por token ajustável) e a
+API com embeddings stub (ou um modelo pequeno via EMBEDDING_MODEL), cada um
+em seu processo e com banco, índice vetorial e cache em um diretório
+temporário, e dispara uma mistura de `/api/triagem`, `/api/triagens`,
+`/api/validar` e `/api/estatisticas` com a concorrência pedida. Não precisa
+de rede nem de GPU.
+
+A pré-triagem por regras e o cache de embeddings ficam desligados na API
+(`--fast-path` e `--cache-embeddings` os ligam); respostas provisórias da
+pré-triagem, quando houver, são relatadas como `triagem_provisoria`.
+
+Relata p50/p95/p99 por operação, vazão, pico de memória (RSS) do processo da
+API e o tempo médio por etapa lido de `/metrics`, e grava tudo em JSON em
+`benchmarks/resultados/` para comparar entre commits (`--comparar`).
+
+Uso (a partir do diretório backend):
+    python benchmarks/load_benchmark.py --concorrencia 8 --requisicoes 400 --token-ms 10
+    python benchmarks/load_benchmark.py --comparar benchmarks/resultados/anterior.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTADOS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "resultados")
+
+SINTOMAS = [
+    "Paciente com febre alta há dois dias e dor no corpo",
+    "Dor torácica em aperto irradiando para o braço esquerdo, sudorese",
+    "Dor leve no joelho após caminhada, sem edema",
+    "Consulta de rotina para renovação de receita de anti-hipertensivo",
+    "Criança com vômitos persistentes e febre alta desde ontem",
+    "Cefaleia moderada há 3 dias, sem alteração neurológica",
+    "Tosse seca e coriza há 5 dias, sem falta de ar",
+    "Paciente inconsciente encontrado em via pública",
+    "Dispneia grave com uso de musculatura acessória",
+    "Corte superficial na mão, sangramento controlado",
+]
+
+OPERACOES = ("triagem", "triagens", "validar", "estatisticas")
+# Triagens respondidas na hora pela pré-triagem por regras (sem o LLM) são
+# relatadas à parte, para não misturar com as idas ao LLM
+OPERACOES_RELATADAS = OPERACOES + ("triagem_provisoria",)
+
+
+def percentil(valores: List[float], p: float) -> Optional[float]:
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+
+def parse_mix(texto: str) -> Dict[str, float]:
+    mix = {}
+    for parte in texto.split(","):
+        nome, _, peso = parte.partition("=")
+        if nome.strip() not in OPERACOES:
+            raise SystemExit(f"Operação desconhecida no --mix: {nome}")
+        mix[nome.strip()] = float(peso or 1)
+    return mix
+
+
+def rss_pico_mb(pid: int) -> Optional[float]:
+    """Pico de memória residente do processo (VmHWM, Linux)"""
+    try:
+        with open(f"/proc/{pid}/status") as arquivo:
+            for linha in arquivo:
+                if linha.startswith("VmHWM:"):
+                    return round(int(linha.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def commit_atual() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def etapas_do_servidor(texto_metricas: str) -> Dict[str, float]:
+    """Tempo médio (ms) por etapa a partir de triagem_stage_seconds"""
+    somas: Dict[str, float] = {}
+    contagens: Dict[str, float] = {}
+    for nome, etapa, valor in re.findall(r'^triagem_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', texto_metricas, re.MULTILINE):
+        (somas if nome == "sum" else contagens)[etapa] = float(valor)
+    return {etapa: round(somas[etapa] / contagens[etapa] * 1000, 2) for etapa in somas if contagens.get(etapa)}
+
+
+async def aguardar_pronto(client: httpx.AsyncClient, url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise SystemExit(f"Timeout aguardando {url}")
+
+
+class Carga:
+    def __init__(self, client: httpx.AsyncClient, mix: Dict[str, float], semente: int):
+        self.client = client
+        self.rng = random.Random(semente)
+        self.nomes = list(mix)
+        self.pesos = [mix[nome] for nome in self.nomes]
+        self.latencias: Dict[str, List[float]] = {nome: [] for nome in OPERACOES_RELATADAS}
+        self.erros: Dict[str, int] = {nome: 0 for nome in OPERACOES_RELATADAS}
+        self.pendentes_validacao: List[str] = []
+
+    async def _executar(self, operacao: str) -> str:
+        if operacao == "validar" and not self.pendentes_validacao:
+            operacao = "triagem"
+        inicio = time.perf_counter()
+        try:
+            if operacao == "triagem":
+                resposta = await self.client.post("/api/triagem", json={"sintomas": self.rng.choice(SINTOMAS)})
+                if resposta.status_code == 200:
+                    corpo = resposta.json()
+                    self.pendentes_validacao.append(corpo["id"])
+                    if corpo.get("provisoria"):
+                        operacao = "triagem_provisoria"
+            elif operacao == "triagens":
+                resposta = await self.client.get("/api/triagens", params={"limite": 50, "projecao": "resumo"})
+            elif operacao == "validar":
+                triagem_id = self.pendentes_validacao.pop(self.rng.randrange(len(self.pendentes_validacao)))
+                resposta = await self.client.post("/api/validar", json={"triagem_id": triagem_id, "validado_por": "benchmark", "feedback": "ok"})
+            else:
+                resposta = await self.client.get("/api/estatisticas")
+            ok = resposta.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            self.latencias[operacao].append(time.perf_counter() - inicio)
+        else:
+            self.erros[operacao] += 1
+        return operacao
+
+    async def rodar(self, concorrencia: int, requisicoes: int) -> float:
+        restantes = requisicoes
+
+        async def trabalhador():
+            nonlocal restantes
+            while restantes > 0:
+                restantes -= 1
+                await self._executar(self.rng.choices(self.nomes, self.pesos)[0])
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabalhador() for _ in range(concorrencia)))
+        return time.perf_counter() - inicio
+
+
+def resumir(carga: Carga, duracao: float) -> Dict[str, Any]:
+    operacoes = {}
+    for nome in OPERACOES_RELATADAS:
+        latencias = carga.latencias[nome]
+        if not latencias and not carga.erros[nome]:
+            continue
+        operacoes[nome] = {
+            "ok": len(latencias),
+            "erros": carga.erros[nome],
+            "p50_ms": round(percentil(latencias, 50) * 1000, 2) if latencias else None,
+            "p95_ms": round(percentil(latencias, 95) * 1000, 2) if latencias else None,
+            "p99_ms": round(percentil(latencias, 99) * 1000, 2) if latencias else None,
+            "media_ms": round(sum(latencias) / len(latencias) * 1000, 2) if latencias else None,
+            "vazao_rps": round(len(latencias) / duracao, 2),
+        }
+    total = sum(op["ok"] for op in operacoes.values())
+    return {"duracao_s": round(duracao, 2), "vazao_rps": round(total / duracao, 2), "operacoes": operacoes}
+
+
+def comparar(atual: Dict[str, Any], anterior_path: str) -> None:
+    with open(anterior_path, encoding="utf-8") as arquivo:
+        anterior = json.load(arquivo)
+    print(f"\nComparação com {anterior.get('commit')} ({anterior_path}):")
+    for nome, op in atual["operacoes"].items():
+        antes = anterior.get("operacoes", {}).get(nome)
+        if not antes or not op["p95_ms"] or not antes.get("p95_ms"):
+            continue
+        delta = (op["p95_ms"] - antes["p95_ms"]) / antes["p95_ms"] * 100
+        print(f"  {nome:<18} p95 {antes['p95_ms']:>9.1f} -> {op['p95_ms']:>9.1f} ms ({delta:+.1f}%)")
+    if anterior.get("vazao_rps"):
+        delta = (atual["vazao_rps"] - anterior["vazao_rps"]) / anterior["vazao_rps"] * 100
+        print(f"  vazão             {anterior['vazao_rps']:>9.2f} -> {atual['vazao_rps']:>9.2f} req/s ({delta:+.1f}%)")
+
+
+def iniciar_processos(args, diretorio: str) -> List[subprocess.Popen]:
+    ollama = subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, "benchmarks", "fake_ollama.py"),
+         "--porta", str(args.porta_ollama), "--token-ms", str(args.token_ms),
+         "--prefill-ms-por-token", str(args.prefill_ms_por_token)],
+        cwd=BACKEND_DIR
+    )
+    ambiente = {
+        **os.environ,
+        "OLLAMA_BASE_URL": f"http://127.0.0.1:{args.porta_ollama}",
+        "EMBEDDING_BACKEND": args.embedder,
+        "DB_PATH": os.path.join(diretorio, "validacao_triagem.db"),
+        "CHROMA_PATH": os.path.join(diretorio, "chroma_db"),
+        "EMBEDDING_CACHE_PATH": os.path.join(diretorio, "embedding_cache.db"),
+        "WARMUP_WAIT_TIMEOUT": "120",
+        # Por padrão toda triagem passa pelo embedding e pelo LLM: a
+        # pré-triagem por regras responde na hora (e completa depois, fora da
+        # medição) e o cache de embeddings sobre poucos textos fixos
+        # esconderia o custo do embedding
+        "FAST_PATH": "1" if args.fast_path else "0",
+        "EMBEDDING_CACHE": "1" if args.cache_embeddings else "0",
+    }
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.porta_api),
+         "--workers", "1", "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR,
+        env=ambiente
+    )
+    return [ollama, api]
+
+
+async def executar(args) -> Dict[str, Any]:
+    processos: List[subprocess.Popen] = []
+    url = args.url
+    with tempfile.TemporaryDirectory(prefix="triagem-bench-") as diretorio:
+        try:
+            if url is None:
+                processos = iniciar_processos(args, diretorio)
+                url = f"http://127.0.0.1:{args.porta_api}"
+            limites = httpx.Limits(max_connections=args.concorrencia, max_keepalive_connections=args.concorrencia)
+            async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limites) as client:
+                await aguardar_pronto(client, "/health/ready", args.timeout_inicio)
+                carga = Carga(client, parse_mix(args.mix), args.semente)
+                duracao = await carga.rodar(args.concorrencia, args.requisicoes)
+                resultado = resumir(carga, duracao)
+                resultado["etapas_servidor_ms"] = etapas_do_servidor((await client.get("/metrics")).text)
+            resultado["rss_pico_api_mb"] = rss_pico_mb(processos[1].pid) if processos else None
+        finally:
+            for processo in processos:
+                processo.terminate()
+            for processo in processos:
+                try:
+                    processo.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    processo.kill()
+
+    return {
+        "data": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": commit_atual(),
+        "config": {
+            "concorrencia": args.concorrencia,
+            "requisicoes": args.requisicoes,
+            "mix": args.mix,
+            "token_ms": args.token_ms,
+            "prefill_ms_por_token": args.prefill_ms_por_token,
+            "embedder": args.embedder,
+            "fast_path": args.fast_path,
+            "cache_embeddings": args.cache_embeddings,
+            "semente": args.semente,
+        },
+        **resultado,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga da API de triagem")
+    parser.add_argument("--concorrencia", type=int, default=8)
+    parser.add_argument("--requisicoes", type=int, default=200, help="Total de operações")
+    parser.add_argument("--mix", default="triagem=6,triagens=2,validar=1,estatisticas=1", help="Pesos das operações")
+    parser.add_argument("--token-ms", type=float, default=10.0, help="Latência por token do Ollama falso (ms)")
+    parser.add_argument("--prefill-ms-por-token", type=float, default=0.2, help="Latência de prefill por token do prompt (ms)")
+    parser.add_argument("--embedder", choices=["stub", "model"], default="stub", help="stub (sem torch) ou o modelo de EMBEDDING_MODEL")
+    parser.add_argument("--fast-path", action="store_true", help="Liga a pré-triagem por regras na API (desligada por padrão)")
+    parser.add_argument("--cache-embeddings", action="store_true", help="Liga o cache de embeddings na API (desligado por padrão)")
+    parser.add_argument("--semente", type=int, default=0)
+    parser.add_argument("--porta-api", type=int, default=8765)
+    parser.add_argument("--porta-ollama", type=int, default=11435)
+    parser.add_argument("--url", help="Usa uma API já em execução em vez de subir os processos")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Timeout por requisição (s)")
+    parser.add_argument("--timeout-inicio", type=float, default=300.0, help="Tempo máximo para a API ficar pronta (s)")
+    parser.add_argument("--saida", help="Arquivo JSON de resultado (padrão: benchmarks/resultados/<data>_<commit>.json)")
+    parser.add_argument("--comparar", help="Resultado anterior para comparar p95 e vazão")
+    args = parser.parse_args()
+
+    resultado = asyncio.run(executar(args))
+
+    print(f"\n{'operação':<18} {'ok':>6} {'erros':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+    for nome, op in resultado["operacoes"].items():
+        colunas = [f"{op[chave]:>9.1f}" if op[chave] is not None else f"{'-':>9}" for chave in ("p50_ms", "p95_ms", "p99_ms")]
+        print(f"{nome:<18} {op['ok']:>6} {op['erros']:>6} {' '.join(colunas)} {op['vazao_rps']:>8.2f}")
+    print(f"vazão total: {resultado['vazao_rps']} req/s em {resultado['duracao_s']} s; pico de RSS da API: {resultado['rss_pico_api_mb']} MB")
+    print(f"etapas no servidor (ms, média): {resultado['etapas_servidor_ms']}")
+
+    saida = args.saida
+    if saida is None:
+        os.makedirs(RESULTADOS_DIR, exist_ok=True)
+        saida = os.path.join(RESULTADOS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{resultado['commit'] or 'sem-commit'}.json")
+    with open(saida, "w", encoding="utf-8") as arquivo:
+        json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+    print(f"Resultado salvo em {saida}")
+
+    if args.comparar:
+        comparar(resultado, args.comparar)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Micro-benchmark e fuzzing dos parsers de resposta do LLM
+
+Mede o custo por resposta do parser heurístico (`process_llm_response`) e do
+parser estruturado (`parse_structured_response`) sobre o corpus
+`parser_corpus.jsonl`, confere as classificações esperadas e, em seguida,
+aplica mutações aleatórias (truncamento, inserção, remoção e troca de
+caracteres) às respostas do corpus para verificar que nenhum dos parsers
+lança exceção e que o parser estruturado só aceita cores válidas.
+
+Uso (a partir do diretório backend):
+    python benchmarks/parser_benchmark.py --repeticoes 2000 --mutacoes 20000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_parser import CORES, parse_structured_response, process_llm_response
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_corpus.jsonl")
+FRAGMENTOS = ['"', "{", "}", "[", "]", ",", ":", "\\", "\n", "Condutas", "Justificativa", "verde", "vermelho", "ç", "\ufeff"]
+
+
+def carregar_corpus(path: str = CORPUS_PATH):
+    with open(path, encoding="utf-8") as arquivo:
+        return [json.loads(linha) for linha in arquivo if linha.strip()]
+
+
+def cronometrar(parser, respostas, repeticoes: int) -> float:
+    """Tempo médio (µs) por resposta"""
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        for resposta in respostas:
+            parser(resposta)
+    return (time.perf_counter() - inicio) / (repeticoes * len(respostas)) * 1e6
+
+
+def conferir(corpus):
+    """Compara cada parser com a classificação esperada no corpus"""
+    erros = []
+    for i, caso in enumerate(corpus):
+        esperado = caso["classificacao"]
+        if caso["formato"] == "json":
+            resultado = parse_structured_response(caso["resposta"])
+            obtido = resultado[0] if resultado else None
+            if obtido != esperado:
+                erros.append(f"#{i} estruturado: esperado {esperado}, obtido {obtido}")
+        else:
+            obtido = process_llm_response(caso["resposta"])[0]
+            if obtido != esperado:
+                erros.append(f"#{i} heurístico: esperado {esperado}, obtido {obtido}")
+    return erros
+
+
+def mutar(texto: str, rng: random.Random) -> str:
+    for _ in range(rng.randint(1, 4)):
+        operacao = rng.randrange(4)
+        pos = rng.randint(0, len(texto))
+        if operacao == 0:
+            texto = texto[:pos]
+        elif operacao == 1:
+            texto = texto[:pos] + rng.choice(FRAGMENTOS) + texto[pos:]
+        elif operacao == 2:
+            texto = texto[:pos] + texto[pos + rng.randint(1, 8):]
+        elif texto:
+            texto = texto[:pos] + chr(rng.randint(0x20, 0x2FF)) + texto[pos + 1:]
+    return texto
+
+
+def fuzz(corpus, mutacoes: int, semente: int):
+    rng = random.Random(semente)
+    falhas = []
+    aceitas = 0
+    for _ in range(mutacoes):
+        texto = mutar(rng.choice(corpus)["resposta"], rng)
+        for nome, parser in (("heurístico", process_llm_response), ("estruturado", parse_structured_response)):
+            try:
+                resultado = parser(texto)
+            except Exception as e:
+                falhas.append(f"{nome}: {type(e).__name__}: {e!r} em {texto[:80]!r}")
+                continue
+            if nome == "estruturado" and resultado is not None:
+                aceitas += 1
+                if resultado[0] not in CORES:
+                    falhas.append(f"estruturado aceitou cor inválida {resultado[0]!r}")
+    return aceitas, falhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark e fuzzing dos parsers de resposta do LLM")
+    parser.add_argument("--repeticoes", type=int, default=2000)
+    parser.add_argument("--mutacoes", type=int, default=20000)
+    parser.add_argument("--semente", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = carregar_corpus()
+    textos = [caso["resposta"] for caso in corpus if caso["formato"] == "texto"]
+    jsons = [caso["resposta"] for caso in corpus if caso["formato"] == "json" and caso["classificacao"]]
+
+    print(f"Corpus: {len(corpus)} respostas ({len(textos)} texto livre, {len(jsons)} JSON válidas)")
+    print(f"heurístico sobre texto livre:  {cronometrar(process_llm_response, textos, args.repeticoes):8.2f} µs/resposta")
+    print(f"estruturado sobre JSON:        {cronometrar(parse_structured_response, jsons, args.repeticoes):8.2f} µs/resposta")
+
+    # Divergências do heurístico são limitações conhecidas (ex.: uma cor citada
+    # na justificativa); só as do parser estruturado contam como erro
+    divergencias = conferir(corpus)
+    for divergencia in divergencias:
+        print(f"Divergência {divergencia}")
+    erros = [d for d in divergencias if "estruturado" in d]
+
+    aceitas, falhas = fuzz(corpus, args.mutacoes, args.semente)
+    print(f"Fuzz: {args.mutacoes} mutações, {aceitas} aceitas pelo parser estruturado, {len(falhas)} falhas")
+    for falha in falhas[:20]:
+        print(f"  {falha}")
+
+    sys.exit(1 if erros or falhas else 0)
+
+
+if __name__ == "__main__":
+    main()
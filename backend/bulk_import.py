@@ -0,0 +1,247 @@
+"""
+Importação em massa de triagens históricas já validadas (CSV ou JSONL)
+
+O arquivo é lido em streaming, em blocos de IMPORT_CHUNK_SIZE registros.
+Cada bloco é gravado no SQLite em uma transação (ids já existentes são
+ignorados) e em seguida embedado em lotes e enviado ao ChromaDB com upsert.
+Depois de cada bloco um checkpoint registra quantos registros do arquivo já
+foram processados; rodar o comando de novo continua de onde parou. A memória
+usada depende só do tamanho do bloco, não do arquivo.
+
+Colunas/campos reconhecidos: `sintomas` (obrigatório), `resposta` ou
+`classificacao` + `justificativa` + `condutas`, e opcionalmente `id`,
+`data_hora`, `validado_por`, `data_validacao` e `feedback`.
+
+Uso (a partir do diretório backend, de preferência com a API parada):
+    python bulk_import.py historico.csv
+    python bulk_import.py historico.jsonl --lote 512 --validado-por "importacao"
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+from dotenv import load_dotenv
+
+# Carrega o .env antes dos módulos que leem a configuração na importação
+load_dotenv()
+
+import database
+import embedding
+import vector_index
+from llm_parser import parse_llm_response
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "256"))
+
+# Namespace dos ids gerados para registros sem `id`: o mesmo registro gera
+# sempre o mesmo id, então reimportar um arquivo não duplica linhas
+_NAMESPACE_IMPORTACAO = uuid.UUID("5b0f4c3e-3d1a-4f7e-9a53-7f1f2b8c6d21")
+
+
+def ler_registros(path: str, formato: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Lê o arquivo registro a registro
+
+    Args:
+        path: Caminho do arquivo CSV ou JSONL
+        formato: "csv" ou "jsonl" (deduzido da extensão se None)
+    """
+    formato = formato or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, encoding="utf-8", newline="") as arquivo:
+        if formato == "csv":
+            yield from csv.DictReader(arquivo)
+        else:
+            for linha in arquivo:
+                if linha.strip():
+                    yield json.loads(linha)
+
+
+def _montar_resposta(classificacao: str, justificativa: str, condutas: str) -> str:
+    return f"Classificação\n{classificacao.lower()}\n\nJustificativa\n{justificativa}\n\nCondutas\n{condutas}"
+
+
+def _texto(registro: Dict[str, Any], campo: str) -> str:
+    """
+    Valor do campo como texto: no JSONL pode vir como número (ex.: `id`),
+    null ou, nas condutas, como lista (um item por linha)
+    """
+    valor = registro.get(campo)
+    if valor is None:
+        return ""
+    if isinstance(valor, list):
+        return "\n".join(str(item).strip() for item in valor if item is not None)
+    return str(valor).strip()
+
+
+def registro_para_triagem(registro: Dict[str, Any], validado_por: str) -> Optional[Dict[str, Any]]:
+    """
+    Converte um registro do arquivo em uma linha de `validacao_triagem`
+
+    Returns:
+        Dict[str, Any]: A triagem validada, ou None se faltar sintomas ou
+        resposta (ou se a linha do JSONL não for um objeto)
+    """
+    if not isinstance(registro, dict):
+        return None
+    sintomas = _texto(registro, "sintomas")
+    resposta = _texto(registro, "resposta")
+    classificacao = _texto(registro, "classificacao").upper()
+    justificativa = _texto(registro, "justificativa")
+    condutas = _texto(registro, "condutas")
+    if not sintomas or not (resposta or classificacao):
+        return None
+
+    if not resposta:
+        resposta = _montar_resposta(classificacao, justificativa, condutas)
+    elif not classificacao:
+        classificacao, justificativa, condutas = parse_llm_response(resposta, structured=resposta.startswith("{"))
+
+    data_hora = _texto(registro, "data_hora") or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    triagem_id = _texto(registro, "id") or str(
+        uuid.uuid5(_NAMESPACE_IMPORTACAO, f"{sintomas}\x00{resposta}\x00{data_hora}")
+    )
+    return {
+        "id": triagem_id,
+        "sintomas": sintomas,
+        "resposta": resposta,
+        "data_hora": data_hora,
+        "feedback": _texto(registro, "feedback") or None,
+        "validado_por": _texto(registro, "validado_por") or validado_por,
+        "data_validacao": _texto(registro, "data_validacao") or data_hora,
+        "classificacao": classificacao,
+        "justificativa": justificativa,
+        "condutas": condutas,
+    }
+
+
+class Checkpoint:
+    """
+    Progresso da importação de um arquivo, gravado em JSON ao lado dele
+
+    O checkpoint só vale para o mesmo arquivo (nome e tamanho); caso
+    contrário a importação recomeça do início.
+    """
+
+    def __init__(self, arquivo: str, path: Optional[str] = None):
+        self.arquivo = os.path.abspath(arquivo)
+        self.path = path or f"{arquivo}.checkpoint.json"
+        self.tamanho = os.path.getsize(arquivo)
+        self.processados = 0
+
+    def load(self) -> int:
+        try:
+            with open(self.path, encoding="utf-8") as arquivo:
+                dados = json.load(arquivo)
+        except (OSError, ValueError):
+            return 0
+        if dados.get("arquivo") == self.arquivo and dados.get("tamanho") == self.tamanho:
+            self.processados = int(dados.get("processados", 0))
+        return self.processados
+
+    def save(self, processados: int) -> None:
+        self.processados = processados
+        temporario = f"{self.path}.tmp"
+        with open(temporario, "w", encoding="utf-8") as arquivo:
+            json.dump({
+                "arquivo": self.arquivo,
+                "tamanho": self.tamanho,
+                "processados": processados,
+                "atualizado_em": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            }, arquivo)
+        os.replace(temporario, self.path)
+
+    def clear(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def importar(path: str, collection, chunk_size: int = IMPORT_CHUNK_SIZE, checkpoint: Optional[Checkpoint] = None,
+             formato: Optional[str] = None, validado_por: str = "importacao") -> Dict[str, Any]:
+    """
+    Importa o arquivo para o SQLite e o ChromaDB em blocos
+
+    Returns:
+        Dict[str, Any]: Registros lidos, importados (novos no banco), indexados,
+        inválidos, duração e vazão
+    """
+    checkpoint = checkpoint or Checkpoint(path)
+    inicio_arquivo = checkpoint.load()
+    if inicio_arquivo:
+        print(f"Retomando após {inicio_arquivo} registros já processados")
+
+    registros = itertools.islice(ler_registros(path, formato), inicio_arquivo, None)
+    estatisticas = {"lidos": 0, "importados": 0, "indexados": 0, "invalidos": 0}
+    inicio = time.perf_counter()
+
+    while True:
+        bloco = list(itertools.islice(registros, max(1, chunk_size)))
+        if not bloco:
+            break
+        triagens = [t for t in (registro_para_triagem(r, validado_por) for r in bloco) if t is not None]
+        estatisticas["lidos"] += len(bloco)
+        estatisticas["invalidos"] += len(bloco) - len(triagens)
+        if triagens:
+            estatisticas["importados"] += database.importar_triagens_validadas(triagens)
+            estatisticas["indexados"] += vector_index.index_cases(collection, [t["id"] for t in triagens])
+        checkpoint.save(inicio_arquivo + estatisticas["lidos"])
+
+        decorrido = time.perf_counter() - inicio
+        print(
+            f"{inicio_arquivo + estatisticas['lidos']} registros processados "
+            f"({estatisticas['importados']} novos, {estatisticas['indexados']} indexados) - "
+            f"{estatisticas['lidos'] / decorrido:.1f} registros/s"
+        )
+
+    duracao = time.perf_counter() - inicio
+    checkpoint.clear()
+    return {
+        **estatisticas,
+        "duracao_s": round(duracao, 2),
+        "registros_por_s": round(estatisticas["lidos"] / duracao, 1) if duracao > 0 else 0.0,
+        # ru_maxrss vem em KB no Linux
+        "pico_memoria_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) if resource else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa triagens históricas validadas (CSV ou JSONL)")
+    parser.add_argument("arquivo", help="Arquivo CSV ou JSONL")
+    parser.add_argument("--formato", choices=["csv", "jsonl"], help="Formato do arquivo (padrão: pela extensão)")
+    parser.add_argument("--lote", type=int, default=IMPORT_CHUNK_SIZE, help="Registros por bloco")
+    parser.add_argument("--checkpoint", help="Arquivo de checkpoint (padrão: <arquivo>.checkpoint.json)")
+    parser.add_argument("--recomecar", action="store_true", help="Ignora o checkpoint e importa desde o início")
+    parser.add_argument("--validado-por", default="importacao", help="Validador registrado quando o arquivo não informa")
+    args = parser.parse_args()
+
+    database.init_validation_db()
+    if not embedding.load_model():
+        raise SystemExit("Model not loaded")
+
+    import chromadb
+    chroma_client = chromadb.PersistentClient(path=vector_index.CHROMA_PATH)
+    vector_index.init_index_table()
+    collection = vector_index.open_collection(chroma_client)
+
+    checkpoint = Checkpoint(args.arquivo, args.checkpoint)
+    if args.recomecar:
+        checkpoint.clear()
+
+    resultado = importar(args.arquivo, collection, args.lote, checkpoint, args.formato, args.validado_por)
+    for chave, valor in resultado.items():
+        print(f"{chave}: {valor}")
+
+
+if __name__ == "__main__":
+    main()
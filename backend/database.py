@@ -1,12 +1,107 @@
+import base64
+import json
+import os
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 import uuid
-from typing import List, Dict, Any, Optional, Tuple
+from pathlib import Path
+from typing import Iterator, List, Dict, Any, Optional, Tuple
 
-# Database initialization
-def init_validation_db():
-    conn = sqlite3.connect('./validacao_triagem.db')
-    cursor = conn.cursor()
+import metrics
+
+DB_PATH = os.getenv("DB_PATH", './validacao_triagem.db')
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+TRIAGENS_PAGE_SIZE = int(os.getenv("TRIAGENS_PAGE_SIZE", "100"))
+TRIAGENS_MAX_PAGE_SIZE = int(os.getenv("TRIAGENS_MAX_PAGE_SIZE", "500"))
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))
+
+# Pragmas applied to every pooled connection. WAL lets readers run alongside
+# a writer; synchronous=NORMAL is durable across application crashes in WAL
+# mode and avoids an fsync per commit.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+)
+
+# Connection pool
+class ConnectionPool:
+    """
+    Small pool of SQLite connections shared across threads
+
+    Connections are created on demand up to `size`; callers beyond that
+    wait for one to be returned.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = max(1, size)
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        inicio = time.perf_counter()
+        conn = self._acquire()
+        metrics.DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - inicio)
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def close_all(self) -> None:
+        with self._lock:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                self._created -= 1
+
+pool = ConnectionPool(DB_PATH, DB_POOL_SIZE)
+
+def get_connection():
+    """
+    Borrow a pooled connection: `with get_connection() as conn: ...`
+    """
+    return pool.connection()
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version
+def _migracao_tabela_base(cursor):
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS validacao_triagem (
         id TEXT PRIMARY KEY,
@@ -19,104 +114,407 @@ def init_validation_db():
         data_validacao TEXT
     )
     ''')
-    conn.commit()
-    conn.close()
 
-# Save triage for validation
-def salvar_para_validacao(sintomas: str, resposta: str) -> str:
-    conn = sqlite3.connect('./validacao_triagem.db')
-    cursor = conn.cursor()
-    triagem_id = str(uuid.uuid4())
-    data_hora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def _migracao_colunas_resposta(cursor):
+    cursor.execute("PRAGMA table_info(validacao_triagem)")
+    colunas = {row[1] for row in cursor.fetchall()}
+    for coluna in ("classificacao", "justificativa", "condutas"):
+        if coluna not in colunas:
+            cursor.execute(f"ALTER TABLE validacao_triagem ADD COLUMN {coluna} TEXT")
+
+def _migracao_indices(cursor):
+    # Listagens filtram por validado e ordenam por data_hora
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_validacao_validado_data ON validacao_triagem (validado, data_hora)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_validacao_data ON validacao_triagem (data_hora)")
+
+def _migracao_indices_keyset(cursor):
+    # Paginação por (data_hora, id): o id entra no índice para desempatar
+    cursor.execute("DROP INDEX IF EXISTS idx_validacao_validado_data")
+    cursor.execute("DROP INDEX IF EXISTS idx_validacao_data")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_validacao_validado_data_id ON validacao_triagem (validado, data_hora, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_validacao_data_id ON validacao_triagem (data_hora, id)")
+
+# Counter and rollup tables kept up to date by triggers. Each one is keyed by
+# SQL expressions over the triage row and stores total and validated counts.
+_CHAVE_CLASSIFICACAO = "COALESCE({linha}.classificacao, '')"
+CONTADORES = {
+    "estatisticas_classificacao": {"classificacao": _CHAVE_CLASSIFICACAO},
+    "triagens_por_hora": {"periodo": "substr({linha}.data_hora, 1, 13)", "classificacao": _CHAVE_CLASSIFICACAO},
+    "triagens_por_dia": {"periodo": "substr({linha}.data_hora, 1, 10)", "classificacao": _CHAVE_CLASSIFICACAO},
+}
+
+def _atualizar_contador_sql(tabela: str, chaves: Dict[str, str], linha: str, sinal: str) -> str:
+    colunas = ", ".join(chaves)
+    valores = ", ".join(expressao.format(linha=linha) for expressao in chaves.values())
+    return (
+        f"INSERT INTO {tabela} ({colunas}, total, validadas) "
+        f"VALUES ({valores}, {sinal}1, {sinal}(COALESCE({linha}.validado, 0) = 1)) "
+        f"ON CONFLICT ({colunas}) DO UPDATE SET total = total + excluded.total, validadas = validadas + excluded.validadas;"
+    )
+
+def _migracao_contadores(cursor):
+    for tabela, chaves in CONTADORES.items():
+        colunas = ", ".join(chaves)
+        definicoes = ", ".join(f"{coluna} TEXT NOT NULL" for coluna in chaves)
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {tabela} (
+            {definicoes},
+            total INTEGER NOT NULL DEFAULT 0,
+            validadas INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY ({colunas})
+        )
+        """)
+        # Backfill from the rows that already exist
+        expressoes = ", ".join(expressao.format(linha="validacao_triagem") for expressao in chaves.values())
+        cursor.execute(f"DELETE FROM {tabela}")
+        cursor.execute(f"""
+        INSERT INTO {tabela} ({colunas}, total, validadas)
+        SELECT {expressoes}, COUNT(*), SUM(COALESCE(validado, 0) = 1)
+        FROM validacao_triagem GROUP BY {expressoes}
+        """)
+
+    novos = "\n".join(_atualizar_contador_sql(t, c, "NEW", "+") for t, c in CONTADORES.items())
+    antigos = "\n".join(_atualizar_contador_sql(t, c, "OLD", "-") for t, c in CONTADORES.items())
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_contadores_insert AFTER INSERT ON validacao_triagem BEGIN\n{novos}\nEND")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_contadores_delete AFTER DELETE ON validacao_triagem BEGIN\n{antigos}\nEND")
     cursor.execute(
-        "INSERT INTO validacao_triagem (id, sintomas, resposta, data_hora) VALUES (?, ?, ?, ?)",
-        (triagem_id, sintomas, str(resposta), data_hora)
+        "CREATE TRIGGER IF NOT EXISTS trg_contadores_update AFTER UPDATE OF validado, classificacao, data_hora "
+        f"ON validacao_triagem BEGIN\n{antigos}\n{novos}\nEND"
     )
-    conn.commit()
-    conn.close()
-    return triagem_id
+
+def _migracao_provisoria(cursor):
+    # Triagens classificadas pela pré-triagem por regras enquanto o LLM não respondeu
+    cursor.execute("PRAGMA table_info(validacao_triagem)")
+    if "provisoria" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE validacao_triagem ADD COLUMN provisoria INTEGER NOT NULL DEFAULT 0")
+
+def _migracao_indice_provisoria(cursor):
+    # Varredura das triagens provisórias que não foram completadas
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_validacao_provisoria ON validacao_triagem (data_hora) WHERE provisoria = 1")
+
+def _migracao_reclamacao_provisoria(cursor):
+    # Processo que está completando a triagem provisória (com vários workers da API)
+    cursor.execute("PRAGMA table_info(validacao_triagem)")
+    if "reclamada_em" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE validacao_triagem ADD COLUMN reclamada_em TEXT")
+
+MIGRATIONS = [
+    _migracao_tabela_base,
+    _migracao_colunas_resposta,
+    _migracao_indices,
+    _migracao_indices_keyset,
+    _migracao_contadores,
+    _migracao_provisoria,
+    _migracao_indice_provisoria,
+    _migracao_reclamacao_provisoria,
+]
+
+# Database initialization
+def init_validation_db():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # Vários processos (workers da API, processo de embeddings) iniciam ao
+        # mesmo tempo: o lock de escrita serializa as migrações e a versão é
+        # lida de novo dentro dele, então cada migração roda uma única vez
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("PRAGMA user_version")
+        versao = cursor.fetchone()[0]
+        for numero, migracao in enumerate(MIGRATIONS[versao:], start=versao + 1):
+            migracao(cursor)
+            cursor.execute(f"PRAGMA user_version = {numero}")
+        conn.commit()
+
+# Build a new triage row (id and timestamp are assigned here, before it is written)
+def nova_triagem(sintomas: str, resposta: str, classificacao: str = "", justificativa: str = "", condutas: str = "", provisoria: bool = False) -> Dict[str, Any]:
+    return {
+        "id": str(uuid.uuid4()),
+        "sintomas": sintomas,
+        "resposta": str(resposta),
+        "data_hora": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "classificacao": classificacao,
+        "justificativa": justificativa,
+        "condutas": condutas,
+        "provisoria": int(provisoria)
+    }
+
+# Insert several triage rows in a single transaction
+def inserir_triagens(triagens: List[Dict[str, Any]]) -> None:
+    with get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO validacao_triagem (id, sintomas, resposta, data_hora, classificacao, justificativa, condutas, provisoria) "
+            "VALUES (:id, :sintomas, :resposta, :data_hora, :classificacao, :justificativa, :condutas, :provisoria)",
+            triagens
+        )
+        conn.commit()
+
+# Save triage for validation
+def salvar_para_validacao(sintomas: str, resposta: str, classificacao: str = "", justificativa: str = "", condutas: str = "", provisoria: bool = False) -> str:
+    triagem = nova_triagem(sintomas, resposta, classificacao, justificativa, condutas, provisoria)
+    inserir_triagens([triagem])
+    return triagem["id"]
+
+# Insert already validated triages (bulk import); rows whose id already exists are skipped
+def importar_triagens_validadas(triagens: List[Dict[str, Any]]) -> int:
+    with get_connection() as conn:
+        cursor = conn.executemany(
+            "INSERT OR IGNORE INTO validacao_triagem "
+            "(id, sintomas, resposta, data_hora, validado, feedback, validado_por, data_validacao, classificacao, justificativa, condutas) "
+            "VALUES (:id, :sintomas, :resposta, :data_hora, 1, :feedback, :validado_por, :data_validacao, :classificacao, :justificativa, :condutas)",
+            triagens
+        )
+        conn.commit()
+        # rowcount soma só as linhas inseridas (ignora as atualizações dos triggers)
+        return cursor.rowcount
+
+# Replace a provisional classification with the full LLM result
+def atualizar_resultado_triagem(triagem_id: str, resposta: str, classificacao: str, justificativa: str, condutas: str) -> bool:
+    with get_connection() as conn:
+        cursor = conn.execute(
+            "UPDATE validacao_triagem SET resposta = ?, classificacao = COALESCE(?, classificacao), justificativa = ?, condutas = ?, provisoria = 0 WHERE id = ?",
+            (str(resposta), classificacao, justificativa, condutas, triagem_id)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+
+# Provisional triages still waiting for the full LLM result and not claimed
+# by any process (or whose claim expired), oldest first
+def listar_triagens_provisorias(criadas_ate: str, reclamadas_ate: str, limite: int = 50) -> List[Dict[str, Any]]:
+    with get_connection() as conn:
+        linhas = conn.execute(
+            "SELECT id, sintomas, classificacao FROM validacao_triagem "
+            "WHERE provisoria = 1 AND data_hora <= ? AND (reclamada_em IS NULL OR reclamada_em <= ?) "
+            "ORDER BY data_hora LIMIT ?",
+            (criadas_ate, reclamadas_ate, limite)
+        ).fetchall()
+    return [{"id": linha[0], "sintomas": linha[1], "classificacao": linha[2]} for linha in linhas]
+
+# Atomically claim a provisional triage: only one process (API worker) gets it
+# until it is completed, released or the claim expires
+def reclamar_triagem_provisoria(triagem_id: str, reclamadas_ate: str) -> bool:
+    agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with get_connection() as conn:
+        cursor = conn.execute(
+            "UPDATE validacao_triagem SET reclamada_em = ? "
+            "WHERE id = ? AND provisoria = 1 AND (reclamada_em IS NULL OR reclamada_em <= ?)",
+            (agora, triagem_id, reclamadas_ate)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+
+# Release a claim after giving up, so that the next sweep (in any process) retries it
+def liberar_triagem_provisoria(triagem_id: str) -> None:
+    with get_connection() as conn:
+        conn.execute("UPDATE validacao_triagem SET reclamada_em = NULL WHERE id = ? AND provisoria = 1", (triagem_id,))
+        conn.commit()
 
 # Load validated cases
 def carregar_casos_validados() -> List[Tuple[str, str]]:
     try:
-        conn = sqlite3.connect('./validacao_triagem.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT sintomas, resposta FROM validacao_triagem WHERE validado = 1")
-        casos = cursor.fetchall()
-        conn.close()
-        return casos
+        with get_connection() as conn:
+            cursor = conn.execute("SELECT sintomas, resposta FROM validacao_triagem WHERE validado = 1")
+            return cursor.fetchall()
     except Exception as e:
         print(f"Error loading validated cases: {e}")
         return []
 
+def _triagem_para_dict(triagem) -> Dict[str, Any]:
+    return {
+        "id": triagem[0],
+        "sintomas": triagem[1],
+        "resposta": triagem[2],
+        "data_hora": triagem[3],
+        "validado": triagem[4],
+        "feedback": triagem[5],
+        "validado_por": triagem[6],
+        "data_validacao": triagem[7]
+    }
+
 # Get all triages with optional filter
 def obter_triagens(filtro: str = "todas") -> List[Dict[str, Any]]:
-    conn = sqlite3.connect('./validacao_triagem.db')
-    cursor = conn.cursor()
-    
     query = "SELECT id, sintomas, resposta, data_hora, validado, feedback, validado_por, data_validacao FROM validacao_triagem"
-    
+
     if filtro == "pendentes":
         query += " WHERE validado = 0"
     elif filtro == "validadas":
         query += " WHERE validado = 1"
-        
+
     query += " ORDER BY data_hora DESC"
-    
-    cursor.execute(query)
-    triagens = cursor.fetchall()
-    conn.close()
-    
-    result = []
-    for triagem in triagens:
-        result.append({
-            "id": triagem[0],
-            "sintomas": triagem[1],
-            "resposta": triagem[2],
-            "data_hora": triagem[3],
-            "validado": triagem[4],
-            "feedback": triagem[5],
-            "validado_por": triagem[6],
-            "data_validacao": triagem[7]
-        })
-    
-    return result
+
+    with get_connection() as conn:
+        triagens = conn.execute(query).fetchall()
+
+    return [_triagem_para_dict(triagem) for triagem in triagens]
+
+# Column projections for paginated listings: the summary leaves out the large
+# text columns (raw LLM answer, justification, conducts and feedback)
+COLUNAS_RESUMO = ("id", "sintomas", "data_hora", "validado", "validado_por", "data_validacao", "classificacao", "provisoria")
+COLUNAS_COMPLETAS = COLUNAS_RESUMO + ("resposta", "feedback", "justificativa", "condutas")
+PROJECOES = {"resumo": COLUNAS_RESUMO, "completa": COLUNAS_COMPLETAS}
+
+def codificar_cursor(data_hora: str, triagem_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([data_hora, triagem_id]).encode("utf-8")).decode("ascii")
+
+def decodificar_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        data_hora, triagem_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(data_hora), str(triagem_id)
+    except Exception:
+        raise ValueError("Cursor inválido")
+
+# Get one page of triages (keyset pagination on data_hora, id)
+def obter_pagina_triagens(filtro: str = "todas", limite: int = TRIAGENS_PAGE_SIZE, cursor: Optional[str] = None, projecao: str = "completa") -> Dict[str, Any]:
+    """
+    Lista triagens da mais recente para a mais antiga, uma página por vez
+
+    Args:
+        filtro: "todas", "pendentes" ou "validadas"
+        limite: Tamanho da página (limitado a TRIAGENS_MAX_PAGE_SIZE)
+        cursor: Valor de `proximo_cursor` da página anterior
+        projecao: "resumo" (sem colunas de texto longas) ou "completa"
+
+    Returns:
+        Dict[str, Any]: As triagens da página e o cursor da próxima, ou None na última
+
+    Raises:
+        ValueError: Se o cursor ou a projeção forem inválidos
+    """
+    if projecao not in PROJECOES:
+        raise ValueError("Projeção inválida")
+    colunas = PROJECOES[projecao]
+    limite = max(1, min(limite, TRIAGENS_MAX_PAGE_SIZE))
+
+    condicoes = []
+    parametros: List[Any] = []
+    if filtro == "pendentes":
+        condicoes.append("validado = 0")
+    elif filtro == "validadas":
+        condicoes.append("validado = 1")
+    if cursor:
+        condicoes.append("(data_hora, id) < (?, ?)")
+        parametros.extend(decodificar_cursor(cursor))
+
+    query = f"SELECT {', '.join(colunas)} FROM validacao_triagem"
+    if condicoes:
+        query += " WHERE " + " AND ".join(condicoes)
+    query += " ORDER BY data_hora DESC, id DESC LIMIT ?"
+    # Uma linha a mais indica se existe próxima página
+    parametros.append(limite + 1)
+
+    with get_connection() as conn:
+        linhas = conn.execute(query, parametros).fetchall()
+
+    triagens = [dict(zip(colunas, linha)) for linha in linhas[:limite]]
+    proximo_cursor = None
+    if len(linhas) > limite:
+        ultima = triagens[-1]
+        proximo_cursor = codificar_cursor(ultima["data_hora"], ultima["id"])
+
+    return {"triagens": triagens, "proximo_cursor": proximo_cursor}
+
+# Stream triages for export from a dedicated read-only connection
+def exportar_triagens(validado: Optional[bool] = None, inicio: Optional[str] = None, fim: Optional[str] = None,
+                      classificacao: Optional[str] = None, tamanho_lote: int = EXPORT_FETCH_SIZE) -> Iterator[List[Tuple]]:
+    """
+    Percorre as triagens em ordem cronológica, um lote de linhas por vez
+
+    Usa uma conexão própria (fora do pool) e um único cursor, então uma
+    exportação longa não ocupa conexões da API e a memória fica limitada ao
+    lote. As linhas seguem a ordem de COLUNAS_COMPLETAS.
+
+    Args:
+        validado: Só validadas (True) ou só pendentes (False); todas se None
+        inicio: Data/hora inicial, inclusiva (prefixo de "YYYY-MM-DD HH:MM:SS")
+        fim: Data/hora final, inclusiva (ex.: "2024-05-31" inclui o dia inteiro)
+        classificacao: Cor da triagem, ou "SEM_CLASSIFICACAO"
+        tamanho_lote: Linhas lidas do cursor por vez
+    """
+    condicoes = []
+    parametros: List[Any] = []
+    if validado is not None:
+        condicoes.append("validado = ?")
+        parametros.append(1 if validado else 0)
+    if inicio:
+        condicoes.append("data_hora >= ?")
+        parametros.append(inicio)
+    if fim:
+        condicoes.append("data_hora <= ?")
+        # Completa o prefixo com o maior instante possível
+        parametros.append(fim + "9999-12-31 23:59:59"[len(fim):])
+    if classificacao:
+        if classificacao.upper() == "SEM_CLASSIFICACAO":
+            condicoes.append("(classificacao IS NULL OR classificacao = '')")
+        else:
+            condicoes.append("classificacao = ?")
+            parametros.append(classificacao.upper())
+
+    query = f"SELECT {', '.join(COLUNAS_COMPLETAS)} FROM validacao_triagem"
+    if condicoes:
+        query += " WHERE " + " AND ".join(condicoes)
+    query += " ORDER BY data_hora, id"
+
+    conn = sqlite3.connect(
+        f"{Path(DB_PATH).resolve().as_uri()}?mode=ro",
+        uri=True,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False
+    )
+    try:
+        cursor = conn.execute(query, parametros)
+        while True:
+            linhas = cursor.fetchmany(max(1, tamanho_lote))
+            if not linhas:
+                break
+            yield linhas
+    finally:
+        conn.close()
 
 # Get a specific triage by ID
 def obter_triagem(triagem_id: str) -> Optional[Dict[str, Any]]:
-    conn = sqlite3.connect('./validacao_triagem.db')
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM validacao_triagem WHERE id = ?", (triagem_id,))
-    triagem = cursor.fetchone()
-    conn.close()
-    
+    with get_connection() as conn:
+        triagem = conn.execute(
+            "SELECT id, sintomas, resposta, data_hora, validado, feedback, validado_por, data_validacao, classificacao, justificativa, condutas, provisoria FROM validacao_triagem WHERE id = ?",
+            (triagem_id,)
+        ).fetchone()
+
     if triagem:
-        return {
-            "id": triagem[0],
-            "sintomas": triagem[1],
-            "resposta": triagem[2],
-            "data_hora": triagem[3],
-            "validado": triagem[4],
-            "feedback": triagem[5],
-            "validado_por": triagem[6],
-            "data_validacao": triagem[7]
-        }
-    
+        resultado = _triagem_para_dict(triagem)
+        resultado.update({
+            "classificacao": triagem[8],
+            "justificativa": triagem[9],
+            "condutas": triagem[10],
+            "provisoria": triagem[11]
+        })
+        return resultado
+
     return None
 
+# Same shape as obter_triagem for a row built by nova_triagem and not yet written
+def triagem_nao_gravada(triagem: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": triagem["id"],
+        "sintomas": triagem["sintomas"],
+        "resposta": triagem["resposta"],
+        "data_hora": triagem["data_hora"],
+        "validado": 0,
+        "feedback": None,
+        "validado_por": None,
+        "data_validacao": None,
+        "classificacao": triagem["classificacao"],
+        "justificativa": triagem["justificativa"],
+        "condutas": triagem["condutas"],
+        "provisoria": triagem["provisoria"]
+    }
+
 # Validate a triage
 def validar_triagem(triagem_id: str, validado_por: str, feedback: str) -> bool:
     try:
-        conn = sqlite3.connect('./validacao_triagem.db')
-        cursor = conn.cursor()
         data_validacao = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute(
-            "UPDATE validacao_triagem SET validado = 1, feedback = ?, validado_por = ?, data_validacao = ? WHERE id = ?",
-            (feedback, validado_por, data_validacao, triagem_id)
-        )
-        conn.commit()
-        conn.close()
+        with get_connection() as conn:
+            conn.execute(
+                "UPDATE validacao_triagem SET validado = 1, feedback = ?, validado_por = ?, data_validacao = ? WHERE id = ?",
+                (feedback, validado_por, data_validacao, triagem_id)
+            )
+            conn.commit()
         return True
     except Exception as e:
         print(f"Error validating triage: {e}")
@@ -125,34 +523,83 @@ def validar_triagem(triagem_id: str, validado_por: str, feedback: str) -> bool:
 # Delete a triage
 def excluir_triagem(triagem_id: str) -> bool:
     try:
-        conn = sqlite3.connect('./validacao_triagem.db')
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM validacao_triagem WHERE id = ?", (triagem_id,))
-        conn.commit()
-        conn.close()
+        with get_connection() as conn:
+            conn.execute("DELETE FROM validacao_triagem WHERE id = ?", (triagem_id,))
+            conn.commit()
         return True
     except Exception as e:
         print(f"Error deleting triage: {e}")
         return False
 
-# Get statistics
-def obter_estatisticas() -> Dict[str, int]:
+# Get statistics (read from the trigger-maintained counters)
+def obter_estatisticas() -> Dict[str, Any]:
     try:
-        conn = sqlite3.connect('./validacao_triagem.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM validacao_triagem")
-        total = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM validacao_triagem WHERE validado = 1")
-        validadas = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM validacao_triagem WHERE validado = 0")
-        pendentes = cursor.fetchone()[0]
-        conn.close()
-        
+        with get_connection() as conn:
+            linhas = conn.execute(
+                "SELECT classificacao, total, validadas FROM estatisticas_classificacao WHERE total > 0"
+            ).fetchall()
+
+        total = sum(linha[1] for linha in linhas)
+        validadas = sum(linha[2] for linha in linhas)
         return {
             "total": total,
             "validadas": validadas,
-            "pendentes": pendentes
+            "pendentes": total - validadas,
+            "por_classificacao": {
+                classificacao or "SEM_CLASSIFICACAO": {
+                    "total": total_cor,
+                    "validadas": validadas_cor,
+                    "pendentes": total_cor - validadas_cor
+                }
+                for classificacao, total_cor, validadas_cor in linhas
+            }
         }
     except Exception as e:
         print(f"Error getting statistics: {e}")
-        return {"total": 0, "validadas": 0, "pendentes": 0}
\ No newline at end of file
+        return {"total": 0, "validadas": 0, "pendentes": 0, "por_classificacao": {}}
+
+# Get triage volume over time (hourly or daily rollups)
+def obter_serie_estatisticas(granularidade: str = "dia", inicio: Optional[str] = None, fim: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Volume de triagens e distribuição de cores por período
+
+    Args:
+        granularidade: "hora" (períodos "YYYY-MM-DD HH") ou "dia" ("YYYY-MM-DD")
+        inicio: Primeiro período incluído (opcional)
+        fim: Último período incluído (opcional)
+
+    Returns:
+        List[Dict[str, Any]]: Um item por período e classificação, em ordem cronológica
+
+    Raises:
+        ValueError: Se a granularidade for inválida
+    """
+    tabelas = {"hora": "triagens_por_hora", "dia": "triagens_por_dia"}
+    if granularidade not in tabelas:
+        raise ValueError("Granularidade inválida")
+
+    condicoes = ["total > 0"]
+    parametros: List[Any] = []
+    if inicio:
+        condicoes.append("periodo >= ?")
+        parametros.append(inicio)
+    if fim:
+        condicoes.append("periodo <= ?")
+        parametros.append(fim)
+
+    query = (
+        f"SELECT periodo, classificacao, total, validadas FROM {tabelas[granularidade]} "
+        f"WHERE {' AND '.join(condicoes)} ORDER BY periodo, classificacao"
+    )
+    with get_connection() as conn:
+        linhas = conn.execute(query, parametros).fetchall()
+
+    return [
+        {
+            "periodo": periodo,
+            "classificacao": classificacao or "SEM_CLASSIFICACAO",
+            "total": total,
+            "validadas": validadas
+        }
+        for periodo, classificacao, total, validadas in linhas
+    ]
@@ -1,50 +1,400 @@
-import torch
-from transformers import AutoTokenizer, AutoModel
+import argparse
+import hashlib
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
 from typing import List, Optional
 
-# Define the device (GPU if available, otherwise CPU)
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+import metrics
+from embedding_cache import EmbeddingCache, EMBEDDING_CACHE_ENABLED
+
+MODEL_NAME = os.getenv("EMBEDDING_MODEL", "pucpr/biobertpt-clin")
+MODEL_REVISION = os.getenv("EMBEDDING_MODEL_REVISION", "main")
+EMBEDDING_MAX_LENGTH = 512
+# Tamanho máximo de um micro-lote e tempo máximo que a primeira requisição
+# espera por outras antes do forward pass
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "16"))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+# Modo de inferência: fp32 (padrão), int8 (quantização dinâmica das camadas
+# lineares, só CPU) ou bf16 (quando o hardware suporta)
+INFERENCE_MODES = ("fp32", "int8", "bf16")
+EMBEDDING_INFERENCE_MODE = os.getenv("EMBEDDING_INFERENCE_MODE", "fp32").lower()
+# Threads intra-op do PyTorch (0 mantém o padrão da biblioteca)
+EMBEDDING_NUM_THREADS = int(os.getenv("EMBEDDING_NUM_THREADS", "0"))
+# "model" usa o modelo de embeddings; "stub" gera vetores determinísticos por
+# hashing de palavras, sem torch/transformers (benchmarks e desenvolvimento)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "model").lower()
+EMBEDDING_STUB_DIM = 768
+# Identifica o espaço vetorial produzido: vetores de assinaturas diferentes
+# não devem ser misturados no cache nem no índice
+if EMBEDDING_BACKEND == "stub":
+    MODEL_SIGNATURE = f"stub:{EMBEDDING_STUB_DIM}"
+else:
+    MODEL_SIGNATURE = f"{MODEL_NAME}@{MODEL_REVISION}:{EMBEDDING_INFERENCE_MODE}"
+
+# torch/transformers are imported on first use so that importing this module
+# stays cheap; see _import_backend
+torch = None
+AutoTokenizer = None
+AutoModel = None
+device = None
 
 # Global variables for tokenizer and model
 tokenizer = None
 model = None
+inference_mode = EMBEDDING_INFERENCE_MODE
+
+# Cliente do processo de embeddings (embedding_worker.WorkerClient); quando
+# definido, os vetores vêm dele e o modelo não é carregado neste processo
+remote_client = None
+
+# Cache de embeddings (memória + disco), chaveado por modelo, revisão e modo
+# de inferência (vetores int8/bf16 não são intercambiáveis com os fp32)
+if not EMBEDDING_CACHE_ENABLED:
+    cache = None
+elif EMBEDDING_BACKEND == "stub":
+    cache = EmbeddingCache("stub", str(EMBEDDING_STUB_DIM))
+else:
+    cache = EmbeddingCache(MODEL_NAME, f"{MODEL_REVISION}:{EMBEDDING_INFERENCE_MODE}")
+
+# Serializa tokenização e forward passes entre o micro-batcher, chamadas em
+# lote, o indexador online e a sincronização do índice
+_forward_lock = threading.Lock()
+
+def _import_backend() -> None:
+    global torch, AutoTokenizer, AutoModel, device
+    if torch is not None:
+        return
+    import torch as _torch
+    from transformers import AutoTokenizer as _AutoTokenizer, AutoModel as _AutoModel
+
+    if EMBEDDING_NUM_THREADS > 0:
+        _torch.set_num_threads(EMBEDDING_NUM_THREADS)
+    # Define the device (GPU if available, otherwise CPU)
+    device = _torch.device("cuda" if _torch.cuda.is_available() else "cpu")
+    AutoTokenizer = _AutoTokenizer
+    AutoModel = _AutoModel
+    torch = _torch
+
+def _bf16_supported() -> bool:
+    try:
+        a = torch.ones((2, 2), dtype=torch.bfloat16, device=device)
+        torch.matmul(a, a)
+        return True
+    except Exception:
+        return False
+
+def _build_model(mode: str):
+    """
+    Load the embedding model configured for the given inference mode
+    """
+    base = AutoModel.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+    base.eval()
+    if mode == "int8":
+        if device.type != "cpu":
+            raise ValueError("int8 dynamic quantization is only available on CPU")
+        return torch.quantization.quantize_dynamic(base, {torch.nn.Linear}, dtype=torch.qint8)
+    if mode == "bf16":
+        if not _bf16_supported():
+            raise ValueError("bf16 is not supported on this device")
+        return base.to(device=device, dtype=torch.bfloat16)
+    return base.to(device)
 
 def load_model():
     """
     Load the tokenizer and model for text embedding
     """
-    global tokenizer, model
+    global tokenizer, model, inference_mode
+    if EMBEDDING_BACKEND == "stub":
+        tokenizer = model = "stub"
+        return True
     try:
-        tokenizer = AutoTokenizer.from_pretrained("pucpr/biobertpt-clin")
-        model = AutoModel.from_pretrained("pucpr/biobertpt-clin")
-        model = model.to(device)
+        _import_backend()
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, revision=MODEL_REVISION)
+        if EMBEDDING_INFERENCE_MODE not in INFERENCE_MODES:
+            raise ValueError(f"Unknown inference mode: {EMBEDDING_INFERENCE_MODE}")
+        model = _build_model(EMBEDDING_INFERENCE_MODE)
+        inference_mode = EMBEDDING_INFERENCE_MODE
         return True
     except Exception as e:
         print(f"Error loading model: {e}")
         return False
 
+def _stub_vector(text: str) -> List[float]:
+    """
+    Vetor determinístico por hashing das palavras: textos com palavras em
+    comum ficam próximos, como no modelo real, sem nenhum custo de inferência
+    """
+    vetor = [0.0] * EMBEDDING_STUB_DIM
+    for palavra in text.lower().split():
+        digest = hashlib.blake2b(palavra.encode("utf-8"), digest_size=8).digest()
+        indice = int.from_bytes(digest[:4], "little") % EMBEDDING_STUB_DIM
+        vetor[indice] += 1.0 if digest[4] & 1 else -1.0
+    norma = math.sqrt(sum(v * v for v in vetor)) or 1.0
+    return [v / norma for v in vetor]
+
+def _forward(texts: List[str], target_model=None) -> List[List[float]]:
+    """
+    Run a single forward pass over a batch, padding only to its longest sequence
+
+    Args:
+        texts: The texts in the batch
+        target_model: Model to run (defaults to the loaded one)
+
+    Returns:
+        List[List[float]]: The CLS vector of each text, in input order
+    """
+    metrics.EMBEDDING_BATCH_SIZE.observe(len(texts))
+    if EMBEDDING_BACKEND == "stub":
+        return [_stub_vector(text) for text in texts]
+    target_model = target_model or model
+    # O tokenizer rápido do HF não é thread-safe com truncation/padding
+    # ("Already borrowed"): tokeniza dentro do mesmo lock do forward
+    with _forward_lock, torch.inference_mode():
+        inputs = tokenizer(
+            texts,
+            return_tensors="pt",
+            padding="longest",
+            truncation=True,
+            max_length=EMBEDDING_MAX_LENGTH
+        ).to(device)
+        outputs = target_model(**inputs)
+        embeddings = outputs.last_hidden_state[:, 0, :]
+    return embeddings.float().cpu().numpy().tolist()
+
+class MicroBatcher:
+    """
+    Collects concurrent embedding requests into dynamic micro-batches
+
+    The first request of a batch waits at most `max_wait_ms` for others to
+    arrive; the batch is run as soon as it reaches `max_batch_size` or the
+    wait expires, and each caller receives its own CLS vector.
+    """
+
+    def __init__(self, max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE, max_wait_ms: float = EMBEDDING_MAX_WAIT_MS):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, text: str) -> Future:
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _ensure_started(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Recoloca o sinal de parada para depois deste lote
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            try:
+                vectors = _forward([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+batcher = MicroBatcher()
+
+def _ensure_model() -> bool:
+    if tokenizer is None or model is None:
+        return load_model()
+    return True
+
 def embed_text(text: str) -> Optional[List[float]]:
     """
     Convert text to embedding vector
-    
+
     Args:
         text: The text to convert to embedding
-        
+
     Returns:
         List[float]: The embedding vector, or None if there was an error
     """
-    global tokenizer, model
-    
-    if tokenizer is None or model is None:
-        if not load_model():
-            return None
-    
+    if cache is not None:
+        vector = cache.get(text)
+        if vector is not None:
+            return vector
+
+    if remote_client is None and not _ensure_model():
+        return None
+
     try:
-        inputs = tokenizer(text, return_tensors="pt", padding=True, truncation=True, max_length=512).to(device)
-        with torch.no_grad():
-            outputs = model(**inputs)
-            embeddings = outputs.last_hidden_state[:, 0, :]
-        return embeddings.cpu().numpy()[0].tolist()
+        if remote_client is not None:
+            vector = remote_client.embed([text])[0]
+        else:
+            vector = batcher.submit(text).result()
+        if cache is not None:
+            cache.put(text, vector)
+        return vector
     except Exception as e:
         print(f"Error embedding text: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def embed_texts(texts: List[str], batch_size: Optional[int] = None) -> Optional[List[List[float]]]:
+    """
+    Convert a list of texts to embedding vectors for bulk work
+
+    Cached texts are served from the embedding cache; the remaining ones are
+    sorted by length before batching so each batch is padded as little as
+    possible. Results are returned in the original order.
+
+    Args:
+        texts: The texts to convert to embeddings
+        batch_size: Texts per forward pass (defaults to EMBEDDING_MAX_BATCH_SIZE)
+
+    Returns:
+        List[List[float]]: One embedding per text, or None if there was an error
+    """
+    if not texts:
+        return []
+
+    results: List[Optional[List[float]]] = cache.get_many(texts) if cache is not None else [None] * len(texts)
+    missing = [i for i, vector in enumerate(results) if vector is None]
+    if not missing:
+        return results
+    if remote_client is None and not _ensure_model():
+        return None
+
+    batch_size = batch_size or EMBEDDING_MAX_BATCH_SIZE
+    order = sorted(missing, key=lambda i: len(texts[i]))
+    try:
+        if remote_client is not None:
+            # O processo de embeddings ordena e divide o lote do seu lado
+            vectors = remote_client.embed([texts[i] for i in missing])
+            for i, vector in zip(missing, vectors):
+                results[i] = vector
+            if cache is not None:
+                cache.put_many([texts[i] for i in missing], vectors)
+            return results
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            vectors = _forward([texts[i] for i in indices])
+            for i, vector in zip(indices, vectors):
+                results[i] = vector
+            if cache is not None:
+                cache.put_many([texts[i] for i in indices], vectors)
+        return results
+    except Exception as e:
+        print(f"Error embedding texts: {e}")
+        return None
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    va = torch.tensor(a)
+    vb = torch.tensor(b)
+    return torch.nn.functional.cosine_similarity(va, vb, dim=0).item()
+
+def measure_drift(sample_size: int = 200, db_path: Optional[str] = None) -> dict:
+    """
+    Compare the configured inference mode against fp32 on stored cases
+
+    Embeds a sample of stored symptom descriptions with both models and
+    reports the cosine similarity between each pair of vectors, plus how
+    often the nearest neighbour inside the sample stays the same.
+
+    Args:
+        sample_size: Maximum number of stored cases to compare
+        db_path: SQLite database with the validacao_triagem table (default:
+            the application database, database.DB_PATH)
+
+    Returns:
+        dict: Drift report (cosine statistics, neighbour agreement and latency)
+    """
+    if not _ensure_model():
+        raise RuntimeError("Model not loaded")
+
+    consulta = "SELECT sintomas FROM validacao_triagem ORDER BY RANDOM() LIMIT ?"
+    if db_path is None:
+        import database
+        with database.get_connection() as conn:
+            textos = [row[0] for row in conn.execute(consulta, (sample_size,)).fetchall()]
+    else:
+        conn = sqlite3.connect(db_path)
+        try:
+            textos = [row[0] for row in conn.execute(consulta, (sample_size,)).fetchall()]
+        finally:
+            conn.close()
+    if not textos:
+        return {"modo": inference_mode, "amostra": 0}
+
+    reference = _build_model("fp32") if inference_mode != "fp32" else model
+
+    def run(target_model):
+        inicio = time.perf_counter()
+        vetores = []
+        for start in range(0, len(textos), EMBEDDING_MAX_BATCH_SIZE):
+            vetores.extend(_forward(textos[start:start + EMBEDDING_MAX_BATCH_SIZE], target_model))
+        return vetores, (time.perf_counter() - inicio) * 1000 / len(textos)
+
+    base, base_ms = run(reference)
+    atual, atual_ms = run(model)
+    cossenos = [_cosine(a, b) for a, b in zip(base, atual)]
+
+    def vizinhos(vetores):
+        matriz = torch.nn.functional.normalize(torch.tensor(vetores), dim=1)
+        similaridade = matriz @ matriz.T
+        similaridade.fill_diagonal_(-2.0)
+        return similaridade.argmax(dim=1).tolist()
+
+    concordancia = None
+    if len(textos) > 1:
+        iguais = sum(1 for a, b in zip(vizinhos(base), vizinhos(atual)) if a == b)
+        concordancia = iguais / len(textos)
+
+    return {
+        "modo": inference_mode,
+        "amostra": len(textos),
+        "cosseno_medio": sum(cossenos) / len(cossenos),
+        "cosseno_minimo": min(cossenos),
+        "concordancia_vizinho": concordancia,
+        "ms_por_texto_fp32": base_ms,
+        "ms_por_texto_modo": atual_ms,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ferramentas do modelo de embeddings")
+    parser.add_argument("--drift", action="store_true", help="Mede o desvio do modo de inferência configurado em relação ao fp32")
+    parser.add_argument("--amostra", type=int, default=200, help="Número de casos armazenados usados na comparação")
+    args = parser.parse_args()
+    if args.drift:
+        for chave, valor in measure_drift(args.amostra).items():
+            print(f"{chave}: {valor}")
+    else:
+        parser.print_help()
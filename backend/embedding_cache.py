@@ -0,0 +1,161 @@
+"""
+Cache de embeddings em duas camadas: LRU em memória + SQLite em disco
+
+A chave é o hash do texto normalizado junto com o nome e a revisão do
+modelo, de modo que trocar o modelo nunca reaproveita vetores antigos.
+
+A camada em memória e a conexão do SQLite têm locks separados: acertos em
+memória não esperam um commit em disco de outra thread. O arquivo usa WAL
+com synchronous=NORMAL, já que o cache pode ser reconstruído a qualquer
+momento.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE", "1") == "1"
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.db")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normaliza Unicode (NFC) e espaços; o tokenizer ignora diferenças de
+    espaçamento, então o embedding do texto normalizado é o mesmo
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    def __init__(self, model_name: str, revision: str, max_size: int = EMBEDDING_CACHE_SIZE, path: str = EMBEDDING_CACHE_PATH):
+        self.model_name = model_name
+        self.revision = revision
+        self.max_size = max_size
+        self.path = path
+        self.hits_memoria = 0
+        self.hits_disco = 0
+        self.misses = 0
+        self._memoria: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Protege a conexão do SQLite (compartilhada entre threads)
+        self._disco_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def key(self, text: str) -> str:
+        conteudo = f"{self.model_name}\x00{self.revision}\x00{normalize_text(text)}"
+        return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+    def _disco(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                chave TEXT PRIMARY KEY,
+                vetor BLOB NOT NULL,
+                criado_em TEXT NOT NULL
+            )
+            ''')
+            self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS metadados (
+                modelo TEXT NOT NULL,
+                revisao TEXT NOT NULL
+            )
+            ''')
+            atual = self._conn.execute("SELECT modelo, revisao FROM metadados").fetchone()
+            if atual != (self.model_name, self.revision):
+                # Modelo mudou: vetores persistidos não são mais válidos
+                self._conn.execute("DELETE FROM embeddings")
+                self._conn.execute("DELETE FROM metadados")
+                self._conn.execute("INSERT INTO metadados (modelo, revisao) VALUES (?, ?)", (self.model_name, self.revision))
+            self._conn.commit()
+        return self._conn
+
+    def _lembrar(self, chave: str, vetor: List[float]) -> None:
+        self._memoria[chave] = vetor
+        self._memoria.move_to_end(chave)
+        while len(self._memoria) > self.max_size:
+            self._memoria.popitem(last=False)
+
+    def get(self, text: str) -> Optional[List[float]]:
+        return self.get_many([text])[0]
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        chaves = [self.key(text) for text in texts]
+        resultados: List[Optional[List[float]]] = [None] * len(texts)
+        with self._lock:
+            faltantes = {}
+            for i, chave in enumerate(chaves):
+                vetor = self._memoria.get(chave)
+                if vetor is not None:
+                    self._memoria.move_to_end(chave)
+                    resultados[i] = vetor
+                    self.hits_memoria += 1
+                else:
+                    faltantes.setdefault(chave, []).append(i)
+
+        if not faltantes:
+            return resultados
+
+        encontrados = {}
+        with self._disco_lock:
+            conn = self._disco()
+            lista = list(faltantes)
+            for inicio in range(0, len(lista), 500):
+                parte = lista[inicio:inicio + 500]
+                marcadores = ",".join("?" * len(parte))
+                for chave, blob in conn.execute(f"SELECT chave, vetor FROM embeddings WHERE chave IN ({marcadores})", parte):
+                    encontrados[chave] = array("f", blob).tolist()
+
+        with self._lock:
+            for chave, vetor in encontrados.items():
+                self._lembrar(chave, vetor)
+                for i in faltantes.pop(chave):
+                    resultados[i] = vetor
+                    self.hits_disco += 1
+            self.misses += sum(len(indices) for indices in faltantes.values())
+        return resultados
+
+    def put(self, text: str, vetor: List[float]) -> None:
+        self.put_many([text], [vetor])
+
+    def put_many(self, texts: List[str], vetores: List[List[float]]) -> None:
+        data = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        chaves = [self.key(text) for text in texts]
+        linhas = [(chave, array("f", vetor).tobytes(), data) for chave, vetor in zip(chaves, vetores)]
+        with self._lock:
+            for chave, vetor in zip(chaves, vetores):
+                self._lembrar(chave, vetor)
+        # Grava em disco fora do lock da memória
+        with self._disco_lock:
+            conn = self._disco()
+            conn.executemany("INSERT OR REPLACE INTO embeddings (chave, vetor, criado_em) VALUES (?, ?, ?)", linhas)
+            conn.commit()
+
+    def invalidate(self) -> None:
+        """
+        Descarta as duas camadas (por exemplo, após trocar os pesos do modelo
+        sem mudar o nome/revisão)
+        """
+        with self._lock:
+            self._memoria.clear()
+        with self._disco_lock:
+            conn = self._disco()
+            conn.execute("DELETE FROM embeddings")
+            conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits_memoria": self.hits_memoria,
+                "hits_disco": self.hits_disco,
+                "misses": self.misses,
+                "itens_memoria": len(self._memoria),
+            }
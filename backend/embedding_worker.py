@@ -0,0 +1,303 @@
+"""
+Processo de embeddings e indexação compartilhado pelos workers da API
+
+Com `uvicorn main:app --workers N`, cada worker carregaria sua própria cópia
+do modelo de embeddings e abriria (e sincronizaria) o mesmo `chroma_db`. Com
+EMBEDDING_WORKER_SOCKET definido, um único processo (`python
+embedding_worker.py`) carrega o modelo, é dono do ChromaDB e do indexador
+online, e os workers da API conversam com ele por um socket Unix.
+
+Cada mensagem é um quadro com o tamanho do cabeçalho e do corpo (8 bytes),
+um cabeçalho JSON e um corpo binário. Vetores trafegam como float32 no
+corpo; respostas com pelo menos EMBEDDING_WORKER_SHM_MIN_BYTES vão por um
+segmento de memória compartilhada, que o cliente copia e remove. Pedidos
+simultâneos de um texto, vindos de qualquer worker, são agrupados pelo
+micro-batcher de `embedding.py`.
+
+Uso (a partir do diretório backend):
+    python embedding_worker.py --socket /tmp/triagem-embeddings.sock
+    EMBEDDING_WORKER_SOCKET=/tmp/triagem-embeddings.sock uvicorn main:app --workers 4
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import queue
+import socket
+import struct
+import time
+from array import array
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+# Rodando como processo próprio, carrega o .env antes de ler a configuração
+# (aqui e em database/embedding/vector_index, importados em main)
+load_dotenv()
+
+EMBEDDING_WORKER_SOCKET = os.getenv("EMBEDDING_WORKER_SOCKET", "")
+EMBEDDING_WORKER_TIMEOUT = float(os.getenv("EMBEDDING_WORKER_TIMEOUT", "30"))
+# Tempo que a API espera o processo de embeddings ficar disponível no warm-up
+EMBEDDING_WORKER_START_TIMEOUT = float(os.getenv("EMBEDDING_WORKER_START_TIMEOUT", "300"))
+EMBEDDING_WORKER_SHM_MIN_BYTES = int(os.getenv("EMBEDDING_WORKER_SHM_MIN_BYTES", "65536"))
+
+_TAMANHOS = struct.Struct("!II")
+
+
+class EmbeddingWorkerError(Exception):
+    """Erro ao se comunicar com o processo de embeddings"""
+
+
+def _quadro(cabecalho: Dict[str, Any], corpo: bytes = b"") -> bytes:
+    dados = json.dumps(cabecalho, ensure_ascii=False).encode("utf-8")
+    return _TAMANHOS.pack(len(dados), len(corpo)) + dados + corpo
+
+
+def _codificar_vetores(vetores: List[List[float]], permitir_shm: bool = False) -> Tuple[Dict[str, Any], bytes]:
+    """
+    Serializa os vetores em float32: no corpo do quadro ou, se forem grandes,
+    em um segmento de memória compartilhada que passa a ser do destinatário
+    """
+    dim = len(vetores[0]) if vetores else 0
+    dados = array("f", itertools.chain.from_iterable(vetores)).tobytes()
+    meta = {"n": len(vetores), "dim": dim}
+    if not permitir_shm or len(dados) < EMBEDDING_WORKER_SHM_MIN_BYTES:
+        return meta, dados
+    segmento = shared_memory.SharedMemory(create=True, size=len(dados))
+    segmento.buf[:len(dados)] = dados
+    meta.update(shm=segmento.name, bytes=len(dados))
+    segmento.close()
+    # Quem remove o segmento é o cliente, depois de copiar os vetores
+    resource_tracker.unregister(segmento._name, "shared_memory")
+    return meta, b""
+
+
+def _decodificar_vetores(meta: Dict[str, Any], corpo: bytes) -> List[List[float]]:
+    if meta.get("shm"):
+        segmento = shared_memory.SharedMemory(name=meta["shm"])
+        try:
+            corpo = bytes(segmento.buf[:meta["bytes"]])
+        finally:
+            segmento.close()
+            segmento.unlink()
+    valores = array("f")
+    valores.frombytes(corpo)
+    dim = meta["dim"]
+    return [valores[i * dim:(i + 1) * dim].tolist() for i in range(meta["n"])]
+
+
+class WorkerClient:
+    """
+    Cliente síncrono (usado nas threads da API) do processo de embeddings
+
+    Mantém um pool de conexões: cada chamada usa uma conexão livre ou abre
+    uma nova, então chamadas de threads diferentes seguem em paralelo.
+    """
+
+    def __init__(self, path: str = EMBEDDING_WORKER_SOCKET, timeout: float = EMBEDDING_WORKER_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._livres: "queue.LifoQueue[socket.socket]" = queue.LifoQueue()
+
+    def _conectar(self) -> socket.socket:
+        conexao = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conexao.settimeout(self.timeout)
+        conexao.connect(self.path)
+        return conexao
+
+    @staticmethod
+    def _receber(conexao: socket.socket, tamanho: int) -> bytes:
+        partes = []
+        while tamanho:
+            parte = conexao.recv(min(tamanho, 1 << 20))
+            if not parte:
+                raise ConnectionError("Conexão encerrada pelo processo de embeddings")
+            partes.append(parte)
+            tamanho -= len(parte)
+        return b"".join(partes)
+
+    def _chamar(self, cabecalho: Dict[str, Any], corpo: bytes = b"") -> Tuple[Dict[str, Any], bytes]:
+        try:
+            conexao = self._livres.get_nowait()
+        except queue.Empty:
+            try:
+                conexao = self._conectar()
+            except OSError as e:
+                raise EmbeddingWorkerError(f"Processo de embeddings indisponível em {self.path}: {e}") from e
+        try:
+            conexao.sendall(_quadro(cabecalho, corpo))
+            tamanho_cabecalho, tamanho_corpo = _TAMANHOS.unpack(self._receber(conexao, _TAMANHOS.size))
+            resposta = json.loads(self._receber(conexao, tamanho_cabecalho))
+            corpo_resposta = self._receber(conexao, tamanho_corpo)
+        except (OSError, ValueError) as e:
+            conexao.close()
+            raise EmbeddingWorkerError(str(e)) from e
+        self._livres.put(conexao)
+        if not resposta.get("ok"):
+            raise EmbeddingWorkerError(resposta.get("erro", "Erro desconhecido no processo de embeddings"))
+        return resposta, corpo_resposta
+
+    def wait_ready(self, timeout: float = EMBEDDING_WORKER_START_TIMEOUT) -> Dict[str, Any]:
+        """Aguarda o processo de embeddings aceitar conexões e devolve seu estado"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.status()
+            except EmbeddingWorkerError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.5)
+
+    def status(self) -> Dict[str, Any]:
+        resposta, _ = self._chamar({"op": "status"})
+        return resposta["status"]
+
+    def verificar_modelo(self, estado: Dict[str, Any], esperado: str) -> None:
+        """
+        Confere se o processo de embeddings usa o mesmo modelo que esta API
+
+        Com modelos (ou modos de inferência) diferentes, os vetores da API e
+        os do índice não seriam comparáveis e a busca de similares ficaria
+        errada sem nenhum erro aparente.
+
+        Raises:
+            EmbeddingWorkerError: Se a assinatura do modelo for diferente
+        """
+        if estado.get("modelo") != esperado:
+            raise EmbeddingWorkerError(
+                f"Embedding worker at {self.path} uses model {estado.get('modelo')!r}, expected {esperado!r}"
+            )
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        resposta, corpo = self._chamar({"op": "embed", "textos": texts})
+        return _decodificar_vetores(resposta, corpo)
+
+    def query(self, query_embeddings: List[List[float]], n_results: int) -> Dict[str, Any]:
+        meta, corpo = _codificar_vetores(query_embeddings)
+        resposta, _ = self._chamar({"op": "query", "n_results": n_results, **meta}, corpo)
+        return resposta["resultado"]
+
+    def agendar(self, triagem_id: str) -> None:
+        """Pede ao indexador online do processo de embeddings para indexar o caso validado"""
+        self._chamar({"op": "agendar", "triagem_ids": [triagem_id]})
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._livres.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class RemoteCollection:
+    """Coleção do ChromaDB do processo de embeddings, com a mesma interface de consulta"""
+
+    def __init__(self, client: WorkerClient):
+        self.client = client
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10) -> Dict[str, Any]:
+        return self.client.query(query_embeddings, n_results)
+
+    def count(self) -> int:
+        return self.client.status()["casos"]
+
+
+class EmbeddingWorker:
+    """Servidor do socket Unix: embeddings, consultas ao ChromaDB e indexação"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def atender(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    tamanho_cabecalho, tamanho_corpo = _TAMANHOS.unpack(await reader.readexactly(_TAMANHOS.size))
+                    cabecalho = json.loads(await reader.readexactly(tamanho_cabecalho))
+                    corpo = await reader.readexactly(tamanho_corpo)
+                except asyncio.IncompleteReadError:
+                    return
+                try:
+                    resposta, corpo_resposta = await self.executar(cabecalho, corpo)
+                    resposta["ok"] = True
+                except Exception as e:
+                    print(f"Error handling embedding worker request: {e}")
+                    resposta, corpo_resposta = {"ok": False, "erro": str(e)}, b""
+                writer.write(_quadro(resposta, corpo_resposta))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def executar(self, cabecalho: Dict[str, Any], corpo: bytes) -> Tuple[Dict[str, Any], bytes]:
+        import embedding
+        import vector_index
+
+        loop = asyncio.get_running_loop()
+        op = cabecalho.get("op")
+        if op == "embed":
+            textos = cabecalho["textos"]
+            if len(textos) == 1:
+                # Um texto por vez: o micro-batcher junta pedidos de todos os workers
+                vetor = await loop.run_in_executor(None, embedding.embed_text, textos[0])
+                vetores = None if vetor is None else [vetor]
+            else:
+                vetores = await loop.run_in_executor(None, embedding.embed_texts, textos)
+            if vetores is None:
+                raise RuntimeError("Model not loaded")
+            return _codificar_vetores(vetores, permitir_shm=True)
+        if op == "query":
+            embeddings = _decodificar_vetores(cabecalho, corpo)
+            resultado = await loop.run_in_executor(
+                None, lambda: self.collection.query(query_embeddings=embeddings, n_results=cabecalho["n_results"])
+            )
+            return {"resultado": {"metadatas": resultado["metadatas"], "distances": resultado.get("distances")}}, b""
+        if op == "agendar":
+            for triagem_id in cabecalho["triagem_ids"]:
+                vector_index.indexer.agendar(triagem_id)
+            return {}, b""
+        if op == "status":
+            casos = await loop.run_in_executor(None, self.collection.count)
+            return {"status": {"modelo": embedding.MODEL_SIGNATURE, "casos": casos, "pid": os.getpid()}}, b""
+        raise ValueError(f"Operação desconhecida: {op}")
+
+
+async def serve(path: str, collection) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+    servidor = await asyncio.start_unix_server(EmbeddingWorker(collection).atender, path=path)
+    os.chmod(path, 0o660)
+    print(f"Embedding worker listening on {path}")
+    async with servidor:
+        await servidor.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Processo de embeddings e indexação compartilhado pelos workers da API")
+    parser.add_argument("--socket", default=EMBEDDING_WORKER_SOCKET or "/tmp/triagem-embeddings.sock", help="Caminho do socket Unix")
+    args = parser.parse_args()
+
+    import database
+    import embedding
+    import vector_index
+
+    database.init_validation_db()
+    if not embedding.load_model():
+        raise SystemExit("Model not loaded")
+    _, collection = vector_index.prepare_collection()
+    try:
+        asyncio.run(serve(args.socket, collection))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        vector_index.indexer.stop()
+        embedding.batcher.stop()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
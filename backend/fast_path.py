@@ -0,0 +1,153 @@
+"""
+Pré-triagem por regras para apresentações críticas
+
+Um autômato Aho-Corasick compilado a partir dos termos de
+`mock_response.TERMOS_POR_COR` (ou de um arquivo de regras JSON) procura,
+em uma única passada sobre o texto sem acentos, os termos que indicam
+VERMELHO ou LARANJA. O resultado é uma classificação provisória devolvida
+imediatamente, enquanto o LLM produz a triagem completa.
+
+Formato do arquivo de regras (FAST_PATH_RULES_PATH):
+    {"VERMELHO": ["parada", "inconsciente"], "LARANJA": ["dor toracica"]}
+"""
+import json
+import os
+import unicodedata
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from mock_response import TERMOS_POR_COR
+
+FAST_PATH_ENABLED = os.getenv("FAST_PATH", "1") == "1"
+FAST_PATH_RULES_PATH = os.getenv("FAST_PATH_RULES_PATH", "")
+
+# Apenas as cores que justificam pular a fila do LLM, da mais grave para a menos
+CORES_CRITICAS = ("VERMELHO", "LARANJA")
+
+# Palavras que, logo antes de um termo, indicam que ele foi negado
+# ("sem sangramento intenso", "nega dor toracica")
+NEGACOES = ("sem", "nega", "negou", "nego", "ausencia de")
+JANELA_NEGACAO = 16
+
+
+def normalize(text: str) -> str:
+    """
+    Remove acentos e diferenças de caixa
+    """
+    decomposto = unicodedata.normalize("NFD", text)
+    return "".join(c for c in decomposto if not unicodedata.combining(c)).casefold()
+
+
+class AhoCorasick:
+    """
+    Autômato de casamento de múltiplos padrões (Aho-Corasick)
+    """
+
+    def __init__(self, padroes: Dict[str, Any]):
+        self._transicoes: List[Dict[str, int]] = [{}]
+        self._falha: List[int] = [0]
+        self._saidas: List[List[Tuple[str, Any]]] = [[]]
+
+        for padrao, valor in padroes.items():
+            estado = 0
+            for c in padrao:
+                proximo = self._transicoes[estado].get(c)
+                if proximo is None:
+                    proximo = len(self._transicoes)
+                    self._transicoes.append({})
+                    self._falha.append(0)
+                    self._saidas.append([])
+                    self._transicoes[estado][c] = proximo
+                estado = proximo
+            self._saidas[estado].append((padrao, valor))
+
+        # Links de falha em largura
+        fila = deque(self._transicoes[0].values())
+        while fila:
+            estado = fila.popleft()
+            for c, proximo in self._transicoes[estado].items():
+                fila.append(proximo)
+                falha = self._falha[estado]
+                while falha and c not in self._transicoes[falha]:
+                    falha = self._falha[falha]
+                destino = self._transicoes[falha].get(c, 0)
+                self._falha[proximo] = destino if destino != proximo else 0
+                self._saidas[proximo] = self._saidas[proximo] + self._saidas[self._falha[proximo]]
+
+    def search(self, texto: str) -> List[Tuple[int, str, Any]]:
+        """
+        Returns:
+            List[Tuple[int, str, Any]]: (posição inicial, padrão, valor) de cada ocorrência
+        """
+        ocorrencias = []
+        estado = 0
+        for i, c in enumerate(texto):
+            while estado and c not in self._transicoes[estado]:
+                estado = self._falha[estado]
+            estado = self._transicoes[estado].get(c, 0)
+            for padrao, valor in self._saidas[estado]:
+                ocorrencias.append((i - len(padrao) + 1, padrao, valor))
+        return ocorrencias
+
+
+def _regras_padrao() -> Dict[str, List[str]]:
+    return {cor: TERMOS_POR_COR[cor.lower()] for cor in CORES_CRITICAS}
+
+
+def load_rules(path: str = FAST_PATH_RULES_PATH) -> Dict[str, List[str]]:
+    if not path:
+        return _regras_padrao()
+    with open(path, encoding="utf-8") as arquivo:
+        regras = json.load(arquivo)
+    return {cor.upper(): list(termos) for cor, termos in regras.items() if cor.upper() in CORES_CRITICAS}
+
+
+class RuleEngine:
+    def __init__(self, regras: Dict[str, List[str]]):
+        padroes: Dict[str, str] = {}
+        # Em termos repetidos prevalece a cor mais grave
+        for cor in reversed(CORES_CRITICAS):
+            for termo in regras.get(cor, []):
+                padroes[normalize(termo)] = cor
+        self._automato = AhoCorasick(padroes)
+
+    @staticmethod
+    def _palavra_inteira(texto: str, inicio: int, fim: int) -> bool:
+        antes = texto[inicio - 1] if inicio > 0 else " "
+        depois = texto[fim] if fim < len(texto) else " "
+        return not antes.isalnum() and not depois.isalnum()
+
+    @staticmethod
+    def _negado(texto: str, inicio: int) -> bool:
+        anterior = texto[max(0, inicio - JANELA_NEGACAO):inicio].split()
+        trecho = " ".join(anterior[-2:])
+        return any(trecho == negacao or trecho.endswith(" " + negacao) for negacao in NEGACOES)
+
+    def classify(self, sintomas: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns:
+            Dict[str, Any]: A cor crítica mais grave encontrada e os termos que a
+            dispararam, ou None se nenhuma regra casou
+        """
+        texto = normalize(sintomas)
+        termos_por_cor: Dict[str, List[str]] = {}
+        for inicio, padrao, cor in self._automato.search(texto):
+            fim = inicio + len(padrao)
+            if self._palavra_inteira(texto, inicio, fim) and not self._negado(texto, inicio):
+                termos = termos_por_cor.setdefault(cor, [])
+                if padrao not in termos:
+                    termos.append(padrao)
+
+        for cor in CORES_CRITICAS:
+            if cor in termos_por_cor:
+                return {"classificacao": cor, "termos": termos_por_cor[cor]}
+        return None
+
+
+engine = RuleEngine(load_rules())
+
+
+def classify(sintomas: str) -> Optional[Dict[str, Any]]:
+    if not FAST_PATH_ENABLED:
+        return None
+    return engine.classify(sintomas)
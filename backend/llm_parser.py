@@ -0,0 +1,237 @@
+"""
+Interpretação das respostas do LLM no formato Classificação / Justificativa / Condutas
+
+No modo estruturado o Ollama gera JSON restrito a TRIAGEM_SCHEMA e
+`parse_structured_response` o interpreta em uma única passada; a heurística
+sobre texto livre (`process_llm_response`) fica como fallback.
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+MARCADOR_JUSTIFICATIVA = "Justificativa"
+MARCADOR_CONDUTAS = "Condutas"
+
+# Cor como palavra inteira, seguida de algum caractere (para não emitir uma
+# palavra que ainda pode estar sendo gerada)
+_COR_COMPLETA = re.compile(r"\b(vermelho|laranja|amarelo|verde|azul)\b(?=\W)", re.IGNORECASE)
+
+CORES = ("VERMELHO", "LARANJA", "AMARELO", "VERDE", "AZUL")
+
+# Esquema enviado no campo "format" do Ollama (saída JSON restrita)
+TRIAGEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "classificacao": {"type": "string", "enum": [cor.lower() for cor in CORES]},
+        "justificativa": {"type": "string"},
+        "condutas": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["classificacao", "justificativa", "condutas"]
+}
+
+_decoder = json.JSONDecoder()
+
+
+def process_llm_response(response_text):
+    # Extract classification, justification, and recommendations
+    classification = ""
+    justification = ""
+    recommendations = ""
+
+    # Clean up the response
+    texto_limpo = response_text.replace("assistant:", "").replace("Justificativa:", "").replace("Justificativa", "")
+    texto_resposta = texto_limpo.lower()
+
+    # Detect classification color
+    if "vermelho" in texto_resposta:
+        classification = "VERMELHO"
+    elif "laranja" in texto_resposta:
+        classification = "LARANJA"
+    elif "amarelo" in texto_resposta:
+        classification = "AMARELO"
+    elif "verde" in texto_resposta:
+        classification = "VERDE"
+    elif "azul" in texto_resposta:
+        classification = "AZUL"
+
+    # Extract justification and recommendations
+    partes = texto_limpo.split("Condutas")
+
+    if "Classificação" in partes[0]:
+        if "Justificativa" in partes[0]:
+            justification = partes[0].split("Justificativa")[1].strip()
+        else:
+            justification = partes[0].split("Classificação")[1].strip()
+            linhas_justificativa = justification.split('\n')
+            if len(linhas_justificativa) > 1:
+                justification = '\n'.join(linhas_justificativa[1:]).strip()
+    else:
+        justification = partes[0]
+
+    if classification.lower() in justification.lower():
+        justification = justification[len(classification):].strip()
+        if justification.startswith("-"):
+            justification = justification[1:].strip()
+
+    if len(partes) > 1:
+        recommendations = partes[1].strip()
+
+    return classification, justification, recommendations
+
+
+def parse_structured_response(response_text: str) -> Optional[Tuple[str, str, str]]:
+    """
+    Interpreta uma resposta JSON no formato de TRIAGEM_SCHEMA
+
+    Aceita apenas um objeto JSON (espaços em volta são ignorados) com uma cor
+    válida; as condutas podem vir como lista ou texto.
+
+    Returns:
+        Tuple[str, str, str]: (classificacao, justificativa, condutas), ou None
+        se a resposta não segue o esquema
+    """
+    texto = response_text.strip()
+    try:
+        dados, fim = _decoder.raw_decode(texto)
+    except ValueError:
+        return None
+    if fim != len(texto) or not isinstance(dados, dict):
+        return None
+
+    classificacao = dados.get("classificacao")
+    justificativa = dados.get("justificativa")
+    condutas = dados.get("condutas")
+    if not isinstance(classificacao, str) or classificacao.strip().upper() not in CORES:
+        return None
+    if not isinstance(justificativa, str):
+        return None
+    if isinstance(condutas, list):
+        if not all(isinstance(item, str) for item in condutas):
+            return None
+        condutas = "\n".join(f"- {item.strip().lstrip('- ')}" for item in condutas if item.strip())
+    elif not isinstance(condutas, str):
+        return None
+
+    return classificacao.strip().upper(), justificativa.strip(), condutas.strip()
+
+
+def parse_llm_response(response_text: str, structured: bool = False) -> Tuple[str, str, str]:
+    """
+    Interpreta a resposta do LLM: primeiro como JSON estruturado (quando
+    `structured`), depois pela heurística de texto livre
+    """
+    if structured:
+        resultado = parse_structured_response(response_text)
+        if resultado is not None:
+            return resultado
+    return process_llm_response(response_text)
+
+
+class IncrementalTriageParser:
+    """
+    Parser incremental para respostas recebidas em streaming
+
+    Recebe os pedaços de texto conforme chegam do LLM e devolve eventos:
+    a classificação assim que a seção "Classificação" está completa, e em
+    seguida os trechos de "Justificativa" e "Condutas" à medida que são
+    gerados. O texto completo continua disponível em `texto`, e `resultado`
+    devolve o resultado definitivo coerente com os eventos já enviados.
+    """
+
+    def __init__(self):
+        self.texto = ""
+        self.secao = "classificacao"
+        self.classificacao: Optional[str] = None
+        self.secoes: Dict[str, List[str]] = {"justificativa": [], "condutas": []}
+        self._pos = 0
+        self._inicio_secao = True
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self.texto += chunk
+        return self._processar(final=False)
+
+    def finish(self) -> List[Dict[str, Any]]:
+        return self._processar(final=True)
+
+    def resultado(self, structured: bool = False) -> Tuple[str, str, str]:
+        """
+        Resultado definitivo, a ser chamado depois de `finish`
+
+        Se a classificação já foi emitida, ela e as seções recebidas são o
+        resultado: o parser completo procura a primeira cor em qualquer parte
+        do texto e poderia gravar uma cor diferente da mostrada ao cliente
+        (ex.: justificativa de um caso LARANJA que menciona "vermelho").
+
+        Returns:
+            Tuple[str, str, str]: (classificacao, justificativa, condutas)
+        """
+        if structured:
+            estruturado = parse_structured_response(self.texto)
+            if estruturado is not None:
+                return estruturado
+        if self.classificacao is not None:
+            return (
+                self.classificacao,
+                "".join(self.secoes["justificativa"]).strip(),
+                "".join(self.secoes["condutas"]).strip(),
+            )
+        return process_llm_response(self.texto)
+
+    def _processar(self, final: bool) -> List[Dict[str, Any]]:
+        eventos: List[Dict[str, Any]] = []
+
+        if self.secao == "classificacao":
+            fim = self.texto.find(MARCADOR_JUSTIFICATIVA)
+            trecho = self.texto if fim == -1 else self.texto[:fim]
+            if self.classificacao is None:
+                self._detectar_cor(trecho, completo=fim != -1 or final, eventos=eventos)
+            if fim == -1:
+                return eventos
+            self._entrar_secao("justificativa", fim + len(MARCADOR_JUSTIFICATIVA))
+
+        if self.secao == "justificativa":
+            fim = self.texto.find(MARCADOR_CONDUTAS, self._pos)
+            if fim == -1:
+                # Segura o final do buffer: pode ser o início de "Condutas"
+                limite = len(self.texto) if final else len(self.texto) - (len(MARCADOR_CONDUTAS) - 1)
+                self._emitir("justificativa", limite, eventos)
+                return eventos
+            self._emitir("justificativa", fim, eventos)
+            self._entrar_secao("condutas", fim + len(MARCADOR_CONDUTAS))
+
+        if self.secao == "condutas":
+            self._emitir("condutas", len(self.texto), eventos)
+
+        return eventos
+
+    def _detectar_cor(self, trecho: str, completo: bool, eventos: List[Dict[str, Any]]) -> None:
+        match = _COR_COMPLETA.search(trecho)
+        if match is None and completo:
+            # Seção encerrada sem cor isolada: recorre à mesma heurística do parser completo
+            classificacao = process_llm_response(trecho)[0]
+            if classificacao:
+                self.classificacao = classificacao
+        elif match is not None:
+            self.classificacao = match.group(1).upper()
+
+        if self.classificacao is not None:
+            eventos.append({"tipo": "classificacao", "classificacao": self.classificacao})
+
+    def _entrar_secao(self, secao: str, pos: int) -> None:
+        self.secao = secao
+        self._pos = pos
+        self._inicio_secao = True
+
+    def _emitir(self, secao: str, limite: int, eventos: List[Dict[str, Any]]) -> None:
+        if limite <= self._pos:
+            return
+        trecho = self.texto[self._pos:limite]
+        self._pos = limite
+        if self._inicio_secao:
+            trecho = trecho.lstrip(": \t\r\n")
+            if not trecho:
+                return
+            self._inicio_secao = False
+        self.secoes[secao].append(trecho)
+        eventos.append({"tipo": secao, "texto": trecho})
+
@@ -0,0 +1,192 @@
+"""
+Controle de admissão e fila com prioridade para as gerações no Ollama
+
+No máximo LLM_MAX_CONCURRENCY gerações rodam ao mesmo tempo; as demais
+esperam em uma fila limitada a LLM_QUEUE_MAX posições, ordenada por
+prioridade (e por ordem de chegada dentro da mesma prioridade). Quem não
+consegue uma vaga em LLM_QUEUE_TIMEOUT segundos desiste com
+`PrazoEsgotado` (503) em vez de esperar o timeout do Ollama, e com a fila
+cheia a requisição é recusada na hora com `FilaCheia` (429) - a não ser que
+seja mais urgente que a última da fila, que então é recusada no lugar dela.
+
+As prioridades seguem as cores do Protocolo de Manchester: casos VERMELHO
+da pré-triagem por regras passam à frente de LARANJA (ou de triagens
+marcadas como urgentes), que passam à frente das triagens comuns e, por
+último, dos itens de triagens em lote.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+import metrics
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "20"))
+
+PRIORIDADE_CRITICA = 0
+PRIORIDADE_URGENTE = 1
+PRIORIDADE_NORMAL = 2
+PRIORIDADE_LOTE = 3
+NOMES_PRIORIDADE = {
+    PRIORIDADE_CRITICA: "critica",
+    PRIORIDADE_URGENTE: "urgente",
+    PRIORIDADE_NORMAL: "normal",
+    PRIORIDADE_LOTE: "lote",
+}
+
+# Peso da última geração na média móvel do tempo de serviço
+_PESO_MEDIA = 0.2
+
+LLM_QUEUE_WAIT_SECONDS = metrics.histogram("llm_queue_wait_seconds", "Espera por uma vaga de geração no Ollama", ("prioridade",))
+LLM_REJECTED = metrics.counter("llm_rejected_total", "Gerações recusadas pelo controle de admissão", ("motivo",))
+
+
+class LLMSobrecarregado(Exception):
+    """Geração recusada pelo controle de admissão"""
+
+    status_code = 503
+
+    def __init__(self, mensagem: str, retry_after: int):
+        super().__init__(mensagem)
+        self.retry_after = retry_after
+
+
+class FilaCheia(LLMSobrecarregado):
+    status_code = 429
+
+
+class PrazoEsgotado(LLMSobrecarregado):
+    status_code = 503
+
+
+def prioridade_da_classificacao(classificacao: Optional[str], urgente: bool = False) -> int:
+    """Prioridade de uma triagem a partir da cor provisória e da marcação de urgência"""
+    if classificacao == "VERMELHO":
+        return PRIORIDADE_CRITICA
+    if classificacao == "LARANJA" or urgente:
+        return PRIORIDADE_URGENTE
+    return PRIORIDADE_NORMAL
+
+
+class LLMScheduler:
+    def __init__(self, limite: int = LLM_MAX_CONCURRENCY, max_fila: int = LLM_QUEUE_MAX, timeout: float = LLM_QUEUE_TIMEOUT):
+        self.limite = max(1, limite)
+        self.max_fila = max(0, max_fila)
+        self.timeout = timeout
+        self.ativos = 0
+        # Heap de [prioridade, ordem de chegada, future que recebe a vaga]
+        self._fila: List[list] = []
+        self._ordem = itertools.count()
+        self._tempo_medio = 0.0
+
+    def na_fila(self) -> int:
+        return len(self._fila)
+
+    def retry_after(self) -> int:
+        """Estimativa (segundos) de quando a fila atual terá sido atendida"""
+        if not self._tempo_medio:
+            return 1
+        return max(1, round(self._tempo_medio * (len(self._fila) + 1) / self.limite))
+
+    def admite(self, prioridade: int) -> bool:
+        """Se uma requisição com esta prioridade seria aceita agora (sem reservar nada)"""
+        if self.ativos < self.limite or len(self._fila) < self.max_fila:
+            return True
+        return bool(self._fila) and prioridade < max(self._fila)[0]
+
+    def _recusar(self, motivo: str, excecao: LLMSobrecarregado) -> LLMSobrecarregado:
+        LLM_REJECTED.inc(motivo=motivo)
+        return excecao
+
+    async def acquire(self, prioridade: int = PRIORIDADE_NORMAL, timeout: Optional[float] = None) -> None:
+        """
+        Ocupa uma vaga de geração, esperando na fila se necessário
+
+        Args:
+            prioridade: Menor valor é atendido primeiro (PRIORIDADE_*)
+            timeout: Espera máxima na fila (padrão LLM_QUEUE_TIMEOUT)
+
+        Raises:
+            FilaCheia: Se a fila estiver cheia de requisições tão ou mais urgentes
+            PrazoEsgotado: Se a vaga não sair dentro do prazo
+        """
+        inicio = time.perf_counter()
+        if self.ativos < self.limite and not self._fila:
+            self.ativos += 1
+            self._registrar_espera(prioridade, inicio)
+            return
+
+        if len(self._fila) >= self.max_fila:
+            ultima = max(self._fila) if self._fila else None
+            if ultima is None or prioridade >= ultima[0]:
+                raise self._recusar("fila_cheia", FilaCheia("Fila de gerações cheia", self.retry_after()))
+            # Abre espaço recusando a requisição menos urgente da fila
+            self._fila.remove(ultima)
+            heapq.heapify(self._fila)
+            ultima[2].set_exception(self._recusar("preterida", FilaCheia("Requisição preterida por um caso mais urgente", self.retry_after())))
+
+        future = asyncio.get_running_loop().create_future()
+        entrada = [prioridade, next(self._ordem), future]
+        heapq.heappush(self._fila, entrada)
+        try:
+            await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self._sair_da_fila(entrada)
+            raise self._recusar("prazo", PrazoEsgotado("Prazo de espera por uma geração esgotado", self.retry_after())) from None
+        except BaseException:
+            # Cancelada na fila; se a vaga já tinha sido passada para ela, devolve
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            else:
+                self._sair_da_fila(entrada)
+            raise
+        self._registrar_espera(prioridade, inicio)
+
+    def _sair_da_fila(self, entrada: list) -> None:
+        try:
+            self._fila.remove(entrada)
+            heapq.heapify(self._fila)
+        except ValueError:
+            pass
+
+    def _registrar_espera(self, prioridade: int, inicio: float) -> None:
+        espera = time.perf_counter() - inicio
+        LLM_QUEUE_WAIT_SECONDS.observe(espera, prioridade=NOMES_PRIORIDADE.get(prioridade, str(prioridade)))
+        metrics.record_stage("fila", espera)
+
+    def release(self) -> None:
+        """Libera a vaga, passando-a direto para a próxima da fila"""
+        while self._fila:
+            _, _, future = heapq.heappop(self._fila)
+            if not future.done():
+                future.set_result(True)
+                return
+        self.ativos -= 1
+
+    @asynccontextmanager
+    async def slot(self, prioridade: int = PRIORIDADE_NORMAL) -> AsyncIterator[None]:
+        await self.acquire(prioridade)
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            duracao = time.perf_counter() - inicio
+            self._tempo_medio = duracao if not self._tempo_medio else (1 - _PESO_MEDIA) * self._tempo_medio + _PESO_MEDIA * duracao
+            self.release()
+
+
+scheduler = LLMScheduler()
+
+metrics.function_metric(
+    "llm_queue_depth", "Gerações aguardando vaga no Ollama", "gauge",
+    lambda: [((), scheduler.na_fila())]
+)
+metrics.function_metric(
+    "llm_slots_in_use", "Vagas de geração ocupadas", "gauge",
+    lambda: [((), scheduler.ativos)]
+)
@@ -1,18 +1,39 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Request, Form
+from fastapi import FastAPI, HTTPException, Depends, status, Request, Form, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional
-import sqlite3
-import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
-import torch
-from transformers import AutoTokenizer, AutoModel
-import chromadb
+import asyncio
+import threading
 from dotenv import load_dotenv
-import requests
 import json
+import hashlib
+import csv
+import io
+import time
+import zlib
+
+# Load environment variables before importing modules that read them
+load_dotenv()
+
+import ollama_client
+import embedding
+import vector_index
+import embedding_worker
+from llm_parser import parse_llm_response, IncrementalTriageParser, TRIAGEM_SCHEMA, CORES
+from database import init_validation_db, obter_pagina_triagens, obter_triagem, validar_triagem, obter_estatisticas, obter_serie_estatisticas
+import database
+import write_behind
+import semantic_cache
+import single_flight
+import fast_path
+import prompt_builder
+import metrics
+import llm_scheduler
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Sistema de Triagem API",
@@ -29,38 +50,65 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Define the device
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-# Load tokenizer and model
-try:
-    tokenizer = AutoTokenizer.from_pretrained("pucpr/biobertpt-clin")
-    model = AutoModel.from_pretrained("pucpr/biobertpt-clin")
-    model = model.to(device)
-except Exception as e:
-    print(f"Error loading model: {e}")
-    model = None
-    tokenizer = None
-
-# Initialize ChromaDB
-try:
-    chroma_client = chromadb.PersistentClient(path="./chroma_db")
-    collection_name = "triagem_hci"
-    
+@app.middleware("http")
+async def medir_requisicao(request: Request, call_next):
+    """Mede cada requisição e devolve as etapas medidas no cabeçalho Server-Timing"""
+    token = metrics.begin_request()
+    inicio = time.perf_counter()
+    status_code = 500
     try:
-        collection = chroma_client.get_collection(name=collection_name)
-        chroma_client.delete_collection(collection_name)
-        collection = chroma_client.create_collection(name=collection_name)
-    except ValueError:
-        collection = chroma_client.create_collection(name=collection_name)
-    except Exception:
-        try:
-            collection = chroma_client.create_collection(name=collection_name)
-        except:
-            collection = chroma_client.get_collection(name=collection_name)
-except Exception as e:
-    print(f"Error initializing ChromaDB: {e}")
-    collection = None
+        with metrics.HTTP_IN_FLIGHT.track():
+            response = await call_next(request)
+        status_code = response.status_code
+        # Etapas concluídas antes do início da resposta (no streaming, as
+        # seguintes aparecem só em /metrics)
+        response.headers["Server-Timing"] = metrics.server_timing(
+            metrics.end_request(token), (time.perf_counter() - inicio) * 1000
+        )
+        token = None
+        return response
+    finally:
+        if token is not None:
+            metrics.end_request(token)
+        rota = request.scope.get("route")
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - inicio,
+            method=request.method,
+            route=getattr(rota, "path", "desconhecida"),
+            status=str(status_code)
+        )
+
+# Vector store handles, filled in by the background warm-up
+chroma_client = None
+collection = None
+# Quem indexa os casos validados: o indexador local ou o processo de embeddings.
+# Decidido antes de servir, para que validações feitas durante o warm-up não
+# caiam no indexador local, que não é iniciado no modo com processo de embeddings
+if embedding_worker.EMBEDDING_WORKER_SOCKET:
+    indexador = embedding_worker.WorkerClient()
+else:
+    indexador = vector_index.indexer
+
+# Warm-up state: the model and the vector store are loaded in a background
+# thread after startup, so importing this module stays fast
+WARMUP_WAIT_TIMEOUT = float(os.getenv("WARMUP_WAIT_TIMEOUT", "10"))
+
+# Triagem em lote: máximo de casos por requisição e gerações simultâneas no LLM
+TRIAGEM_LOTE_MAX_ITENS = int(os.getenv("TRIAGEM_LOTE_MAX_ITENS", "200"))
+TRIAGEM_LOTE_CONCORRENCIA = int(os.getenv("TRIAGEM_LOTE_CONCORRENCIA", "2"))
+warmup_ready = threading.Event()
+warmup_error: Optional[str] = None
+
+# Triagens provisórias (pré-triagem por regras): tentativas de completar pelo
+# LLM e intervalo (segundos) da varredura das que ficaram sem resultado; 0 desativa
+PROVISORIA_MAX_TENTATIVAS = int(os.getenv("PROVISORIA_MAX_TENTATIVAS", "3"))
+PROVISORIA_RETRY_BACKOFF = float(os.getenv("PROVISORIA_RETRY_BACKOFF", "2"))
+PROVISORIA_VARREDURA_INTERVALO = float(os.getenv("PROVISORIA_VARREDURA_INTERVALO", "60"))
+# Validade (segundos) da reclamação de um registro provisório por um processo;
+# deve cobrir todas as tentativas, e depois disso outro processo pode retomá-lo
+PROVISORIA_RECLAMACAO_SEGUNDOS = float(os.getenv("PROVISORIA_RECLAMACAO_SEGUNDOS", "600"))
+provisorias_em_andamento: set = set()
+varredura_provisorias: Optional["asyncio.Task"] = None
 
 # Pydantic models
 class TriagemRequest(BaseModel):
@@ -71,6 +119,11 @@ class TriagemRequest(BaseModel):
 
 class TriagemProcessar(BaseModel):
     sintomas: str
+    # Marca a triagem para passar à frente das comuns na fila do LLM
+    urgente: bool = False
+
+class TriagemLoteRequest(BaseModel):
+    sintomas: List[str]
 
 class TriagemResponse(BaseModel):
     id: str
@@ -80,6 +133,9 @@ class TriagemResponse(BaseModel):
     justificativa: str
     condutas: str
     data_hora: str
+    cached: bool = False
+    provisoria: bool = False
+    prompt_tokens: Optional[int] = None
 
 class ValidationRequest(BaseModel):
     triagem_id: str
@@ -99,28 +155,129 @@ class LoginResponse(BaseModel):
     message: str
     user: Optional[str] = None
 
+# Instruções fixas enviadas ao LLM em toda triagem
+SYSTEM_PROMPT = """Você é um assistente especializado em triagem clínica baseado no Protocolo de Manchester.
+
+ESTRUTURA OBRIGATÓRIA DA RESPOSTA:
+Classificação
+[COR_ÚNICA]
+
+Justificativa
+[Análise clínica detalhada sem mencionar cores]
+
+Condutas
+[Procedimentos e encaminhamentos específicos]
+
+REGRAS PARA CLASSIFICAÇÃO:
+- VERMELHO: Risco de vida imediato (parada cardiorrespiratória, choque, inconsciência)
+- LARANJA: Muito urgente (dor torácica intensa, dispneia grave, alteração neurológica aguda)
+- AMARELO: Urgente (febre alta, dor moderada a intensa, vômitos persistentes)
+- VERDE: Pouco urgente (sintomas leves, condições estáveis)
+- AZUL: Não urgente (condições crônicas estáveis, consultas de rotina)
+
+INSTRUÇÕES ESPECÍFICAS:
+1. Na seção "Classificação": Use APENAS uma palavra (vermelho, laranja, amarelo, verde ou azul)
+2. Na seção "Justificativa": 
+   - NÃO mencione nenhuma cor
+   - Analise sintomas, sinais vitais e fatores de risco
+   - Explique o raciocínio clínico baseado nos achados
+   - Cite protocolos relevantes quando aplicável
+3. Na seção "Condutas":
+   - Liste procedimentos imediatos
+   - Indique exames necessários
+   - Especifique encaminhamentos
+   - Defina tempo máximo para reavaliação"""
+
+SYSTEM_PROMPT_JSON = """Você é um assistente especializado em triagem clínica baseado no Protocolo de Manchester.
+
+Responda APENAS com um objeto JSON com os campos:
+- "classificacao": uma única cor (vermelho, laranja, amarelo, verde ou azul)
+- "justificativa": análise clínica detalhada, sem mencionar cores
+- "condutas": lista de procedimentos, exames e encaminhamentos
+
+REGRAS PARA CLASSIFICAÇÃO:
+- VERMELHO: Risco de vida imediato (parada cardiorrespiratória, choque, inconsciência)
+- LARANJA: Muito urgente (dor torácica intensa, dispneia grave, alteração neurológica aguda)
+- AMARELO: Urgente (febre alta, dor moderada a intensa, vômitos persistentes)
+- VERDE: Pouco urgente (sintomas leves, condições estáveis)
+- AZUL: Não urgente (condições crônicas estáveis, consultas de rotina)
+
+INSTRUÇÕES ESPECÍFICAS:
+1. Em "justificativa": analise sintomas, sinais vitais e fatores de risco, explique o raciocínio clínico e cite protocolos relevantes quando aplicável
+2. Em "condutas": liste procedimentos imediatos, exames necessários, encaminhamentos e o tempo máximo para reavaliação"""
+
+# "texto" mantém a resposta em seções de texto livre; "json" pede ao Ollama
+# saída restrita a TRIAGEM_SCHEMA, interpretada sem heurísticas
+OLLAMA_OUTPUT_FORMAT = os.getenv("OLLAMA_OUTPUT_FORMAT", "texto").lower()
+SAIDA_ESTRUTURADA = OLLAMA_OUTPUT_FORMAT == "json"
+PROMPT_SISTEMA = SYSTEM_PROMPT_JSON if SAIDA_ESTRUTURADA else SYSTEM_PROMPT
+PROMPT_SISTEMA_TOKENS = prompt_builder.count_tokens(PROMPT_SISTEMA)
+
+OLLAMA_OPTIONS = {
+    "temperature": 0.3,
+    "top_p": 0.9,
+    "max_tokens": 1000
+}
+
+# Identifica prompt + modelo + opções: respostas reaproveitadas (cache
+# semântico) só valem enquanto esta versão não mudar
+PROMPT_VERSION = hashlib.sha256(
+    f"{PROMPT_SISTEMA}\x00{ollama_client.OLLAMA_MODEL}\x00{json.dumps(OLLAMA_OPTIONS, sort_keys=True)}\x00{OLLAMA_OUTPUT_FORMAT}"
+    f"\x00{prompt_builder.PROMPT_MAX_TOKENS}\x00{prompt_builder.PROMPT_CASE_MAX_TOKENS}\x00{prompt_builder.PROMPT_MAX_CASES}".encode("utf-8")
+).hexdigest()[:16]
+semantic_cache.cache.set_version(PROMPT_VERSION)
+
 # Helper functions (definir ANTES dos endpoints)
-async def call_ollama_mistral(prompt: str) -> str:
-    """Chama o modelo Mistral via Ollama"""
+def build_ollama_payload(prompt: str) -> dict:
+    # O prompt de sistema vai em um campo próprio e sempre idêntico: o Ollama
+    # o coloca no início do contexto e reaproveita o prefixo já processado
+    # entre triagens enquanto o modelo segue carregado (keep_alive)
+    payload = {
+        "model": ollama_client.OLLAMA_MODEL,
+        "system": PROMPT_SISTEMA,
+        "prompt": prompt,
+        "stream": False,
+        "keep_alive": ollama_client.OLLAMA_KEEP_ALIVE,
+        "options": OLLAMA_OPTIONS
+    }
+    if SAIDA_ESTRUTURADA:
+        payload["format"] = TRIAGEM_SCHEMA
+    return payload
+
+def build_warm_payload() -> dict:
+    """Geração de um único token com o mesmo prefixo de sistema das triagens"""
+    payload = build_ollama_payload("Sintomas do novo caso:")
+    payload["options"] = {**OLLAMA_OPTIONS, "num_predict": 1}
+    payload.pop("format", None)
+    return payload
+
+def erro_de_sobrecarga(e: llm_scheduler.LLMSobrecarregado) -> HTTPException:
+    """429 (fila cheia) ou 503 (prazo esgotado) com a estimativa de espera"""
+    return HTTPException(
+        status_code=e.status_code,
+        detail=f"{e}. Tente novamente em instantes.",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+@app.exception_handler(write_behind.FilaDeGravacaoCheia)
+async def fila_de_gravacao_cheia(request: Request, e: write_behind.FilaDeGravacaoCheia):
+    """503 quando a fila write-behind não abre vaga (banco não acompanha a carga)"""
+    return JSONResponse(
+        status_code=e.status_code,
+        content={"detail": f"{e}. Tente novamente em instantes."},
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+async def call_ollama_mistral(prompt: str, prioridade: int = llm_scheduler.PRIORIDADE_NORMAL) -> str:
+    """Chama o modelo Mistral via Ollama, respeitando a fila de gerações"""
     try:
-        url = "http://localhost:11434/api/generate"
-        payload = {
-            "model": "mistral",
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": 0.3,
-                "top_p": 0.9,
-                "max_tokens": 1000
-            }
-        }
-        
-        response = requests.post(url, json=payload, timeout=30)
-        response.raise_for_status()
-        
-        result = response.json()
+        async with llm_scheduler.scheduler.slot(prioridade):
+            with metrics.stage("llm"):
+                result = await ollama_client.generate(build_ollama_payload(prompt))
         return result.get("response", "")
-        
+
+    except llm_scheduler.LLMSobrecarregado as e:
+        raise erro_de_sobrecarga(e)
     except Exception as e:
         print(f"Erro ao chamar Ollama: {e}")
         # Lançar exceção para informar que o Ollama não está disponível
@@ -129,152 +286,32 @@ async def call_ollama_mistral(prompt: str) -> str:
             detail="O serviço Ollama não está disponível. Por favor, verifique se o Ollama está instalado e em execução."
         )
 
-def embed_text(text: str) -> List[float]:
-    if tokenizer is None or model is None:
-        raise HTTPException(status_code=500, detail="Model not loaded")
-    
-    inputs = tokenizer(text, return_tensors="pt", padding=True, truncation=True, max_length=512).to(device)
-    with torch.no_grad():
-        outputs = model(**inputs)
-        embeddings = outputs.last_hidden_state[:, 0, :]
-    return embeddings.cpu().numpy()[0].tolist()
-
-def process_llm_response(response_text):
-    # Extract classification, justification, and recommendations
-    classification = ""
-    justification = ""
-    recommendations = ""
-    
-    # Clean up the response
-    texto_limpo = response_text.replace("assistant:", "").replace("Justificativa:", "").replace("Justificativa", "")
-    texto_resposta = texto_limpo.lower()
-    
-    # Detect classification color
-    if "vermelho" in texto_resposta:
-        classification = "VERMELHO"
-    elif "laranja" in texto_resposta:
-        classification = "LARANJA"
-    elif "amarelo" in texto_resposta:
-        classification = "AMARELO"
-    elif "verde" in texto_resposta:
-        classification = "VERDE"
-    elif "azul" in texto_resposta:
-        classification = "AZUL"
-    
-    # Extract justification and recommendations
-    partes = texto_limpo.split("Condutas")
-    
-    if "Classificação" in partes[0]:
-        if "Justificativa" in partes[0]:
-            justification = partes[0].split("Justificativa")[1].strip()
-        else:
-            justification = partes[0].split("Classificação")[1].strip()
-            linhas_justificativa = justification.split('\n')
-            if len(linhas_justificativa) > 1:
-                justification = '\n'.join(linhas_justificativa[1:]).strip()
-    else:
-        justification = partes[0]
-    
-    if classification.lower() in justification.lower():
-        justification = justification[len(classification):].strip()
-        if justification.startswith("-"):
-            justification = justification[1:].strip()
-    
-    if len(partes) > 1:
-        recommendations = partes[1].strip()
-    
-    return classification, justification, recommendations
-
-# Database functions
-def init_validation_db():
-    conn = sqlite3.connect('./validacao_triagem.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS validacao_triagem (
-        id TEXT PRIMARY KEY,
-        sintomas TEXT NOT NULL,
-        resposta TEXT NOT NULL,
-        data_hora TEXT NOT NULL,
-        validado INTEGER DEFAULT 0,
-        feedback TEXT,
-        validado_por TEXT,
-        data_validacao TEXT,
-        classificacao TEXT,
-        justificativa TEXT,
-        condutas TEXT
-    )
-    ''')
-    conn.commit()
-    conn.close()
-
-def salvar_para_validacao(sintomas, resposta, classificacao="", justificativa="", condutas=""):
-    conn = sqlite3.connect('./validacao_triagem.db')
-    cursor = conn.cursor()
-    triagem_id = str(uuid.uuid4())
-    data_hora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute(
-        "INSERT INTO validacao_triagem (id, sintomas, resposta, data_hora, classificacao, justificativa, condutas) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (triagem_id, sintomas, str(resposta), data_hora, classificacao, justificativa, condutas)
-    )
-    conn.commit()
-    conn.close()
-    return triagem_id
+async def stream_ollama_mistral(prompt: str, prioridade: int = llm_scheduler.PRIORIDADE_NORMAL):
+    """Chama o modelo Mistral via Ollama em streaming, produzindo os fragmentos de texto"""
+    async with llm_scheduler.scheduler.slot(prioridade):
+        inicio = time.perf_counter()
+        async for chunk in ollama_client.stream_generate(build_ollama_payload(prompt)):
+            if chunk.get("response"):
+                yield chunk["response"]
+            if chunk.get("done"):
+                break
+        metrics.record_stage("llm", time.perf_counter() - inicio)
 
-def carregar_casos_validados():
-    try:
-        conn = sqlite3.connect('./validacao_triagem.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT sintomas, resposta FROM validacao_triagem WHERE validado = 1")
-        casos = cursor.fetchall()
-        conn.close()
-        return casos
-    except Exception as e:
-        print(f"Error loading validated cases: {e}")
-        return []
+def verificar_admissao(prioridade: int) -> None:
+    """Recusa na hora (429), antes do embedding e da busca, se a fila do LLM não tem lugar"""
+    if not llm_scheduler.scheduler.admite(prioridade):
+        raise HTTPException(
+            status_code=429,
+            detail="Fila de gerações cheia. Tente novamente em instantes.",
+            headers={"Retry-After": str(llm_scheduler.scheduler.retry_after())}
+        )
 
-def obter_triagens(filtro="todas"):
-    conn = sqlite3.connect('./validacao_triagem.db')
-    cursor = conn.cursor()
-    
-    query = "SELECT id, sintomas, resposta, data_hora, validado, feedback, validado_por, data_validacao FROM validacao_triagem"
-    
-    if filtro == "pendentes":
-        query += " WHERE validado = 0"
-    elif filtro == "validadas":
-        query += " WHERE validado = 1"
-        
-    query += " ORDER BY data_hora DESC"
-    
-    cursor.execute(query)
-    triagens = cursor.fetchall()
-    conn.close()
-    
-    result = []
-    for triagem in triagens:
-        result.append({
-            "id": triagem[0],
-            "sintomas": triagem[1],
-            "resposta": triagem[2],
-            "data_hora": triagem[3],
-            "validado": triagem[4],
-            "feedback": triagem[5],
-            "validado_por": triagem[6],
-            "data_validacao": triagem[7]
-        })
-    
-    return result
-
-def validar_triagem(triagem_id, validado_por, feedback):
-    conn = sqlite3.connect('./validacao_triagem.db')
-    cursor = conn.cursor()
-    data_validacao = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute(
-        "UPDATE validacao_triagem SET validado = 1, feedback = ?, validado_por = ?, data_validacao = ? WHERE id = ?",
-        (feedback, validado_por, data_validacao, triagem_id)
-    )
-    conn.commit()
-    conn.close()
-    return True
+def embed_text(text: str) -> List[float]:
+    with metrics.stage("embedding"):
+        vector = embedding.embed_text(text)
+    if vector is None:
+        raise HTTPException(status_code=500, detail="Model not loaded")
+    return vector
 
 def autenticar(username, password):
     usuarios_validos = {
@@ -290,122 +327,698 @@ def autenticar(username, password):
 # Initialize database
 init_validation_db()
 
-# Load validated cases
-casos_validados = carregar_casos_validados()
+def warm_up():
+    """
+    Carrega tokenizer/modelo, abre o ChromaDB e sincroniza o índice vetorial,
+    ou, com EMBEDDING_WORKER_SOCKET, aguarda o processo de embeddings que é
+    dono deles
+    """
+    global chroma_client, collection, warmup_error
+    try:
+        if embedding_worker.EMBEDDING_WORKER_SOCKET:
+            cliente = indexador
+            estado = cliente.wait_ready()
+            cliente.verificar_modelo(estado, embedding.MODEL_SIGNATURE)
+            print(f"Using embedding worker {estado}")
+            embedding.remote_client = cliente
+            collection = embedding_worker.RemoteCollection(cliente)
+            warmup_ready.set()
+            return
 
-# Insert validated cases into vector database
-if collection is not None:
-    for i, (sintomas, resposta) in enumerate(casos_validados):
-        case_id = f"validated_case_{i}"
-        try:
-            embedding = embed_text(sintomas)
-            collection.add(
-                embeddings=[embedding],
-                ids=[case_id],
-                metadatas=[{"content": sintomas, "resposta": resposta}]
+        if not embedding.load_model():
+            raise RuntimeError("Model not loaded")
+
+        # Sync validated cases into the vector database (only new or changed rows)
+        chroma_client, collection = vector_index.prepare_collection()
+
+        warmup_ready.set()
+    except Exception as e:
+        print(f"Error during warm-up: {e}")
+        warmup_error = str(e)
+
+async def wait_until_ready():
+    """Aguarda o warm-up por até WARMUP_WAIT_TIMEOUT segundos; depois disso responde 503"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + WARMUP_WAIT_TIMEOUT
+    while not warmup_ready.is_set():
+        if warmup_error is not None or loop.time() >= deadline:
+            raise HTTPException(
+                status_code=503,
+                detail="O serviço ainda está inicializando os modelos. Tente novamente em instantes.",
+                headers={"Retry-After": "5"}
             )
+        await asyncio.sleep(0.1)
+
+# Application lifecycle
+@app.on_event("startup")
+async def startup():
+    global varredura_provisorias
+    await ollama_client.start_client()
+    ollama_client.warmer.start(build_warm_payload())
+    write_behind.start()
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    if PROVISORIA_VARREDURA_INTERVALO > 0:
+        varredura_provisorias = asyncio.ensure_future(varrer_triagens_provisorias())
+
+@app.on_event("shutdown")
+async def shutdown():
+    if varredura_provisorias is not None:
+        varredura_provisorias.cancel()
+    await ollama_client.warmer.stop()
+    await ollama_client.close_client()
+    vector_index.indexer.stop()
+    embedding.batcher.stop()
+    await run_in_threadpool(write_behind.stop)
+    database.pool.close_all()
+
+def montar_prompt(sintomas: str, metadatas: List[dict]) -> dict:
+    """
+    Monta o prompt de triagem a partir dos casos similares já recuperados
+
+    Returns:
+        dict: "prompt" (sem o prompt de sistema, enviado à parte) e "tokens"
+        estimados do conjunto
+    """
+    with metrics.stage("prompt"):
+        entrada = prompt_builder.build_prompt_input(sintomas, metadatas, reserved_tokens=PROMPT_SISTEMA_TOKENS)
+    return {"prompt": entrada["texto"], "tokens": entrada["tokens"]}
+
+def build_triage_prompt(sintomas: str, query_embedding: List[float]) -> dict:
+    """Busca casos similares e monta o prompt de triagem dentro do orçamento de tokens"""
+    # Query vector database for similar cases
+    with metrics.stage("busca"):
+        results = collection.query(query_embeddings=[query_embedding], n_results=prompt_builder.PROMPT_CANDIDATE_CASES)
+    return montar_prompt(sintomas, results['metadatas'][0])
+
+async def interpretar_triagem(query_embedding: List[float], montado: dict, prioridade: int = llm_scheduler.PRIORIDADE_NORMAL) -> dict:
+    """Chama o LLM com o prompt montado e interpreta a resposta"""
+    # Call Ollama API
+    response_text = await call_ollama_mistral(montado["prompt"], prioridade)
+
+    # Process the response
+    with metrics.stage("parse"):
+        classificacao, justificativa, condutas = parse_llm_response(response_text, SAIDA_ESTRUTURADA)
+
+    resultado = {
+        "resposta": response_text,
+        "classificacao": classificacao,
+        "justificativa": justificativa,
+        "condutas": condutas
+    }
+    if semantic_cache.SEMANTIC_CACHE_ENABLED and classificacao:
+        semantic_cache.cache.store(query_embedding, resultado)
+    return {**resultado, "cached": False, "prompt_tokens": montado["tokens"]}
+
+async def gerar_triagem(sintomas: str, prioridade: int = llm_scheduler.PRIORIDADE_NORMAL) -> dict:
+    """
+    Executa o pipeline de triagem (embedding, busca de similares, LLM e
+    interpretação) sem persistir o resultado
+    """
+    # Convert symptoms to embedding
+    query_embedding = await run_in_threadpool(embed_text, sintomas)
+
+    if semantic_cache.SEMANTIC_CACHE_ENABLED:
+        resultado = semantic_cache.cache.lookup(query_embedding)
+        if resultado is not None:
+            return {**resultado, "cached": True}
+
+    montado = await run_in_threadpool(build_triage_prompt, sintomas, query_embedding)
+    return await interpretar_triagem(query_embedding, montado, prioridade)
+
+def resultado_provisorio(regra: dict) -> dict:
+    """Resultado imediato da pré-triagem por regras, enquanto o LLM não responde"""
+    termos = ", ".join(regra["termos"])
+    return {
+        "resposta": "",
+        "classificacao": regra["classificacao"],
+        "justificativa": f"Classificação provisória por regra (termos: {termos}). Análise completa em andamento.",
+        "condutas": "",
+        "cached": False
+    }
+
+async def completar_triagem_provisoria(triagem_id: str, sintomas: str, prioridade: int) -> bool:
+    """
+    Gera a triagem completa pelo LLM e substitui o registro provisório
+
+    O registro é antes reclamado no banco, então com vários workers da API só
+    um deles gera a triagem. Tenta até PROVISORIA_MAX_TENTATIVAS vezes, com
+    espera crescente entre as tentativas; o que ainda assim ficar provisório
+    é liberado e retomado pela varredura periódica (`varrer_triagens_provisorias`).
+
+    Returns:
+        bool: True se o registro foi completado
+    """
+    if triagem_id in provisorias_em_andamento:
+        return False
+    provisorias_em_andamento.add(triagem_id)
+    try:
+        try:
+            # O registro pode ainda estar na fila write-behind
+            await run_in_threadpool(write_behind.fila.wait_for, triagem_id)
+            if not await run_in_threadpool(database.reclamar_triagem_provisoria, triagem_id, reclamacoes_expiradas_ate()):
+                # Já completado ou sendo completado por outro processo
+                return False
+        except Exception as e:
+            print(f"Error claiming provisional triage {triagem_id}: {e}")
+            return False
+
+        for tentativa in range(1, PROVISORIA_MAX_TENTATIVAS + 1):
+            try:
+                await wait_until_ready()
+                chave = single_flight.triage_key(sintomas, PROMPT_VERSION)
+                resultado = await single_flight.triagens.do(chave, lambda: gerar_triagem(sintomas, prioridade))
+                await run_in_threadpool(
+                    database.atualizar_resultado_triagem,
+                    triagem_id,
+                    resultado["resposta"],
+                    # Sem cor reconhecível na resposta do LLM, mantém a da regra
+                    resultado["classificacao"] or None,
+                    resultado["justificativa"],
+                    resultado["condutas"]
+                )
+                PROVISORIAS_COMPLETADAS.inc(resultado="sucesso")
+                return True
+            except Exception as e:
+                PROVISORIAS_COMPLETADAS.inc(resultado="falha")
+                print(f"Error completing provisional triage {triagem_id} (attempt {tentativa}): {getattr(e, 'detail', e)}")
+                if tentativa < PROVISORIA_MAX_TENTATIVAS:
+                    await asyncio.sleep(PROVISORIA_RETRY_BACKOFF * (2 ** (tentativa - 1)))
+        try:
+            await run_in_threadpool(database.liberar_triagem_provisoria, triagem_id)
+        except Exception as e:
+            # A reclamação expira depois de PROVISORIA_RECLAMACAO_SEGUNDOS
+            print(f"Error releasing provisional triage {triagem_id}: {e}")
+        return False
+    finally:
+        provisorias_em_andamento.discard(triagem_id)
+
+def reclamacoes_expiradas_ate() -> str:
+    """Reclamações de registros provisórios feitas até este instante já expiraram"""
+    return (datetime.now() - timedelta(seconds=PROVISORIA_RECLAMACAO_SEGUNDOS)).strftime("%Y-%m-%d %H:%M:%S")
+
+async def varrer_triagens_provisorias():
+    """
+    Completa as triagens que continuam provisórias (falhas do LLM, API
+    reiniciada antes do fim da tarefa em segundo plano): uma vez após o
+    warm-up e depois a cada PROVISORIA_VARREDURA_INTERVALO segundos. Roda em
+    todos os workers da API; a reclamação no banco garante que cada registro
+    seja completado por um só
+    """
+    while True:
+        while not warmup_ready.is_set():
+            await asyncio.sleep(1)
+        # Só pega registros mais antigos que um intervalo, para não disputar
+        # com a tarefa em segundo plano que acabou de ser agendada
+        criadas_ate = (datetime.now() - timedelta(seconds=PROVISORIA_VARREDURA_INTERVALO)).strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            pendentes = await run_in_threadpool(database.listar_triagens_provisorias, criadas_ate, reclamacoes_expiradas_ate())
         except Exception as e:
-            print(f"Error processing validated case {case_id}: {str(e)}")
+            print(f"Error listing provisional triages: {e}")
+            pendentes = []
+        for triagem in pendentes:
+            prioridade = llm_scheduler.prioridade_da_classificacao(triagem["classificacao"])
+            await completar_triagem_provisoria(triagem["id"], triagem["sintomas"], prioridade)
+        await asyncio.sleep(PROVISORIA_VARREDURA_INTERVALO)
+
+def _metricas_de_cache():
+    amostras = []
+    if embedding.cache is not None:
+        estatisticas = embedding.cache.stats()
+        amostras += [
+            (("embedding", "hit_memoria"), estatisticas["hits_memoria"]),
+            (("embedding", "hit_disco"), estatisticas["hits_disco"]),
+            (("embedding", "miss"), estatisticas["misses"]),
+        ]
+    estatisticas = semantic_cache.cache.stats()
+    amostras += [(("semantico", "hit"), estatisticas["hits"]), (("semantico", "miss"), estatisticas["misses"])]
+    return amostras
+
+metrics.function_metric("cache_requests_total", "Consultas aos caches por resultado", "counter", _metricas_de_cache, ("cache", "resultado"))
+metrics.function_metric(
+    "triagem_coalesced_total", "Triagens atendidas por uma execução idêntica já em andamento", "counter",
+    lambda: [((), single_flight.triagens.coalescidas)]
+)
+metrics.function_metric(
+    "triagem_in_flight", "Execuções distintas do pipeline de triagem em andamento", "gauge",
+    lambda: [((), single_flight.triagens.em_andamento())]
+)
+metrics.function_metric(
+    "write_behind_pending", "Triagens aguardando gravação na fila write-behind", "gauge",
+    lambda: [((), write_behind.fila.pendentes())]
+)
+PROVISORIAS_COMPLETADAS = metrics.counter(
+    "triagem_provisional_completions_total", "Tentativas de completar triagens provisórias pelo LLM", ("resultado",)
+)
+FAST_PATH_MATCHES = metrics.counter("fast_path_matches_total", "Triagens classificadas provisoriamente pelas regras", ("classificacao",))
 
 # API endpoints
+@app.get("/metrics", include_in_schema=False)
+async def metricas():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def root():
     return {"message": "Sistema de Triagem API"}
 
+@app.get("/health/live")
+async def health_live():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready():
+    if warmup_ready.is_set():
+        return {"status": "ready"}
+    if warmup_error is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "detail": warmup_error})
+    return JSONResponse(status_code=503, content={"status": "warming_up"})
+
 @app.post("/api/triagem", response_model=TriagemResponse)
-async def realizar_triagem(request: TriagemProcessar):
+async def realizar_triagem(request: TriagemProcessar, background_tasks: BackgroundTasks):
+    # Apresentações críticas reconhecidas pelas regras não esperam o LLM:
+    # a classificação provisória volta na hora e a triagem completa é
+    # gravada no mesmo registro quando ficar pronta
+    with metrics.stage("regras"):
+        regra = fast_path.classify(request.sintomas) if request.sintomas else None
+    if regra is not None:
+        FAST_PATH_MATCHES.inc(classificacao=regra["classificacao"])
+        resultado = resultado_provisorio(regra)
+        triagem_id = await run_in_threadpool(
+            write_behind.persistir_triagem,
+            request.sintomas,
+            resultado["resposta"],
+            resultado["classificacao"],
+            resultado["justificativa"],
+            resultado["condutas"],
+            True
+        )
+        # A triagem completa de um caso crítico passa à frente na fila do LLM
+        prioridade = llm_scheduler.prioridade_da_classificacao(regra["classificacao"], request.urgente)
+        background_tasks.add_task(completar_triagem_provisoria, triagem_id, request.sintomas, prioridade)
+        return {
+            "id": triagem_id,
+            "sintomas": request.sintomas,
+            **resultado,
+            "provisoria": True,
+            "data_hora": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+    await wait_until_ready()
+    prioridade = llm_scheduler.prioridade_da_classificacao(None, request.urgente)
     try:
         # Check if symptoms are provided
         if not request.sintomas:
             raise HTTPException(status_code=400, detail="Sintomas não fornecidos")
+        verificar_admissao(prioridade)
         
-        # Convert symptoms to embedding
-        query_embedding = embed_text(request.sintomas)
-        
-        # Query vector database for similar cases
-        results = collection.query(query_embeddings=[query_embedding], n_results=3)
+        # Requisições idênticas simultâneas compartilham uma única execução;
+        # cada uma continua gravando o próprio registro para auditoria
+        chave = single_flight.triage_key(request.sintomas, PROMPT_VERSION)
+        resultado = await single_flight.triagens.do(chave, lambda: gerar_triagem(request.sintomas, prioridade))
         
-        # Extract similar cases
-        similar_cases = [metadata["content"] for metadata in results['metadatas'][0]]
-        
-        # Prepare input for LLM
-        input_text = f"Sintomas do novo caso: {request.sintomas}\n\nCasos Similares: {' '.join(similar_cases)}"
+        # Save to validation database
+        triagem_id = await run_in_threadpool(
+            write_behind.persistir_triagem,
+            request.sintomas,
+            resultado["resposta"],
+            resultado["classificacao"],
+            resultado["justificativa"],
+            resultado["condutas"]
+        )
         
-        # Create message sequence for LLM
-        system_prompt = """Você é um assistente especializado em triagem clínica baseado no Protocolo de Manchester.
-
-ESTRUTURA OBRIGATÓRIA DA RESPOSTA:
-Classificação
-[COR_ÚNICA]
+        return {
+            "id": triagem_id,
+            "sintomas": request.sintomas,
+            **resultado,
+            "data_hora": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+    except (HTTPException, write_behind.FilaDeGravacaoCheia):
+        # 400, 429 e 503 chegam ao cliente como estão
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao processar triagem: {str(e)}")
 
-Justificativa
-[Análise clínica detalhada sem mencionar cores]
+# Gerações do streaming em andamento (mantidas até terminarem de gravar,
+# mesmo que o cliente já tenha desconectado)
+triagens_stream_em_andamento: set = set()
 
-Condutas
-[Procedimentos e encaminhamentos específicos]
+@app.post("/api/triagem/stream")
+async def realizar_triagem_stream(request: TriagemProcessar):
+    """
+    Variante em streaming de /api/triagem (NDJSON, um evento por linha)
 
-REGRAS PARA CLASSIFICAÇÃO:
-- VERMELHO: Risco de vida imediato (parada cardiorrespiratória, choque, inconsciência)
-- LARANJA: Muito urgente (dor torácica intensa, dispneia grave, alteração neurológica aguda)
-- AMARELO: Urgente (febre alta, dor moderada a intensa, vômitos persistentes)
-- VERDE: Pouco urgente (sintomas leves, condições estáveis)
-- AZUL: Não urgente (condições crônicas estáveis, consultas de rotina)
+    Emite a classificação assim que a seção "Classificação" termina, depois os
+    trechos de justificativa e condutas conforme são gerados, e por fim um
+    evento "final" com o registro salvo para validação. Quando a pré-triagem
+    por regras reconhece um caso crítico, o registro provisório é gravado
+    antes de tudo (como em /api/triagem) e um evento "classificacao_provisoria"
+    com o id abre o stream; o resultado do LLM completa esse mesmo registro
+    e, se a geração falhar, ele segue para `completar_triagem_provisoria`.
+    """
+    if not request.sintomas:
+        raise HTTPException(status_code=400, detail="Sintomas não fornecidos")
 
-INSTRUÇÕES ESPECÍFICAS:
-1. Na seção "Classificação": Use APENAS uma palavra (vermelho, laranja, amarelo, verde ou azul)
-2. Na seção "Justificativa": 
-   - NÃO mencione nenhuma cor
-   - Analise sintomas, sinais vitais e fatores de risco
-   - Explique o raciocínio clínico baseado nos achados
-   - Cite protocolos relevantes quando aplicável
-3. Na seção "Condutas":
-   - Liste procedimentos imediatos
-   - Indique exames necessários
-   - Especifique encaminhamentos
-   - Defina tempo máximo para reavaliação"""
-        
-        prompt = f"{system_prompt}\n\n{input_text}"
-        
-        # Call Ollama API
-        response_text = await call_ollama_mistral(prompt)
-        
-        # Process the response
-        classificacao, justificativa, condutas = process_llm_response(response_text)
-        
-        # Save to validation database
-        triagem_id = salvar_para_validacao(
-            request.sintomas, 
-            response_text,
-            classificacao,
-            justificativa,
-            condutas
+    with metrics.stage("regras"):
+        regra = fast_path.classify(request.sintomas)
+    prioridade = llm_scheduler.prioridade_da_classificacao(regra["classificacao"] if regra else None, request.urgente)
+    provisoria_id: Optional[str] = None
+    if regra is not None:
+        FAST_PATH_MATCHES.inc(classificacao=regra["classificacao"])
+        # O caso crítico fica registrado mesmo que o LLM nunca responda
+        provisorio = resultado_provisorio(regra)
+        provisoria_id = await run_in_threadpool(
+            write_behind.persistir_triagem,
+            request.sintomas,
+            provisorio["resposta"],
+            provisorio["classificacao"],
+            provisorio["justificativa"],
+            provisorio["condutas"],
+            True
         )
-        
+    else:
+        # Sem classificação provisória para enviar, o aquecimento pendente
+        # ou a fila do LLM cheia ainda podem virar 503/429 antes de abrir o stream
+        await wait_until_ready()
+        verificar_admissao(prioridade)
+
+    async def persistir_e_finalizar(resultado: dict, cached: bool, prompt_tokens: Optional[int] = None) -> dict:
+        if provisoria_id is not None:
+            triagem_id = provisoria_id
+            await run_in_threadpool(write_behind.fila.wait_for, triagem_id)
+            await run_in_threadpool(
+                database.atualizar_resultado_triagem,
+                triagem_id,
+                resultado["resposta"],
+                # Sem cor reconhecível na resposta do LLM, mantém a da regra
+                resultado["classificacao"] or None,
+                resultado["justificativa"],
+                resultado["condutas"]
+            )
+        else:
+            triagem_id = await run_in_threadpool(
+                write_behind.persistir_triagem,
+                request.sintomas,
+                resultado["resposta"],
+                resultado["classificacao"],
+                resultado["justificativa"],
+                resultado["condutas"]
+            )
         return {
+            "tipo": "final",
             "id": triagem_id,
             "sintomas": request.sintomas,
+            **resultado,
+            "cached": cached,
+            "prompt_tokens": prompt_tokens,
+            "data_hora": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+    fila: "asyncio.Queue[Optional[dict]]" = asyncio.Queue()
+
+    async def gerar_e_gravar() -> bool:
+        """Gera e grava a triagem; False se parou em um evento de erro"""
+        if regra is not None:
+            try:
+                await wait_until_ready()
+            except HTTPException as e:
+                fila.put_nowait({"tipo": "erro", "detalhe": e.detail})
+                return False
+
+        query_embedding = await run_in_threadpool(embed_text, request.sintomas)
+        cacheado = None
+        if semantic_cache.SEMANTIC_CACHE_ENABLED:
+            cacheado = semantic_cache.cache.lookup(query_embedding)
+        if cacheado is not None:
+            fila.put_nowait({"tipo": "classificacao", "classificacao": cacheado["classificacao"]})
+            fila.put_nowait(await persistir_e_finalizar(cacheado, cached=True))
+            return True
+
+        montado = await run_in_threadpool(build_triage_prompt, request.sintomas, query_embedding)
+        parser = IncrementalTriageParser()
+        try:
+            async for fragmento in stream_ollama_mistral(montado["prompt"], prioridade):
+                for evento in parser.feed(fragmento):
+                    fila.put_nowait(evento)
+            for evento in parser.finish():
+                fila.put_nowait(evento)
+        except llm_scheduler.LLMSobrecarregado as e:
+            fila.put_nowait({"tipo": "erro", "detalhe": erro_de_sobrecarga(e).detail, "retry_after": e.retry_after})
+            return False
+        except Exception as e:
+            print(f"Erro ao chamar Ollama: {e}")
+            fila.put_nowait({"tipo": "erro", "detalhe": "O serviço Ollama não está disponível."})
+            return False
+
+        response_text = parser.texto
+        with metrics.stage("parse"):
+            # Grava a mesma classificação que o cliente já recebeu
+            classificacao, justificativa, condutas = parser.resultado(SAIDA_ESTRUTURADA)
+        resultado = {
             "resposta": response_text,
             "classificacao": classificacao,
             "justificativa": justificativa,
-            "condutas": condutas,
+            "condutas": condutas
+        }
+        if semantic_cache.SEMANTIC_CACHE_ENABLED and classificacao:
+            semantic_cache.cache.store(query_embedding, resultado)
+        fila.put_nowait(await persistir_e_finalizar(resultado, cached=False, prompt_tokens=montado["tokens"]))
+        return True
+
+    async def produzir():
+        gravada = False
+        try:
+            gravada = await gerar_e_gravar()
+        except Exception as e:
+            print(f"Error processing streamed triage: {e}")
+            fila.put_nowait({"tipo": "erro", "detalhe": f"Erro ao processar triagem: {getattr(e, 'detail', e)}"})
+        finally:
+            fila.put_nowait(None)
+        if provisoria_id is not None and not gravada:
+            # Warm-up pendente ou LLM indisponível: o registro provisório é
+            # completado com novas tentativas (e, se preciso, pela varredura)
+            await completar_triagem_provisoria(provisoria_id, request.sintomas, prioridade)
+
+    async def eventos():
+        if regra is not None:
+            yield json.dumps({"tipo": "classificacao_provisoria", "id": provisoria_id, **regra}, ensure_ascii=False) + "\n"
+
+        # A geração e a gravação rodam em uma task própria: se o cliente
+        # desconectar, o stream para de ser lido mas a triagem ainda é gravada
+        tarefa = asyncio.ensure_future(produzir())
+        triagens_stream_em_andamento.add(tarefa)
+        tarefa.add_done_callback(triagens_stream_em_andamento.discard)
+        while True:
+            evento = await fila.get()
+            if evento is None:
+                return
+            yield json.dumps(evento, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(eventos(), media_type="application/x-ndjson")
+
+@app.post("/api/triagem/lote")
+async def realizar_triagem_lote(request: TriagemLoteRequest):
+    """
+    Triagem de vários casos em uma requisição (NDJSON, um evento por linha)
+
+    Os sintomas são embedados em lotes e os casos similares de todos eles são
+    buscados em uma única consulta ao ChromaDB. As gerações rodam com no
+    máximo TRIAGEM_LOTE_CONCORRENCIA chamadas simultâneas ao LLM e cada
+    resultado é gravado (via write_behind, como na triagem individual) e
+    enviado ("item", com o índice do caso) assim que fica pronto; se o
+    cliente desconectar, as gerações já concluídas continuam gravadas. Um
+    evento "final" resume o lote.
+    """
+    if not request.sintomas:
+        raise HTTPException(status_code=400, detail="Sintomas não fornecidos")
+    if len(request.sintomas) > TRIAGEM_LOTE_MAX_ITENS:
+        raise HTTPException(status_code=400, detail=f"O lote aceita no máximo {TRIAGEM_LOTE_MAX_ITENS} casos")
+
+    await wait_until_ready()
+    indices = [i for i, sintomas in enumerate(request.sintomas) if sintomas and sintomas.strip()]
+    textos = [request.sintomas[i] for i in indices]
+
+    embeddings = await run_in_threadpool(embedding.embed_texts, textos) if textos else []
+    if embeddings is None:
+        raise HTTPException(status_code=500, detail="Model not loaded")
+    metadatas: List[List[dict]] = []
+    if embeddings:
+        resultados = await run_in_threadpool(
+            collection.query,
+            query_embeddings=embeddings,
+            n_results=prompt_builder.PROMPT_CANDIDATE_CASES
+        )
+        metadatas = resultados['metadatas']
+
+    limite = asyncio.Semaphore(max(1, TRIAGEM_LOTE_CONCORRENCIA))
+
+    async def processar(posicao: int) -> tuple:
+        indice = indices[posicao]
+        try:
+            cacheado = semantic_cache.cache.lookup(embeddings[posicao]) if semantic_cache.SEMANTIC_CACHE_ENABLED else None
+            if cacheado is not None:
+                resultado = {**cacheado, "cached": True}
+            else:
+                montado = montar_prompt(textos[posicao], metadatas[posicao])
+                async with limite:
+                    resultado = await interpretar_triagem(embeddings[posicao], montado, llm_scheduler.PRIORIDADE_LOTE)
+        except HTTPException as e:
+            return indice, e.detail
+        except Exception as e:
+            return indice, f"Erro ao processar triagem: {str(e)}"
+
+        # Grava cada item assim que fica pronto, sem esperar o resto do lote
+        try:
+            triagem_id = await run_in_threadpool(
+                write_behind.persistir_triagem,
+                request.sintomas[indice],
+                resultado["resposta"],
+                resultado["classificacao"],
+                resultado["justificativa"],
+                resultado["condutas"]
+            )
+        except Exception as e:
+            print(f"Error saving batch triage: {e}")
+            return indice, f"Erro ao salvar triagem: {str(e)}"
+        return indice, {
+            "id": triagem_id,
+            "sintomas": request.sintomas[indice],
+            **resultado,
             "data_hora": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao processar triagem: {str(e)}")
+
+    async def eventos():
+        sucesso = 0
+        falhas = 0
+        for i, sintomas in enumerate(request.sintomas):
+            if not sintomas or not sintomas.strip():
+                falhas += 1
+                yield json.dumps({"tipo": "erro", "indice": i, "detalhe": "Sintomas não fornecidos"}, ensure_ascii=False) + "\n"
+
+        tarefas = [asyncio.ensure_future(processar(posicao)) for posicao in range(len(indices))]
+        try:
+            for concluida in asyncio.as_completed(tarefas):
+                indice, resultado = await concluida
+                if isinstance(resultado, str):
+                    falhas += 1
+                    yield json.dumps({"tipo": "erro", "indice": indice, "detalhe": resultado}, ensure_ascii=False) + "\n"
+                    continue
+                sucesso += 1
+                yield json.dumps({"tipo": "item", "indice": indice, **resultado}, ensure_ascii=False) + "\n"
+        finally:
+            # Cliente desconectado: não deixa gerações órfãs ocupando o LLM
+            # (as já concluídas foram gravadas em processar)
+            for tarefa in tarefas:
+                tarefa.cancel()
+
+        final = {"tipo": "final", "total": len(request.sintomas), "sucesso": sucesso, "falhas": falhas}
+        yield json.dumps(final, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(eventos(), media_type="application/x-ndjson")
 
 @app.get("/api/triagens")
-async def listar_triagens(filtro: str = "todas"):
+async def listar_triagens(
+    filtro: str = "todas",
+    limite: int = database.TRIAGENS_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    projecao: str = "completa"
+):
     try:
-        triagens = obter_triagens(filtro)
-        return {"triagens": triagens}
+        return await run_in_threadpool(obter_pagina_triagens, filtro, limite, cursor, projecao)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao listar triagens: {str(e)}")
 
+def serializar_exportacao(lotes, formato: str, compactar: bool):
+    """
+    Converte os lotes de linhas em blocos NDJSON ou CSV, opcionalmente em gzip
+
+    Cada lote lido do banco vira um bloco enviado ao cliente; com gzip, o
+    primeiro bloco é descarregado do compressor na hora para o download
+    começar sem esperar o buffer do zlib.
+    """
+    colunas = database.COLUNAS_COMPLETAS
+    compressor = zlib.compressobj(wbits=31) if compactar else None
+
+    def saida(texto: str, descarregar: bool = False) -> bytes:
+        dados = texto.encode("utf-8")
+        if compressor is None:
+            return dados
+        dados = compressor.compress(dados)
+        if descarregar:
+            dados += compressor.flush(zlib.Z_SYNC_FLUSH)
+        return dados
+
+    primeiro = True
+    if formato == "csv":
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        escritor.writerow(colunas)
+        yield saida(buffer.getvalue(), descarregar=True)
+        primeiro = False
+        for linhas in lotes:
+            buffer.seek(0)
+            buffer.truncate()
+            escritor.writerows(linhas)
+            yield saida(buffer.getvalue())
+    else:
+        for linhas in lotes:
+            bloco = "".join(json.dumps(dict(zip(colunas, linha)), ensure_ascii=False) + "\n" for linha in linhas)
+            yield saida(bloco, descarregar=primeiro)
+            primeiro = False
+
+    if compressor is not None:
+        yield compressor.flush()
+
+@app.get("/api/triagens/exportar")
+async def exportar_historico(
+    formato: str = "ndjson",
+    validado: Optional[bool] = None,
+    inicio: Optional[str] = None,
+    fim: Optional[str] = None,
+    classificacao: Optional[str] = None,
+    gzip: bool = False
+):
+    """
+    Exporta o histórico de triagens em streaming (NDJSON ou CSV), em ordem
+    cronológica, direto do cursor do banco
+    """
+    if formato not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Formato inválido (use ndjson ou csv)")
+    if classificacao and classificacao.upper() not in CORES + ("SEM_CLASSIFICACAO",):
+        raise HTTPException(status_code=400, detail="Classificação inválida")
+
+    lotes = database.exportar_triagens(validado, inicio, fim, classificacao)
+    nome = f"triagens.{formato}" + (".gz" if gzip else "")
+    tipo = "application/gzip" if gzip else ("text/csv; charset=utf-8" if formato == "csv" else "application/x-ndjson")
+    return StreamingResponse(
+        serializar_exportacao(lotes, formato, gzip),
+        media_type=tipo,
+        headers={"Content-Disposition": f'attachment; filename="{nome}"'}
+    )
+
+@app.get("/api/triagens/{triagem_id}")
+async def detalhar_triagem(triagem_id: str):
+    try:
+        triagem = write_behind.fila.pendente(triagem_id) or await run_in_threadpool(obter_triagem, triagem_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao obter triagem: {str(e)}")
+    if triagem is None:
+        raise HTTPException(status_code=404, detail="Triagem não encontrada")
+    return triagem
+
 @app.post("/api/validar", response_model=ValidationResponse)
 async def validar(request: ValidationRequest):
     try:
-        success = validar_triagem(request.triagem_id, request.validado_por, request.feedback)
+        # Garante que a triagem já foi gravada caso ainda esteja na fila write-behind
+        await run_in_threadpool(write_behind.fila.wait_for, request.triagem_id)
+        success = await run_in_threadpool(validar_triagem, request.triagem_id, request.validado_por, request.feedback)
         if success:
+            # Caso validado passa a ser usado na busca de similares sem reiniciar
+            try:
+                await run_in_threadpool(indexador.agendar, request.triagem_id)
+            except embedding_worker.EmbeddingWorkerError as e:
+                # O caso entra na sincronização da próxima inicialização do processo de embeddings
+                print(f"Error scheduling online indexing: {e}")
             return {"success": True, "message": "Triagem validada com sucesso"}
         else:
             return {"success": False, "message": "Erro ao validar triagem"}
@@ -425,21 +1038,17 @@ async def login(request: LoginRequest):
 @app.get("/api/estatisticas")
 async def estatisticas():
     try:
-        conn = sqlite3.connect('./validacao_triagem.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM validacao_triagem")
-        total = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM validacao_triagem WHERE validado = 1")
-        validadas = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM validacao_triagem WHERE validado = 0")
-        pendentes = cursor.fetchone()[0]
-        conn.close()
-        
-        return {
-            "total": total,
-            "validadas": validadas,
-            "pendentes": pendentes
-        }
+        return await run_in_threadpool(obter_estatisticas)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao obter estatísticas: {str(e)}")
+
+@app.get("/api/estatisticas/serie")
+async def estatisticas_serie(granularidade: str = "dia", inicio: Optional[str] = None, fim: Optional[str] = None):
+    try:
+        serie = await run_in_threadpool(obter_serie_estatisticas, granularidade, inicio, fim)
+        return {"granularidade": granularidade, "serie": serie}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao obter estatísticas: {str(e)}")
 
@@ -0,0 +1,186 @@
+"""
+Métricas da aplicação no formato de exposição do Prometheus
+
+Contadores, gauges e histogramas do `prometheus_client`, em um registro
+próprio, renderizados por `render()` (endpoint `/metrics`). Os wrappers
+daqui recebem os rótulos como argumentos nomeados (`inc(motivo="prazo")`).
+Métricas derivadas de estado que já existe em outros módulos (caches, fila
+de persistência) são registradas como funções lidas no momento da coleta.
+
+`stage()` mede um trecho do pipeline de triagem: alimenta o histograma
+`triagem_stage_seconds` e registra a duração na requisição atual, que o
+middleware devolve no cabeçalho `Server-Timing`.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import prometheus_client
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+# Séries *_created dobrariam a saída sem uso nos painéis
+prometheus_client.disable_created_metrics()
+
+registry = prometheus_client.CollectorRegistry()
+
+# Durações (ms) por etapa da requisição em andamento
+_etapas_requisicao: "contextvars.ContextVar[Optional[List[Tuple[str, float]]]]" = contextvars.ContextVar("etapas_requisicao", default=None)
+
+
+class _Metrica:
+    def __init__(self, metrica, rotulos: Sequence[str] = ()):
+        self._metrica = metrica
+        self.rotulos = tuple(rotulos)
+
+    def _serie(self, rotulos: Dict[str, str]):
+        if not self.rotulos:
+            return self._metrica
+        return self._metrica.labels(*(str(rotulos.get(rotulo, "")) for rotulo in self.rotulos))
+
+
+class Counter(_Metrica):
+    def inc(self, valor: float = 1.0, **rotulos: str) -> None:
+        self._serie(rotulos).inc(valor)
+
+
+class Gauge(_Metrica):
+    def set(self, valor: float, **rotulos: str) -> None:
+        self._serie(rotulos).set(valor)
+
+    def inc(self, valor: float = 1.0, **rotulos: str) -> None:
+        self._serie(rotulos).inc(valor)
+
+    def dec(self, valor: float = 1.0, **rotulos: str) -> None:
+        self._serie(rotulos).dec(valor)
+
+    @contextmanager
+    def track(self, **rotulos: str) -> Iterator[None]:
+        serie = self._serie(rotulos)
+        serie.inc()
+        try:
+            yield
+        finally:
+            serie.dec()
+
+
+class Histogram(_Metrica):
+    def observe(self, valor: float, **rotulos: str) -> None:
+        self._serie(rotulos).observe(valor)
+
+    @contextmanager
+    def time(self, **rotulos: str) -> Iterator[None]:
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - inicio, **rotulos)
+
+
+class FunctionMetric:
+    """
+    Métrica cujas amostras são lidas de uma função na hora da coleta
+
+    A função devolve uma lista de (valores dos rótulos, valor).
+    """
+
+    _FAMILIAS = {"counter": CounterMetricFamily, "gauge": GaugeMetricFamily}
+
+    def __init__(self, nome: str, descricao: str, tipo: str, funcao: Callable[[], List[Tuple[Sequence[str], float]]], rotulos: Sequence[str] = ()):
+        self.nome = nome
+        self.descricao = descricao
+        self.tipo = tipo
+        self.funcao = funcao
+        self.rotulos = tuple(rotulos)
+
+    def describe(self):
+        # Sem descrição prévia: o registro não chama a função ao registrar
+        return []
+
+    def collect(self):
+        familia = self._FAMILIAS[self.tipo](self.nome, self.descricao, labels=self.rotulos)
+        try:
+            amostras = self.funcao()
+        except Exception as e:
+            print(f"Error collecting metric {self.nome}: {e}")
+            amostras = []
+        for valores, valor in amostras:
+            familia.add_metric([str(valor_rotulo) for valor_rotulo in valores], valor)
+        yield familia
+
+
+def counter(nome: str, descricao: str, rotulos: Sequence[str] = ()) -> Counter:
+    return Counter(prometheus_client.Counter(nome, descricao, rotulos, registry=registry), rotulos)
+
+
+def gauge(nome: str, descricao: str, rotulos: Sequence[str] = ()) -> Gauge:
+    return Gauge(prometheus_client.Gauge(nome, descricao, rotulos, registry=registry), rotulos)
+
+
+def histogram(nome: str, descricao: str, rotulos: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return Histogram(prometheus_client.Histogram(nome, descricao, rotulos, registry=registry, buckets=buckets), rotulos)
+
+
+def function_metric(nome: str, descricao: str, tipo: str, funcao: Callable[[], List[Tuple[Sequence[str], float]]], rotulos: Sequence[str] = ()) -> FunctionMetric:
+    metrica = FunctionMetric(nome, descricao, tipo, funcao, rotulos)
+    registry.register(metrica)
+    return metrica
+
+
+def render() -> str:
+    return prometheus_client.generate_latest(registry).decode("utf-8")
+
+
+# Métricas compartilhadas entre os módulos
+STAGE_SECONDS = histogram("triagem_stage_seconds", "Duração de cada etapa do pipeline de triagem", ("stage",))
+HTTP_REQUEST_SECONDS = histogram("http_request_duration_seconds", "Duração das requisições HTTP", ("method", "route", "status"))
+HTTP_IN_FLIGHT = gauge("http_requests_in_flight", "Requisições HTTP em andamento")
+LLM_IN_FLIGHT = gauge("llm_requests_in_flight", "Gerações em andamento no Ollama")
+LLM_PROMPT_TOKENS = histogram("llm_prompt_tokens", "Tokens do prompt avaliados pelo Ollama por geração", buckets=TOKEN_BUCKETS)
+LLM_COMPLETION_TOKENS = histogram("llm_completion_tokens", "Tokens gerados pelo Ollama por geração", buckets=TOKEN_BUCKETS)
+LLM_TIME_TO_FIRST_TOKEN = histogram("llm_time_to_first_token_seconds", "Tempo até o primeiro fragmento nas gerações em streaming")
+LLM_ERRORS = counter("llm_errors_total", "Falhas ao chamar o Ollama")
+EMBEDDING_BATCH_SIZE = histogram("embedding_batch_size", "Textos por passada do modelo de embeddings", buckets=BATCH_BUCKETS)
+DB_POOL_WAIT_SECONDS = histogram("db_pool_wait_seconds", "Espera por uma conexão do pool do SQLite", buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+
+
+def begin_request() -> contextvars.Token:
+    """Começa a registrar as etapas da requisição atual"""
+    return _etapas_requisicao.set([])
+
+
+def end_request(token: contextvars.Token) -> List[Tuple[str, float]]:
+    """Encerra o registro e devolve as etapas (nome, ms) medidas"""
+    etapas = _etapas_requisicao.get() or []
+    _etapas_requisicao.reset(token)
+    return etapas
+
+
+def record_stage(nome: str, segundos: float) -> None:
+    STAGE_SECONDS.observe(segundos, stage=nome)
+    etapas = _etapas_requisicao.get()
+    if etapas is not None:
+        etapas.append((nome, segundos * 1000))
+
+
+@contextmanager
+def stage(nome: str) -> Iterator[None]:
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(nome, time.perf_counter() - inicio)
+
+
+def server_timing(etapas: List[Tuple[str, float]], total_ms: float) -> str:
+    """Valor do cabeçalho Server-Timing (etapas repetidas são somadas)"""
+    somas: Dict[str, float] = {}
+    for nome, ms in etapas:
+        somas[nome] = somas.get(nome, 0.0) + ms
+    partes = [f"{nome};dur={ms:.1f}" for nome, ms in somas.items()]
+    partes.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(partes)
@@ -2,6 +2,15 @@
 Módulo para fornecer respostas simuladas quando o Ollama não estiver disponível
 """
 
+# Termos que caracterizam cada cor, na ordem em que são avaliados
+TERMOS_POR_COR = {
+    "vermelho": ["parada", "inconsciente", "choque", "não responde", "sangramento intenso"],
+    "laranja": ["dor torácica", "dispneia grave", "confusão", "convulsão"],
+    "amarelo": ["febre alta", "vômitos", "desidratação", "dor moderada"],
+    "verde": ["dor leve", "tosse", "resfriado", "mal estar"],
+    "azul": ["renovação", "atestado", "crônico", "consulta de rotina"],
+}
+
 def get_mock_response(sintomas):
     """
     Retorna uma resposta simulada baseada nos sintomas
@@ -15,7 +24,7 @@ def get_mock_response(sintomas):
     sintomas_lower = sintomas.lower()
     
     # Caso de emergência (vermelho)
-    if any(termo in sintomas_lower for termo in ["parada", "inconsciente", "choque", "não responde", "sangramento intenso"]):
+    if any(termo in sintomas_lower for termo in TERMOS_POR_COR["vermelho"]):
         return """Classificação
 vermelho
 
@@ -30,7 +39,7 @@ Condutas
 - Exames laboratoriais de emergência (gasometria, eletrólitos, hemograma)"""
 
     # Caso muito urgente (laranja)
-    elif any(termo in sintomas_lower for termo in ["dor torácica", "dispneia grave", "confusão", "convulsão"]):
+    elif any(termo in sintomas_lower for termo in TERMOS_POR_COR["laranja"]):
         return """Classificação
 laranja
 
@@ -46,7 +55,7 @@ Condutas
 - Administração de AAS conforme protocolo"""
 
     # Caso urgente (amarelo)
-    elif any(termo in sintomas_lower for termo in ["febre alta", "vômitos", "desidratação", "dor moderada"]):
+    elif any(termo in sintomas_lower for termo in TERMOS_POR_COR["amarelo"]):
         return """Classificação
 amarelo
 
@@ -60,7 +69,7 @@ Condutas
 - Reavaliação médica em até 60 minutos"""
 
     # Caso pouco urgente (verde)
-    elif any(termo in sintomas_lower for termo in ["dor leve", "tosse", "resfriado", "mal estar"]):
+    elif any(termo in sintomas_lower for termo in TERMOS_POR_COR["verde"]):
         return """Classificação
 verde
 
@@ -74,7 +83,7 @@ Condutas
 - Retorno se piora ou persistência dos sintomas"""
 
     # Caso não urgente (azul)
-    elif any(termo in sintomas_lower for termo in ["renovação", "atestado", "crônico", "consulta de rotina"]):
+    elif any(termo in sintomas_lower for termo in TERMOS_POR_COR["azul"]):
         return """Classificação
 azul
 
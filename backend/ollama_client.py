@@ -0,0 +1,244 @@
+"""
+Cliente HTTP assíncrono para o Ollama
+
+Mantém um único httpx.AsyncClient compartilhado pela aplicação, com pool de
+conexões keep-alive, timeouts de conexão/leitura configuráveis e um número
+limitado de novas tentativas com backoff exponencial. O `warmer` mantém o
+modelo carregado no Ollama com uma requisição mínima quando a API fica ociosa.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+import metrics
+
+# Configuração (pode ser sobrescrita por variáveis de ambiente / .env)
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "mistral")
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "30"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "10"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "10"))
+OLLAMA_MAX_RETRIES = int(os.getenv("OLLAMA_MAX_RETRIES", "2"))
+OLLAMA_RETRY_BACKOFF = float(os.getenv("OLLAMA_RETRY_BACKOFF", "0.5"))
+# Quanto tempo o Ollama mantém o modelo na memória após cada requisição
+# (duração como "30m" ou segundos; "-1" mantém indefinidamente)
+_keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_KEEP_ALIVE = int(_keep_alive) if _keep_alive.lstrip("-").isdigit() else _keep_alive
+# Intervalo (segundos) do ping que mantém o modelo aquecido; 0 desativa
+OLLAMA_WARM_INTERVAL = float(os.getenv("OLLAMA_WARM_INTERVAL", "120"))
+
+# Erros transitórios que justificam uma nova tentativa. Um timeout de leitura
+# NÃO entra aqui: a geração pode já estar em andamento no servidor.
+RETRYABLE_ERRORS = (
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httpx.PoolTimeout,
+    httpx.RemoteProtocolError,
+)
+RETRYABLE_STATUS = {502, 503, 504}
+
+_client: Optional[httpx.AsyncClient] = None
+# Instante (time.monotonic) da última requisição enviada ao Ollama
+_ultimo_uso = 0.0
+
+
+class OllamaError(Exception):
+    """Erro ao se comunicar com o servidor Ollama"""
+
+
+def _build_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=OLLAMA_BASE_URL,
+        timeout=httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+        ),
+    )
+
+
+async def start_client() -> None:
+    """
+    Cria o cliente compartilhado (chamado no startup da aplicação)
+    """
+    global _client
+    if _client is None:
+        _client = _build_client()
+
+
+async def close_client() -> None:
+    """
+    Fecha o cliente compartilhado e suas conexões (chamado no shutdown)
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Retorna o cliente compartilhado, criando-o se o startup ainda não rodou
+    (por exemplo, em scripts que importam o módulo diretamente)
+    """
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+
+def _backoff(attempt: int) -> float:
+    return OLLAMA_RETRY_BACKOFF * (2 ** attempt)
+
+
+def _registrar_tokens(resposta: Dict[str, Any]) -> None:
+    if "prompt_eval_count" in resposta:
+        metrics.LLM_PROMPT_TOKENS.observe(resposta["prompt_eval_count"])
+    if "eval_count" in resposta:
+        metrics.LLM_COMPLETION_TOKENS.observe(resposta["eval_count"])
+
+
+async def generate(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Envia uma requisição não-streaming para /api/generate
+
+    Args:
+        payload: Corpo da requisição no formato da API do Ollama
+
+    Returns:
+        Dict[str, Any]: O JSON retornado pelo Ollama
+
+    Raises:
+        OllamaError: Se o Ollama não responder após todas as tentativas
+    """
+    global _ultimo_uso
+    client = get_client()
+    last_error: Optional[Exception] = None
+    _ultimo_uso = time.monotonic()
+
+    with metrics.LLM_IN_FLIGHT.track():
+        for attempt in range(OLLAMA_MAX_RETRIES + 1):
+            try:
+                response = await client.post("/api/generate", json=payload)
+                if response.status_code in RETRYABLE_STATUS:
+                    last_error = OllamaError(f"Ollama respondeu {response.status_code}")
+                else:
+                    response.raise_for_status()
+                    resultado = response.json()
+                    _registrar_tokens(resultado)
+                    return resultado
+            except RETRYABLE_ERRORS as e:
+                last_error = e
+            except httpx.HTTPError as e:
+                metrics.LLM_ERRORS.inc()
+                raise OllamaError(str(e)) from e
+
+            if attempt < OLLAMA_MAX_RETRIES:
+                await asyncio.sleep(_backoff(attempt))
+
+    metrics.LLM_ERRORS.inc()
+    raise OllamaError(f"Falha após {OLLAMA_MAX_RETRIES + 1} tentativas: {last_error}")
+
+
+async def stream_generate(payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Envia uma requisição em streaming para /api/generate
+
+    Só tenta novamente enquanto nenhum fragmento foi entregue ao chamador;
+    depois disso, qualquer falha é propagada como OllamaError.
+
+    Args:
+        payload: Corpo da requisição no formato da API do Ollama
+
+    Yields:
+        Dict[str, Any]: Cada objeto NDJSON enviado pelo Ollama
+    """
+    global _ultimo_uso
+    client = get_client()
+    payload = {**payload, "stream": True}
+    _ultimo_uso = time.monotonic()
+    inicio = time.perf_counter()
+    last_error: Optional[Exception] = None
+    started = False
+
+    with metrics.LLM_IN_FLIGHT.track():
+        for attempt in range(OLLAMA_MAX_RETRIES + 1):
+            try:
+                async with client.stream("POST", "/api/generate", json=payload) as response:
+                    if response.status_code in RETRYABLE_STATUS:
+                        last_error = OllamaError(f"Ollama respondeu {response.status_code}")
+                    else:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if not line:
+                                continue
+                            chunk = json.loads(line)
+                            if not started:
+                                metrics.LLM_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - inicio)
+                            started = True
+                            if chunk.get("done"):
+                                _registrar_tokens(chunk)
+                            yield chunk
+                        return
+            except RETRYABLE_ERRORS as e:
+                if started:
+                    metrics.LLM_ERRORS.inc()
+                    raise OllamaError(str(e)) from e
+                last_error = e
+            except httpx.HTTPError as e:
+                metrics.LLM_ERRORS.inc()
+                raise OllamaError(str(e)) from e
+
+            if attempt < OLLAMA_MAX_RETRIES:
+                await asyncio.sleep(_backoff(attempt))
+
+    metrics.LLM_ERRORS.inc()
+    raise OllamaError(f"Falha após {OLLAMA_MAX_RETRIES + 1} tentativas: {last_error}")
+
+
+class ModelWarmer:
+    """
+    Envia periodicamente uma geração mínima quando nenhuma outra requisição
+    chegou ao Ollama no último intervalo, para que o modelo (e o prefixo do
+    prompt de sistema já processado) não seja descarregado entre picos
+    """
+
+    def __init__(self, interval: float = OLLAMA_WARM_INTERVAL):
+        self.interval = interval
+        self.pings = 0
+        self._task: Optional["asyncio.Task"] = None
+
+    def start(self, payload: Dict[str, Any]) -> None:
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.ensure_future(self._run(payload))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, payload: Dict[str, Any]) -> None:
+        # O primeiro ping carrega o modelo logo na inicialização
+        ocioso = self.interval
+        while True:
+            if ocioso >= self.interval:
+                try:
+                    await generate(payload)
+                    self.pings += 1
+                except OllamaError as e:
+                    print(f"Error keeping Ollama model warm: {e}")
+                ocioso = 0.0
+            await asyncio.sleep(self.interval - ocioso)
+            ocioso = time.monotonic() - _ultimo_uso
+
+
+warmer = ModelWarmer()
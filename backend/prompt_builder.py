@@ -0,0 +1,145 @@
+"""
+Montagem do prompt de triagem com orçamento de tokens
+
+Os casos similares recuperados do ChromaDB entram no prompt em ordem de
+similaridade, cada um com os sintomas e o desfecho validado em forma
+compacta (classificação e primeiras condutas). Casos quase idênticos a um
+já incluído são descartados, cada caso é truncado em
+PROMPT_CASE_MAX_TOKENS e a seção inteira respeita o que sobra de
+PROMPT_MAX_TOKENS depois do prompt de sistema e dos sintomas.
+
+A contagem de tokens é uma estimativa (sem carregar o tokenizer do Mistral):
+palavras contam um token a cada quatro caracteres e pontuação conta um token.
+"""
+import math
+import os
+import re
+from typing import Any, Dict, List, Optional, Set
+
+from fast_path import normalize
+from llm_parser import parse_llm_response
+
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "1536"))
+PROMPT_CASE_MAX_TOKENS = int(os.getenv("PROMPT_CASE_MAX_TOKENS", "160"))
+PROMPT_MAX_CASES = int(os.getenv("PROMPT_MAX_CASES", "3"))
+# Casos pedidos ao ChromaDB: alguns a mais que PROMPT_MAX_CASES, para
+# compensar os descartados como duplicados
+PROMPT_CANDIDATE_CASES = int(os.getenv("PROMPT_CANDIDATE_CASES", "6"))
+PROMPT_DEDUP_THRESHOLD = float(os.getenv("PROMPT_DEDUP_THRESHOLD", "0.8"))
+PROMPT_CONDUTAS_MAX = 2
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_PALAVRA = re.compile(r"\w+")
+
+
+def count_tokens(text: str) -> int:
+    """Estimativa do número de tokens de um texto"""
+    total = 0
+    for token in _TOKEN.findall(text):
+        total += math.ceil(len(token) / 4) if token[0].isalnum() or token[0] == "_" else 1
+    return total
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Corta o texto no fim da última palavra que cabe em `max_tokens`,
+    marcando o corte com reticências
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    total = 0
+    fim = 0
+    for match in _TOKEN.finditer(text):
+        token = match.group()
+        custo = math.ceil(len(token) / 4) if token[0].isalnum() or token[0] == "_" else 1
+        # Reserva um token para as reticências
+        if total + custo > max_tokens - 1:
+            break
+        total += custo
+        fim = match.end()
+    return text[:fim].rstrip(" ,;:-") + "…"
+
+
+def _palavras(text: str) -> Set[str]:
+    return set(_PALAVRA.findall(normalize(text)))
+
+
+def _similaridade(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 1.0 if a == b else 0.0
+    return len(a & b) / len(a | b)
+
+
+def compact_outcome(resposta: str) -> str:
+    """
+    Resume a resposta validada de um caso em classificação + primeiras condutas
+    """
+    if not resposta:
+        return ""
+    classificacao, _, condutas = parse_llm_response(resposta, structured=resposta.lstrip().startswith("{"))
+    itens = [linha.strip().lstrip("-•* ").strip() for linha in condutas.splitlines()]
+    itens = [item for item in itens if item][:PROMPT_CONDUTAS_MAX]
+    partes = []
+    if classificacao:
+        partes.append(f"Classificação validada: {classificacao}")
+    if itens:
+        partes.append(f"Condutas: {'; '.join(itens)}")
+    return " | ".join(partes)
+
+
+def build_prompt_input(sintomas: str, metadatas: List[Dict[str, Any]], reserved_tokens: int = 0, max_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Monta a parte variável do prompt (sintomas + casos similares)
+
+    Args:
+        sintomas: Sintomas do novo caso
+        metadatas: Metadados dos casos recuperados, do mais para o menos similar
+        reserved_tokens: Tokens já ocupados por outras partes do prompt (sistema)
+        max_tokens: Orçamento total do prompt (padrão PROMPT_MAX_TOKENS)
+
+    Returns:
+        Dict[str, Any]: "texto" montado, "tokens" estimados (incluindo os
+        reservados), "casos" incluídos e "descartados" (duplicados ou sem espaço)
+    """
+    orcamento = (PROMPT_MAX_TOKENS if max_tokens is None else max_tokens) - reserved_tokens
+    cabecalho = f"Sintomas do novo caso: {sintomas}\n\nCasos Similares:"
+    usados = count_tokens(cabecalho)
+
+    linhas: List[str] = []
+    incluidos: List[Set[str]] = []
+    descartados = 0
+    for metadata in metadatas:
+        if len(linhas) >= PROMPT_MAX_CASES:
+            descartados += 1
+            continue
+        conteudo = metadata.get("content", "")
+        palavras = _palavras(conteudo)
+        if any(_similaridade(palavras, outras) >= PROMPT_DEDUP_THRESHOLD for outras in incluidos):
+            descartados += 1
+            continue
+
+        desfecho = compact_outcome(metadata.get("resposta", ""))
+        caso = truncate_to_tokens(conteudo, PROMPT_CASE_MAX_TOKENS)
+        linha = f"\n{len(linhas) + 1}. {caso}"
+        if desfecho:
+            linha += f" → {desfecho}"
+        custo = count_tokens(linha)
+        if usados + custo > orcamento:
+            # Sem espaço para o caso inteiro: tenta só os sintomas truncados
+            restante = orcamento - usados - count_tokens(f"\n{len(linhas) + 1}. ")
+            if restante < 16:
+                descartados += 1
+                continue
+            linha = f"\n{len(linhas) + 1}. {truncate_to_tokens(conteudo, restante)}"
+            custo = count_tokens(linha)
+        linhas.append(linha)
+        incluidos.append(palavras)
+        usados += custo
+
+    texto = cabecalho + ("".join(linhas) if linhas else " nenhum")
+    return {
+        "texto": texto,
+        "tokens": reserved_tokens + count_tokens(texto),
+        "casos": len(linhas),
+        "descartados": descartados,
+    }
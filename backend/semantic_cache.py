@@ -0,0 +1,100 @@
+"""
+Cache semântico de respostas de triagem
+
+Guarda o resultado já interpretado (classificação, justificativa e condutas)
+das triagens recentes junto com o embedding dos sintomas. Uma nova consulta
+cujo embedding tenha similaridade de cosseno acima do limiar com uma entrada
+válida reaproveita esse resultado sem chamar o LLM. As entradas expiram por
+TTL, o cache tem tamanho limitado (sai a mais antiga) e é esvaziado quando a
+versão do prompt/modelo muda.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.97"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "600"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "256"))
+
+
+class SemanticCache:
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, ttl: float = SEMANTIC_CACHE_TTL, max_size: int = SEMANTIC_CACHE_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self.versao: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self._entradas: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._proximo_id = 0
+        self._lock = threading.Lock()
+
+    def set_version(self, versao: str) -> None:
+        """
+        Define a versão do prompt/modelo; uma versão diferente invalida tudo
+        """
+        with self._lock:
+            if versao != self.versao:
+                self._entradas.clear()
+                self.versao = versao
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+
+    def _expirar(self, agora: float) -> None:
+        while self._entradas:
+            entrada = next(iter(self._entradas.values()))
+            if agora - entrada["criado_em"] <= self.ttl:
+                break
+            self._entradas.popitem(last=False)
+
+    @staticmethod
+    def _normalizar(vetor: List[float]) -> np.ndarray:
+        v = np.asarray(vetor, dtype=np.float32)
+        norma = np.linalg.norm(v)
+        return v / norma if norma > 0 else v
+
+    def lookup(self, vetor: List[float]) -> Optional[Dict[str, Any]]:
+        """
+        Retorna o resultado da entrada mais similar, se acima do limiar
+        """
+        consulta = self._normalizar(vetor)
+        with self._lock:
+            self._expirar(time.monotonic())
+            if not self._entradas:
+                self.misses += 1
+                return None
+            entradas = list(self._entradas.values())
+            similaridades = np.stack([entrada["vetor"] for entrada in entradas]) @ consulta
+            melhor = int(np.argmax(similaridades))
+            if similaridades[melhor] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(entradas[melhor]["resultado"])
+
+    def store(self, vetor: List[float], resultado: Dict[str, Any]) -> None:
+        with self._lock:
+            agora = time.monotonic()
+            self._expirar(agora)
+            self._entradas[self._proximo_id] = {
+                "vetor": self._normalizar(vetor),
+                "resultado": dict(resultado),
+                "criado_em": agora,
+            }
+            self._proximo_id += 1
+            while len(self._entradas) > self.max_size:
+                self._entradas.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "itens": len(self._entradas)}
+
+
+cache = SemanticCache()
@@ -0,0 +1,43 @@
+"""
+Coalescência (single-flight) de requisições de triagem idênticas em andamento
+
+Requisições concorrentes com a mesma chave aguardam uma única execução e
+recebem o mesmo resultado. A execução roda em uma task própria, então o
+cancelamento de quem a iniciou (cliente desconectado) não afeta os demais.
+"""
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict
+
+from embedding_cache import normalize_text
+
+
+def triage_key(sintomas: str, prompt_version: str) -> str:
+    """
+    Chave de coalescência: sintomas normalizados (Unicode, espaços e caixa)
+    mais a versão do prompt
+    """
+    conteudo = f"{prompt_version}\x00{normalize_text(sintomas).casefold()}"
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._em_andamento: Dict[str, "asyncio.Task"] = {}
+        self.coalescidas = 0
+
+    async def do(self, chave: str, funcao: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._em_andamento.get(chave)
+        if task is None:
+            task = asyncio.ensure_future(funcao())
+            self._em_andamento[chave] = task
+            task.add_done_callback(lambda _: self._em_andamento.pop(chave, None))
+        else:
+            self.coalescidas += 1
+        return await asyncio.shield(task)
+
+    def em_andamento(self) -> int:
+        return len(self._em_andamento)
+
+
+triagens = SingleFlight()
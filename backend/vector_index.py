@@ -0,0 +1,294 @@
+"""
+Sincronização incremental do índice vetorial (ChromaDB) com os casos validados
+
+A tabela `indice_vetorial` registra, para cada triagem validada já indexada,
+o hash do conteúdo enviado ao ChromaDB. Na inicialização apenas as linhas
+novas ou alteradas são embedadas e enviadas com upsert, em lotes; linhas que
+deixaram de estar validadas são removidas da coleção. Se a coleção e a
+tabela divergem (ex.: `chroma_db` apagado), a tabela é corrigida antes.
+"""
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import embedding
+from database import get_connection
+
+COLLECTION_NAME = "triagem_hci"
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_db")
+INDEX_SYNC_BATCH_SIZE = int(os.getenv("INDEX_SYNC_BATCH_SIZE", "64"))
+# Tempo que o indexador online espera para juntar validações em um lote
+ONLINE_INDEX_FLUSH_MS = float(os.getenv("ONLINE_INDEX_FLUSH_MS", "500"))
+
+
+def init_index_table():
+    with get_connection() as conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS indice_vetorial (
+            triagem_id TEXT PRIMARY KEY,
+            hash TEXT NOT NULL,
+            data_indexacao TEXT NOT NULL
+        )
+        ''')
+        conn.commit()
+
+
+def content_hash(sintomas: str, resposta: str) -> str:
+    # Inclui a assinatura do modelo: trocar modelo ou modo de inferência reindexa tudo
+    conteudo = f"{embedding.MODEL_SIGNATURE}\x00{sintomas}\x00{resposta}"
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+
+def case_id(triagem_id: str) -> str:
+    return f"validated_case_{triagem_id}"
+
+
+def _casos_pendentes(cursor, triagem_ids: Optional[List[str]] = None) -> List[Tuple[str, str, str, str]]:
+    """
+    Casos validados cujo hash não está registrado ou mudou desde a última indexação
+
+    Args:
+        triagem_ids: Restringe a verificação a estes ids (todos, se None)
+    """
+    query = '''
+    SELECT v.id, v.sintomas, v.resposta, i.hash
+    FROM validacao_triagem v
+    LEFT JOIN indice_vetorial i ON i.triagem_id = v.id
+    WHERE v.validado = 1
+    '''
+    parametros: List[str] = []
+    if triagem_ids is not None:
+        query += f" AND v.id IN ({','.join('?' * len(triagem_ids))})"
+        parametros = list(triagem_ids)
+    cursor.execute(query, parametros)
+    pendentes = []
+    for triagem_id, sintomas, resposta, hash_indexado in cursor.fetchall():
+        hash_atual = content_hash(sintomas, resposta)
+        if hash_atual != hash_indexado:
+            pendentes.append((triagem_id, sintomas, resposta, hash_atual))
+    return pendentes
+
+
+def _casos_removidos(cursor) -> List[str]:
+    cursor.execute('''
+    SELECT triagem_id FROM indice_vetorial
+    WHERE triagem_id NOT IN (SELECT id FROM validacao_triagem WHERE validado = 1)
+    ''')
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _reconciliar(collection, cursor) -> None:
+    """
+    Confere os ids da coleção com os registrados em `indice_vetorial`
+
+    Se o ChromaDB foi apagado ou recriado com a tabela ainda preenchida, os
+    casos rastreados que não estão na coleção perdem o registro e voltam a
+    ficar pendentes; ids da coleção sem registro na tabela são removidos.
+    Só os ids são lidos da coleção, sem embeddings nem metadados.
+    """
+    cursor.execute("SELECT triagem_id FROM indice_vetorial")
+    rastreados = {case_id(row[0]): row[0] for row in cursor.fetchall()}
+    na_colecao = set(collection.get(include=[])["ids"])
+    perdidos = [triagem_id for id_caso, triagem_id in rastreados.items() if id_caso not in na_colecao]
+    sobrando = [id_caso for id_caso in na_colecao if id_caso not in rastreados]
+    if not perdidos and not sobrando:
+        return
+    if sobrando:
+        collection.delete(ids=sobrando)
+    if perdidos:
+        cursor.executemany("DELETE FROM indice_vetorial WHERE triagem_id = ?", [(triagem_id,) for triagem_id in perdidos])
+    cursor.connection.commit()
+    print(f"Vector index out of sync with indice_vetorial: {len(perdidos)} cases to reindex, {len(sobrando)} untracked removed")
+
+
+def open_collection(chroma_client):
+    """
+    Abre a coleção persistida; se ainda não há nada registrado em
+    `indice_vetorial` (primeira execução ou coleção montada pela versão
+    antiga), recria a coleção para não manter ids sem rastreamento
+    """
+    with get_connection() as conn:
+        rastreados = conn.execute("SELECT COUNT(*) FROM indice_vetorial").fetchone()[0]
+
+    if rastreados == 0:
+        try:
+            chroma_client.delete_collection(COLLECTION_NAME)
+        except Exception:
+            pass
+    return chroma_client.get_or_create_collection(name=COLLECTION_NAME)
+
+
+def upsert_cases(collection, cursor, casos: List[Tuple[str, str, str, str]]) -> None:
+    """
+    Embeda e envia um lote de casos ao ChromaDB, registrando o hash de cada um
+    """
+    embeddings = embedding.embed_texts([caso[1] for caso in casos])
+    if embeddings is None:
+        raise RuntimeError("Falha ao gerar embeddings do lote")
+
+    collection.upsert(
+        embeddings=embeddings,
+        ids=[case_id(caso[0]) for caso in casos],
+        metadatas=[
+            {"content": sintomas, "resposta": resposta}
+            for _, sintomas, resposta, _ in casos
+        ]
+    )
+    data_indexacao = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cursor.executemany(
+        "INSERT OR REPLACE INTO indice_vetorial (triagem_id, hash, data_indexacao) VALUES (?, ?, ?)",
+        [(caso[0], caso[3], data_indexacao) for caso in casos]
+    )
+
+
+def index_cases(collection, triagem_ids: List[str]) -> int:
+    """
+    Indexa os casos validados destes ids que ainda não estão no ChromaDB
+    (ou cujo conteúdo mudou)
+
+    Returns:
+        int: Quantidade de casos enviados ao ChromaDB
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        casos = _casos_pendentes(cursor, triagem_ids)
+        if casos:
+            upsert_cases(collection, cursor, casos)
+            conn.commit()
+        return len(casos)
+
+
+def sync_index(collection) -> Dict[str, int]:
+    """
+    Sincroniza a coleção com os casos validados do banco
+
+    Cada lote é confirmado no banco só depois do upsert no ChromaDB, então
+    uma interrupção no meio da sincronização apenas deixa o restante para a
+    próxima execução. Se a coleção perdeu casos registrados (ChromaDB apagado
+    ou recriado), eles são reindexados.
+
+    Returns:
+        Dict[str, int]: Quantidade de casos indexados e removidos
+    """
+    indexados = 0
+    removidos = 0
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            _reconciliar(collection, cursor)
+            removidos_ids = _casos_removidos(cursor)
+            if removidos_ids:
+                collection.delete(ids=[case_id(triagem_id) for triagem_id in removidos_ids])
+                cursor.executemany(
+                    "DELETE FROM indice_vetorial WHERE triagem_id = ?",
+                    [(triagem_id,) for triagem_id in removidos_ids]
+                )
+                conn.commit()
+                removidos = len(removidos_ids)
+
+            pendentes = _casos_pendentes(cursor)
+            for inicio in range(0, len(pendentes), INDEX_SYNC_BATCH_SIZE):
+                lote = pendentes[inicio:inicio + INDEX_SYNC_BATCH_SIZE]
+                upsert_cases(collection, cursor, lote)
+                conn.commit()
+                indexados += len(lote)
+    except Exception as e:
+        print(f"Error syncing vector index: {e}")
+
+    return {"indexados": indexados, "removidos": removidos}
+
+
+def prepare_collection():
+    """
+    Abre o ChromaDB em CHROMA_PATH, sincroniza a coleção com os casos
+    validados (só linhas novas ou alteradas) e inicia o indexador online
+
+    Returns:
+        tuple: O cliente do ChromaDB e a coleção
+    """
+    import chromadb
+    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+
+    init_index_table()
+    collection = open_collection(chroma_client)
+    resultado_sync = sync_index(collection)
+    print(f"Vector index synced: {resultado_sync}")
+    indexer.start(collection)
+    return chroma_client, collection
+
+
+class OnlineIndexer:
+    """
+    Indexa em segundo plano as triagens validadas durante a execução
+
+    `agendar` só registra o id (validações repetidas do mesmo caso antes do
+    próximo lote são agrupadas); uma thread junta os ids por até
+    ONLINE_INDEX_FLUSH_MS e os envia ao ChromaDB em lotes, pulando os casos
+    cujo conteúdo já está indexado.
+    """
+
+    def __init__(self, batch_size: int = INDEX_SYNC_BATCH_SIZE, flush_ms: float = ONLINE_INDEX_FLUSH_MS):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_ms) / 1000.0
+        self.collection = None
+        self._pendentes: Dict[str, None] = {}
+        self._condicao = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._parar = False
+
+    def start(self, collection) -> None:
+        with self._condicao:
+            self.collection = collection
+            self._parar = False
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="online-indexer", daemon=True)
+                self._thread.start()
+            self._condicao.notify_all()
+
+    def stop(self) -> None:
+        with self._condicao:
+            self._parar = True
+            self._condicao.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def agendar(self, triagem_id: str) -> None:
+        with self._condicao:
+            self._pendentes[triagem_id] = None
+            self._condicao.notify_all()
+
+    def _proximo_lote(self) -> Optional[List[str]]:
+        with self._condicao:
+            while not self._parar and (not self._pendentes or self.collection is None):
+                self._condicao.wait()
+            if self._parar:
+                return None
+            # Dá um tempo para outras validações entrarem no mesmo lote
+            deadline = time.monotonic() + self.flush_interval
+            while not self._parar and len(self._pendentes) < self.batch_size:
+                restante = deadline - time.monotonic()
+                if restante <= 0:
+                    break
+                self._condicao.wait(restante)
+            lote = list(self._pendentes)[:self.batch_size]
+            for triagem_id in lote:
+                del self._pendentes[triagem_id]
+            return lote
+
+    def _run(self) -> None:
+        while True:
+            lote = self._proximo_lote()
+            if lote is None:
+                return
+            try:
+                index_cases(self.collection, lote)
+            except Exception as e:
+                # Os casos continuam sem hash registrado e entram na próxima sincronização
+                print(f"Error indexing validated cases online: {e}")
+
+
+indexer = OnlineIndexer()
@@ -0,0 +1,209 @@
+"""
+Persistência write-behind dos resultados de triagem
+
+No modo "batched", os registros vão para uma fila em memória limitada e uma
+thread de escrita os grava em transações agrupadas, quando o lote atinge
+WRITE_BEHIND_BATCH_SIZE ou após WRITE_BEHIND_FLUSH_MS. O id é gerado antes
+da gravação, então a resposta da API não espera o commit. No modo "sync"
+(padrão) cada triagem é gravada na hora, como antes. Com a fila cheia por
+mais de WRITE_BEHIND_ENQUEUE_TIMEOUT segundos (banco lento ou indisponível),
+`enqueue` desiste com `FilaDeGravacaoCheia`, que a API devolve como 503.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import database
+import metrics
+
+PERSISTENCIA_MODO = os.getenv("PERSISTENCIA_MODO", "sync").lower()
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "1000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "50"))
+WRITE_BEHIND_FLUSH_MS = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "200"))
+# Espera máxima por uma vaga na fila antes de recusar a gravação
+WRITE_BEHIND_ENQUEUE_TIMEOUT = float(os.getenv("WRITE_BEHIND_ENQUEUE_TIMEOUT", "2"))
+WRITE_BEHIND_RETRY_SECONDS = 1.0
+# Tentativas de gravar um lote com o banco ocupado/travado antes de passar a
+# gravar linha a linha
+WRITE_BEHIND_MAX_TENTATIVAS = int(os.getenv("WRITE_BEHIND_MAX_TENTATIVAS", "5"))
+
+WRITE_BEHIND_REJECTED = metrics.counter("write_behind_rejected_total", "Gravações recusadas com a fila write-behind cheia")
+WRITE_BEHIND_DROPPED = metrics.counter("write_behind_dropped_total", "Triagens descartadas por erro ao gravar na fila write-behind")
+
+
+class FilaDeGravacaoCheia(Exception):
+    """Gravação recusada: a fila write-behind continuou cheia durante toda a espera"""
+
+    status_code = 503
+    retry_after = 5
+
+
+class WriteBehindQueue:
+    def __init__(self, max_queue: int = WRITE_BEHIND_MAX_QUEUE, batch_size: int = WRITE_BEHIND_BATCH_SIZE, flush_ms: float = WRITE_BEHIND_FLUSH_MS):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_ms) / 1000.0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, max_queue))
+        # Registros aceitos e ainda não gravados, para leitura e espera por id
+        self._pendentes: Dict[str, Dict[str, Any]] = {}
+        self._gravados = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Para a thread de escrita depois de gravar tudo o que está na fila
+        """
+        if self._thread is not None:
+            self._stopping.set()
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def enqueue(self, triagem: Dict[str, Any], timeout: float = WRITE_BEHIND_ENQUEUE_TIMEOUT) -> None:
+        """
+        Coloca a triagem na fila de gravação
+
+        Raises:
+            FilaDeGravacaoCheia: Se a fila não abrir uma vaga dentro do prazo
+        """
+        with self._gravados:
+            self._pendentes[triagem["id"]] = triagem
+        try:
+            self._queue.put(triagem, timeout=max(0.0, timeout))
+        except queue.Full:
+            # Contrapressão: a escrita não acompanha, então recusa em vez de
+            # gravar na thread da requisição (que tentaria indefinidamente)
+            with self._gravados:
+                self._pendentes.pop(triagem["id"], None)
+                self._gravados.notify_all()
+            WRITE_BEHIND_REJECTED.inc()
+            raise FilaDeGravacaoCheia("Fila de gravação cheia") from None
+
+    def pendente(self, triagem_id: str) -> Optional[Dict[str, Any]]:
+        """Registro aceito e ainda não gravado, no formato de database.obter_triagem"""
+        with self._gravados:
+            triagem = self._pendentes.get(triagem_id)
+        return None if triagem is None else database.triagem_nao_gravada(triagem)
+
+    def pendentes(self) -> int:
+        with self._gravados:
+            return len(self._pendentes)
+
+    def wait_for(self, triagem_id: str, timeout: float = 5.0) -> bool:
+        """
+        Aguarda até que o registro com este id tenha sido gravado
+        """
+        deadline = time.monotonic() + timeout
+        with self._gravados:
+            while triagem_id in self._pendentes:
+                restante = deadline - time.monotonic()
+                if restante <= 0:
+                    return False
+                self._gravados.wait(restante)
+        return True
+
+    def _coletar(self, primeiro) -> List[Dict[str, Any]]:
+        lote = [primeiro]
+        deadline = time.monotonic() + self.flush_interval
+        while len(lote) < self.batch_size:
+            restante = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=restante) if restante > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Sinal de parada: _run encerra quando a fila esvaziar
+                break
+            lote.append(item)
+        return lote
+
+    def _gravar(self, lote: List[Dict[str, Any]]) -> None:
+        """
+        Grava o lote em uma transação
+
+        Só erros de banco ocupado/travado (OperationalError) são tentados de
+        novo, até WRITE_BEHIND_MAX_TENTATIVAS vezes; depois disso, ou com
+        qualquer outro erro, o lote é gravado linha a linha e as linhas que
+        ainda falham são registradas no log e descartadas, para que um
+        registro inválido não prenda a única thread de escrita.
+        """
+        gravado = False
+        for tentativa in range(1, WRITE_BEHIND_MAX_TENTATIVAS + 1):
+            try:
+                database.inserir_triagens(lote)
+                gravado = True
+                break
+            except sqlite3.OperationalError as e:
+                print(f"Error writing triage batch ({len(lote)} rows, attempt {tentativa}): {e}")
+                if tentativa < WRITE_BEHIND_MAX_TENTATIVAS:
+                    time.sleep(WRITE_BEHIND_RETRY_SECONDS)
+            except Exception as e:
+                print(f"Error writing triage batch ({len(lote)} rows): {e}")
+                break
+        if not gravado:
+            self._gravar_linha_a_linha(lote)
+        with self._gravados:
+            for triagem in lote:
+                self._pendentes.pop(triagem["id"], None)
+            self._gravados.notify_all()
+
+    def _gravar_linha_a_linha(self, lote: List[Dict[str, Any]]) -> None:
+        for triagem in lote:
+            try:
+                database.inserir_triagens([triagem])
+            except Exception as e:
+                WRITE_BEHIND_DROPPED.inc()
+                print(f"Discarding triage {triagem['id']}: {e}")
+
+    def _run(self) -> None:
+        while True:
+            if self._stopping.is_set() and self._queue.empty():
+                return
+            primeiro = self._queue.get()
+            if primeiro is None:
+                continue
+            self._gravar(self._coletar(primeiro))
+
+
+fila = WriteBehindQueue()
+
+
+def batched() -> bool:
+    return PERSISTENCIA_MODO == "batched"
+
+
+def start() -> None:
+    if batched():
+        fila.start()
+
+
+def stop() -> None:
+    fila.stop()
+
+
+def persistir_triagem(sintomas: str, resposta: str, classificacao: str = "", justificativa: str = "", condutas: str = "", provisoria: bool = False) -> str:
+    """
+    Registra uma triagem para validação conforme PERSISTENCIA_MODO
+
+    Returns:
+        str: O id da triagem (já definitivo, mesmo antes da gravação no modo batched)
+    """
+    with metrics.stage("persistencia"):
+        if not batched():
+            return database.salvar_para_validacao(sintomas, resposta, classificacao, justificativa, condutas, provisoria)
+
+        triagem = database.nova_triagem(sintomas, resposta, classificacao, justificativa, condutas, provisoria)
+        fila.start()
+        fila.enqueue(triagem)
+        return triagem["id"]
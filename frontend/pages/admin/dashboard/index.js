@@ -8,6 +8,8 @@ export default function Dashboard() {
   const [activeMenu, setActiveMenu] = useState('dashboard');
   const [stats, setStats] = useState({ total: 0, validadas: 0, pendentes: 0 });
   const [triagens, setTriagens] = useState([]);
+  const [proximoCursor, setProximoCursor] = useState(null);
+  const [filtroAtual, setFiltroAtual] = useState('pendentes');
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [validatingTriagem, setValidatingTriagem] = useState(null);
@@ -28,6 +30,29 @@ export default function Dashboard() {
     fetchDashboardData();
   }, []);
 
+  // A API devolve as triagens em páginas; `proximo_cursor` aponta para a seguinte
+  const carregarTriagens = async (filtro, cursor = null) => {
+    const params = { filtro };
+    if (cursor) params.cursor = cursor;
+    const response = await axios.get('http://localhost:8000/api/triagens', { params });
+    setTriagens((atuais) => (cursor ? [...atuais, ...response.data.triagens] : response.data.triagens));
+    setProximoCursor(response.data.proximo_cursor || null);
+    setFiltroAtual(filtro);
+  };
+
+  const carregarMais = async () => {
+    if (!proximoCursor) return;
+    setLoading(true);
+    try {
+      await carregarTriagens(filtroAtual, proximoCursor);
+    } catch (err) {
+      console.error('Error loading more triages:', err);
+      setError('Erro ao carregar dados. Por favor, tente novamente.');
+    } finally {
+      setLoading(false);
+    }
+  };
+
   const fetchDashboardData = async () => {
     setLoading(true);
     try {
@@ -36,11 +61,9 @@ export default function Dashboard() {
       
       // Load triagens based on active menu
       if (activeMenu === 'dashboard' || activeMenu === 'pendentes') {
-        const triagensResponse = await axios.get('http://localhost:8000/api/triagens?filtro=pendentes');
-        setTriagens(triagensResponse.data.triagens);
+        await carregarTriagens('pendentes');
       } else if (activeMenu === 'todas') {
-        const triagensResponse = await axios.get('http://localhost:8000/api/triagens?filtro=todas');
-        setTriagens(triagensResponse.data.triagens);
+        await carregarTriagens('todas');
       }
     } catch (err) {
       console.error('Error fetching dashboard data:', err);
@@ -56,11 +79,9 @@ export default function Dashboard() {
     
     try {
       if (menu === 'pendentes') {
-        const response = await axios.get('http://localhost:8000/api/triagens?filtro=pendentes');
-        setTriagens(response.data.triagens);
+        await carregarTriagens('pendentes');
       } else if (menu === 'todas') {
-        const response = await axios.get('http://localhost:8000/api/triagens?filtro=todas');
-        setTriagens(response.data.triagens);
+        await carregarTriagens('todas');
       } else if (menu === 'dashboard') {
         await fetchDashboardData();
       }
@@ -357,6 +378,17 @@ export default function Dashboard() {
           ) : (
             <p>Nenhuma triagem encontrada.</p>
           )}
+
+          {proximoCursor && (
+            <button
+              className="button"
+              style={{ marginTop: '1rem' }}
+              onClick={carregarMais}
+              disabled={loading}
+            >
+              Carregar mais
+            </button>
+          )}
         </>
       );
     } else if (activeMenu === 'conhecimento') {
@@ -1,4 +1,4 @@
-import { useState } from 'react';
+import { useEffect, useState } from 'react';
 import Head from 'next/head';
 import Link from 'next/link';
 import axios from 'axios';
@@ -43,6 +43,36 @@ export default function Home() {
 
   // Função removida pois a triagem já é salva diretamente no handleSubmit
 
+  // Casos críticos reconhecidos pelas regras chegam com uma classificação
+  // provisória: consulta o registro até a análise completa substituí-la
+  useEffect(() => {
+    if (!result || !result.provisoria) return undefined;
+    let ativo = true;
+    let tentativas = 0;
+    let timer;
+    const consultar = async () => {
+      tentativas += 1;
+      try {
+        const response = await axios.get(`http://localhost:8000/api/triagens/${result.id}`);
+        if (!ativo) return;
+        if (!response.data.provisoria) {
+          setResult({ ...response.data, provisoria: false });
+          return;
+        }
+      } catch (err) {
+        console.error('Error polling provisional triage:', err);
+      }
+      if (ativo && tentativas < 90) {
+        timer = setTimeout(consultar, 2000);
+      }
+    };
+    timer = setTimeout(consultar, 2000);
+    return () => {
+      ativo = false;
+      clearTimeout(timer);
+    };
+  }, [result]);
+
   const getClassificationColor = (classification) => {
     const classLower = classification.toLowerCase();
     if (classLower === 'vermelho') return 'classification-red';
@@ -136,6 +166,12 @@ export default function Home() {
                 </h3>
               </div>
               
+              {result.provisoria && (
+                <div className="card card-warning" style={{ marginBottom: '1rem' }}>
+                  <p>⏳ Classificação provisória por critérios de risco. A análise clínica completa e as condutas estão sendo geradas e aparecerão aqui automaticamente.</p>
+                </div>
+              )}
+
               <div className="section">
                 <h3 className="section-title">Análise Clínica</h3>
                 <p>{result.justificativa}</p>